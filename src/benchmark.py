@@ -0,0 +1,211 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+import collections as col
+import numpy as np
+import pandas as pd
+
+import parser
+from rule_set import RuleSet
+
+#Numbers of rules of the rule sets timed when none are given
+DEFAULT_SCALES = [250,1000,4000]
+#Number of calls timed for the operations on one rule (connection, add_rule, delete_rule, update_val)
+DEFAULT_CALLS = 100
+#Relative slowdown above which an operation is reported as a regression by compare
+TOLERANCE = 0.25
+
+def generate(n, m=6, wildcards=0.3, width='uniform', mean_width=3.0, span=10.0, booleans=0.2, numbers=0.2, recs=3, seed=0):
+    ''' Returns a list of n random rules (ordered dictionnaries) with a recommendation and m-1 other attributes
+        @wildcards: probability that a value is unspecified (nan)
+        @width: distribution of the widths of the intervals, 'uniform' (in [0,2*mean_width]), 'exponential' or 'fixed'
+        @span: the left endpoints of the intervals are integers in [0,span), so that they often share endpoints
+        @booleans, numbers: fractions of the attributes holding booleans and floats, the others holding intervals
+        @recs: number of different recommendations
+    '''
+    if width not in ('uniform','exponential','fixed'):
+        raise ValueError("'width' must be 'uniform', 'exponential' or 'fixed'. width="+str(width))
+    rng = np.random.default_rng(seed)
+    kinds = rng.choice(['interval','bool','number'],size=m-1,p=[1-booleans-numbers,booleans,numbers])
+    closed = ['both','neither','left','right']
+    rules = []
+    for i in range(n):
+        rule = col.OrderedDict({'Rec': 'rec'+str(rng.integers(recs))})
+        for k, kind in enumerate(kinds):
+            if rng.random() < wildcards:
+                val = float('nan')
+            elif kind == 'bool':
+                val = bool(rng.integers(2))
+            elif kind == 'number':
+                val = float(rng.integers(span))
+            else:
+                left = float(rng.integers(span))
+                if width == 'uniform':
+                    size = rng.uniform(0,2*mean_width)
+                elif width == 'exponential':
+                    size = rng.exponential(mean_width)
+                else:
+                    size = mean_width
+                val = pd.Interval(left,left+round(size,1),closed[rng.integers(4)])
+            rule['A'+str(k)] = val
+        rules.append(rule)
+    return rules
+
+def _with_idm(rules, packed):
+    ruleset = RuleSet(rules,packed=packed)
+    ruleset.build_IDM()
+    return ruleset
+
+def _built(rules, packed):
+    ruleset = RuleSet(rules,packed=packed)
+    ruleset.build()
+    return ruleset
+
+def operations(rules, new_rules, csv_name, packed=False, calls=DEFAULT_CALLS, seed=0):
+    ''' Returns the timed operations on a rule set: list of (name, number of calls, setup, run),
+        setup() returning the state given to run(state), only run being measured
+        @new_rules: rules added by add_rule (with the same attributes as 'rules'), one per call
+    '''
+    rng = np.random.default_rng(seed)
+    n = len(rules)
+    m = len(rules[0])
+    pairs = rng.integers(n,size=(calls,2))
+    new_rules = [list(rule.values()) for rule in new_rules[:calls]]
+    deleted = [int(rng.integers(n-k)) for k in range(min(calls,n-2))]
+    updated = [(int(r),int(rng.integers(1,m))) for r in rng.integers(n,size=calls)]
+    def connections(ruleset):
+        for r1, r2 in pairs:
+            ruleset.connection(int(r1),int(r2))
+    def add(ruleset):
+        for rule in new_rules:
+            ruleset.add_rule(rule[0],rule[1:])
+    def delete(ruleset):
+        for rule in deleted:
+            ruleset.delete_rule(rule)
+    def update(ruleset):
+        for rule, attr in updated:
+            #value of the same attribute of another rule, so that it has the right kind
+            ruleset.update_val(rule,attr,ruleset.get_val((rule+1) % n,attr))
+    return [
+        ('to_csv',1,lambda: RuleSet(rules,packed=packed),lambda ruleset: ruleset.to_csv(csv_name)),
+        ('parse_csv',1,lambda: None,lambda state: parser.parse_csv(csv_name)),
+        ('parse_columns',1,lambda: None,lambda state: parser.parse_columns(csv_name)),
+        ('build_IDM',1,lambda: RuleSet(rules,packed=packed),lambda ruleset: ruleset.build_IDM()),
+        ('build_PM',1,lambda: _with_idm(rules,packed),lambda ruleset: ruleset.build_PM()),
+        ('connection',calls,lambda: _built(rules,packed),connections),
+        ('add_rule',calls,lambda: _built(rules,packed),add),
+        ('delete_rule',len(deleted),lambda: _built(rules,packed),delete),
+        ('update_val',calls,lambda: _built(rules,packed),update),
+    ]
+
+def measure(setup, run, repeat=3, memory=True):
+    ''' Returns the best time (seconds) of 'repeat' runs and the peak of memory allocated by one run (bytes, None if not 'memory')
+        The memory is measured in a separate run because tracing allocations slows them down
+    '''
+    best = float('inf')
+    for r in range(repeat):
+        state = setup()
+        start = time.perf_counter()
+        run(state)
+        best = min(best,time.perf_counter()-start)
+    peak = None
+    if memory:
+        state = setup()
+        tracemalloc.start()
+        try:
+            run(state)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return best, peak
+
+def run_benchmark(scales=DEFAULT_SCALES, packed=False, calls=DEFAULT_CALLS, repeat=3, memory=True, only=None, log=None, **parameters):
+    ''' Time the operations (see operations) on generated rule sets (see generate, which gets 'parameters') of each scale
+        @only: names of the operations to time, all if None
+        @log: function called with each result as it is measured (e.g. print)
+        Returns a dictionnary holding the environment, the parameters and a list of results
+        (n, operation, calls, seconds, peak_bytes), that can be written in json and compared with compare
+    '''
+    report = {'environment': environment(), 'parameters': dict(parameters,packed=packed,calls=calls,repeat=repeat), 'results': []}
+    with tempfile.TemporaryDirectory() as directory:
+        csv_name = os.path.join(directory,'rules.csv')
+        for n in scales:
+            rules = generate(n+calls,**parameters)
+            rules, new_rules = rules[:n], rules[n:]
+            RuleSet(rules).to_csv(csv_name) #read by parse_csv even if to_csv isn't timed
+            for name, number, setup, run in operations(rules,new_rules,csv_name,packed,calls):
+                if only is not None and name not in only:
+                    continue
+                seconds, peak = measure(setup,run,repeat,memory)
+                result = {'n': n, 'operation': name, 'calls': number, 'seconds': seconds, 'peak_bytes': peak}
+                report['results'].append(result)
+                if log is not None:
+                    log(result)
+    return report
+
+def environment():
+    ''' Versions and machine the benchmark was run with, and the git commit of the code if available '''
+    try:
+        commit = subprocess.run(['git','rev-parse','HEAD'],capture_output=True,text=True,cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'commit': commit or None, 'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'machine': platform.machine(), 'system': platform.system(), 'cpus': os.cpu_count()}
+
+def compare(baseline, report, tolerance=TOLERANCE):
+    ''' Returns the results of 'report' slower than the same operation at the same scale in 'baseline' by more than
+        'tolerance' (relative): list of (n, operation, baseline seconds, seconds)
+    '''
+    before = {(r['n'],r['operation']): r['seconds'] for r in baseline['results']}
+    slower = []
+    for r in report['results']:
+        old = before.get((r['n'],r['operation']))
+        if old is not None and r['seconds'] > old*(1+tolerance):
+            slower.append((r['n'],r['operation'],old,r['seconds']))
+    return slower
+
+def main(args=None):
+    arg_parser = argparse.ArgumentParser(description="Time the operations of RuleSet on generated rule sets")
+    arg_parser.add_argument('--scales',type=int,nargs='+',default=DEFAULT_SCALES,help="numbers of rules")
+    arg_parser.add_argument('--attributes',type=int,default=6,help="number of attributes, recommendation included")
+    arg_parser.add_argument('--wildcards',type=float,default=0.3)
+    arg_parser.add_argument('--width',choices=['uniform','exponential','fixed'],default='uniform')
+    arg_parser.add_argument('--mean-width',type=float,default=3.0)
+    arg_parser.add_argument('--booleans',type=float,default=0.2)
+    arg_parser.add_argument('--numbers',type=float,default=0.2)
+    arg_parser.add_argument('--recs',type=int,default=3,help="number of different recommendations")
+    arg_parser.add_argument('--seed',type=int,default=0)
+    arg_parser.add_argument('--packed',action='store_true')
+    arg_parser.add_argument('--calls',type=int,default=DEFAULT_CALLS)
+    arg_parser.add_argument('--repeat',type=int,default=3)
+    arg_parser.add_argument('--no-memory',action='store_true',help="don't measure the peak memory")
+    arg_parser.add_argument('--only',nargs='+',help="names of the operations to time")
+    arg_parser.add_argument('--output',help="json file in which the results are written")
+    arg_parser.add_argument('--baseline',help="json file of previous results, exits with status 1 if an operation got slower")
+    arg_parser.add_argument('--tolerance',type=float,default=TOLERANCE)
+    options = arg_parser.parse_args(args)
+    def log(result):
+        peak = '' if result['peak_bytes'] is None else '%10.1f MB' % (result['peak_bytes']/2**20)
+        print('%8d %-14s %10.4f s %s' % (result['n'],result['operation'],result['seconds'],peak))
+    report = run_benchmark(options.scales,options.packed,options.calls,options.repeat,not options.no_memory,options.only,log,
+                           m=options.attributes,wildcards=options.wildcards,width=options.width,mean_width=options.mean_width,
+                           booleans=options.booleans,numbers=options.numbers,recs=options.recs,seed=options.seed)
+    if options.output is not None:
+        with open(options.output,'w') as f:
+            json.dump(report,f,indent=1)
+    if options.baseline is not None:
+        with open(options.baseline) as f:
+            slower = compare(json.load(f),report,options.tolerance)
+        for n, name, old, new in slower:
+            print('slower: %d %s %.4f s -> %.4f s' % (n,name,old,new))
+        return 1 if slower else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
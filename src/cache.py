@@ -0,0 +1,78 @@
+import os
+import re
+import hashlib
+import numpy as np
+
+import columns
+from relation import *
+from connection import *
+
+#Directory of the cache when none is given
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser('~'),'.cache','relationship-identification-tool')
+#Total size of the files of the cache above which the least recently used ones are deleted
+DEFAULT_MAX_BYTES = 1 << 30
+#Names of the files of the cache: v<SEMANTICS_VERSION>-<key>.npz, other files of the directory are never deleted
+FILE_NAME = re.compile(r'v(\d+)-[0-9a-f]{64}\.npz')
+
+class Cache:
+    ''' Local directory storing the idm and pm of rule sets in .npz files named after a hash of their content
+        (see key), so that reopening an unchanged rule set doesn't recompute them.
+        Files are evicted in least recently used order when their total size exceeds max_bytes.
+        Files of the cache (see FILE_NAME) written with another SEMANTICS_VERSION are deleted when the cache is opened.
+    '''
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory,exist_ok=True)
+        for file_name in os.listdir(directory):
+            match = FILE_NAME.fullmatch(file_name)
+            if match and int(match.group(1)) != SEMANTICS_VERSION:
+                os.remove(os.path.join(directory,file_name))
+
+    def _prefix(self):
+        return 'v'+str(SEMANTICS_VERSION)+'-'
+
+    def key(self, cols, packed):
+        ''' Key of the matrices of the rules held by 'cols' (typed columns, the recommendation first), which depends
+            on their values, the layout and the format of the matrices but not on the names of the attributes
+        '''
+        h = hashlib.sha256()
+        h.update(columns.fingerprint(cols).encode())
+        h.update(repr((packed,[rel.value for rel in PM_RELATIONS],np.dtype(PM_DTYPE).str)).encode())
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory,self._prefix()+key+'.npz')
+
+    def get(self, key):
+        ''' Returns the arrays (idm, pm) stored with 'key', None if there are none '''
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                idm, pm = data['idm'], data['pm']
+        except (OSError, KeyError, ValueError):
+            return None
+        os.utime(path) #most recently used
+        return idm, pm
+
+    def put(self, key, idm, pm):
+        ''' Store the arrays idm and pm with 'key' and evict the least recently used files if the cache is too large '''
+        path = self.path(key)
+        tmp = path + '.tmp'
+        with open(tmp,'wb') as f:
+            np.savez(f,idm=idm,pm=pm)
+        os.replace(tmp,path) #readers never see a partially written file
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for file_name in os.listdir(self.directory):
+            if FILE_NAME.fullmatch(file_name):
+                stat = os.stat(os.path.join(self.directory,file_name))
+                entries.append((stat.st_mtime,stat.st_size,file_name))
+        total = sum(size for mtime, size, file_name in entries)
+        for mtime, size, file_name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory,file_name))
+            total -= size
@@ -0,0 +1,298 @@
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+import parser
+import sparse
+import profiling
+import rulefile
+from cache import Cache
+from rule_set import RuleSet
+from layout import DENSE, PACKED
+from connection import *
+
+#Engines computing the connections: idm and pm in memory (dense or packed), in files (mapped) or sparse graph only
+ENGINES = ['auto','dense','packed','mapped','sparse']
+REPORTS = ['counts','conflicts','clusters','matrix','redundancy']
+FORMATS = ['csv','jsonl','binary']
+#Connections counted for each rule by the 'counts' report
+COUNTED = [c for c in CONNECTIONS if c not in (Connection.ERROR,Connection.REFERENCE)]
+#Units accepted by --memory-limit
+UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+def parse_size(text):
+    ''' Returns the number of bytes of a size such as '512M' or '2G' (powers of 1024), raises a ValueError if it isn't one '''
+    text = text.strip().upper().rstrip('B')
+    unit = text[-1:] if text[-1:] in UNITS else ''
+    try:
+        value = float(text[:len(text)-len(unit)])
+    except ValueError:
+        raise ValueError("Size must be a number followed by an optional unit K, M, G or T. size="+text)
+    return int(value*UNITS[unit])
+
+def matrices_bytes(layout, n, m):
+    ''' Number of bytes of the idm and pm of n rules with m attributes with 'layout' '''
+    return int(np.prod(layout.shape(n)))*(m*np.dtype(np.int8).itemsize + PM_ROWS*np.dtype(PM_DTYPE).itemsize)
+
+def available_memory():
+    ''' Bytes of memory available for new allocations (MemAvailable on Linux, free pages otherwise),
+        None if it can't be known
+    '''
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) << 10
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES')*os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def free_disk(directory):
+    ''' Free bytes of the disk holding 'directory', or its closest existing parent if it doesn't exist yet '''
+    directory = os.path.abspath(directory)
+    while not os.path.isdir(directory) and os.path.dirname(directory) != directory:
+        directory = os.path.dirname(directory)
+    return shutil.disk_usage(directory).free
+
+def choose_engine(engine, n, m, memory_limit=None, disk=None):
+    ''' Returns the engine to use for n rules with m attributes: 'engine' itself unless it is 'auto', in which case
+        the first of dense and packed whose idm and pm fit in 'memory_limit' (bytes, the available memory if None) is chosen,
+        then mapped if its files fit in 'disk' (free bytes of its directory, mapped isn't considered if None), then sparse.
+        Raises a ValueError if the idm and pm of an in-memory engine don't fit in memory_limit.
+    '''
+    if engine == 'auto':
+        limit = memory_limit if memory_limit is not None else available_memory()
+        for engine, layout in [('dense',DENSE),('packed',PACKED)]:
+            if limit is None or matrices_bytes(layout,n,m) <= limit:
+                return engine
+        if disk is not None and matrices_bytes(PACKED,n,m) <= disk:
+            return 'mapped'
+        return 'sparse'
+    if engine in ('dense','packed') and memory_limit is not None:
+        needed = matrices_bytes(DENSE if engine == 'dense' else PACKED,n,m)
+        if needed > memory_limit:
+            raise ValueError("The matrices of engine '"+engine+"' need "+str(needed)+" bytes, more than the memory limit ("
+                             +str(memory_limit)+"). Use engine 'mapped' or 'sparse'.")
+    return engine
+
+def load(file_name, directory=None, packed=False):
+    ''' Returns the RuleSet of a rule set file (see rulefile) or of a csv file '''
+    if file_name.endswith(rulefile.EXTENSION):
+        ruleset = RuleSet.load(file_name,directory)
+        if ruleset.layout.packed != packed:
+            ruleset = RuleSet.from_store(ruleset.store,packed,directory)
+        return ruleset
+    return RuleSet.from_store(parser.parse_columns(file_name),packed,directory)
+
+def connections(ruleset, engine, workers=1, cache=None):
+    ''' Returns the ConnectionGraph of a rule set computed by 'engine' (not 'auto') '''
+    if engine == 'sparse':
+        return ruleset.connection_graph()
+    if not ruleset.built or cache is not None:
+        ruleset.build(workers,cache)
+    if ruleset.n < 2:
+        return sparse.graph_from_pm(np.zeros((PM_ROWS,)+ruleset.layout.shape(ruleset.n),dtype=PM_DTYPE),ruleset.layout,ruleset.n)
+    return sparse.graph_from_pm(ruleset.pm,ruleset.layout,ruleset.n)
+
+def rule_counts(graph):
+    ''' Returns the number of connections of each kind of COUNTED of every rule (n x len(COUNTED) array) '''
+    counts = np.zeros((graph.n,len(CONNECTIONS)),dtype=np.int64)
+    np.add.at(counts,(graph.rows,graph.codes),1)
+    np.add.at(counts,(graph.cols,graph.codes),1)
+    counts[:,CODES[Connection.DISCONNECTED]] = max(graph.n-1,0) - counts.sum(axis=1)
+    return counts[:,[CODES[c] for c in COUNTED]]
+
+def conflicts(graph):
+    ''' Returns the pairs (rows, cols, codes) of the graph whose connection is one of CONFLICTS '''
+    keep = np.isin(graph.codes,[CODES[c] for c in CONFLICTS])
+    return graph.rows[keep], graph.cols[keep], graph.codes[keep]
+
+def matrix_rows(graph, tile=1024):
+    ''' Yields (start, codes) blocks of rows of the full n x n matrix of connection codes (REFERENCE on the diagonal) '''
+    for start in range(0,graph.n,tile):
+        stop = min(start+tile,graph.n)
+        block = np.full((stop-start,graph.n),CODES[Connection.DISCONNECTED],dtype=np.int8)
+        lo, hi = graph.indptr[start], graph.indptr[stop]
+        block_rows = np.repeat(np.arange(stop-start),np.diff(graph.indptr[start:stop+1]))
+        block[block_rows,graph.indices[lo:hi]] = graph.neighbour_codes[lo:hi]
+        block[np.arange(stop-start),np.arange(start,stop)] = CODES[Connection.REFERENCE]
+        yield start, block
+
+def _writer(path, header, fmt):
+    ''' Returns a function writing one row (list of values) in a csv or jsonl file and the file to close '''
+    f = open(path,'w',newline='')
+    if fmt == 'csv':
+        writer = csv.writer(f)
+        writer.writerow(header)
+        return writer.writerow, f
+    return lambda row: f.write(json.dumps(dict(zip(header,row)))+'\n'), f
+
+def write_reports(graph, ruleset, reports, fmt, prefix, subsumed=None):
+    ''' Write the reports of a rule set in files named prefix + '.' + report + extension, returns their paths
+        @subsumed: redundancy.Subsumptions written by the 'redundancy' report, the ones of 'ruleset' if None
+    '''
+    paths = []
+    extension = {'csv': '.csv', 'jsonl': '.jsonl', 'binary': '.npy'}[fmt]
+    recs = ruleset.store.cols[0] if ruleset.m > 0 else None
+    for report in reports:
+        path = prefix+'.'+report+extension
+        paths.append(path)
+        if report == 'counts':
+            counts = rule_counts(graph)
+            if fmt == 'binary':
+                np.save(path,counts)
+                continue
+            write, f = _writer(path,['rule','rec']+[c.value for c in COUNTED],fmt)
+            with f:
+                for rule in range(graph.n):
+                    write([rule,recs.get(rule)]+[int(v) for v in counts[rule]])
+        elif report == 'conflicts':
+            rows, cols, codes = conflicts(graph)
+            if fmt == 'binary':
+                pairs = np.zeros(len(codes),dtype=[('rule1',np.int64),('rule2',np.int64),('code',np.int8)])
+                pairs['rule1'], pairs['rule2'], pairs['code'] = rows, cols, codes
+                np.save(path,pairs)
+                continue
+            write, f = _writer(path,['rule1','rule2','connection'],fmt)
+            with f:
+                for r1, r2, code in zip(rows.tolist(),cols.tolist(),codes.tolist()):
+                    write([r1,r2,CONNECTIONS[code].value])
+        elif report == 'clusters':
+            #groups of at least two rules linked by conflicting connections
+            groups = sparse.clusters(graph,recs,CONFLICTS) if graph.n > 0 else []
+            if fmt == 'binary':
+                labels = np.full(graph.n,-1,dtype=np.int64)
+                for k, cluster in enumerate(groups):
+                    labels[cluster.rules] = k
+                np.save(path,labels)
+                continue
+            write, f = _writer(path,['cluster','size','recommendations','rules'],fmt)
+            with f:
+                for k, cluster in enumerate(groups):
+                    recommendations = {str(rec): count for rec, count in cluster.recommendations.items()}
+                    rules = cluster.rules.tolist()
+                    if fmt == 'csv':
+                        write([k,cluster.size,json.dumps(recommendations),' '.join(map(str,rules))])
+                    else:
+                        write([k,cluster.size,recommendations,rules])
+        elif report == 'redundancy':
+            #rules subsumed by another rule with the same recommendation
+            if subsumed is None:
+                subsumed = ruleset.subsumptions()
+            if fmt == 'binary':
+                pairs = np.zeros(len(subsumed),dtype=[('rule',np.int64),('by',np.int64),('equal',bool)])
+                pairs['rule'], pairs['by'], pairs['equal'] = subsumed.rules, subsumed.by, subsumed.equal
+                np.save(path,pairs)
+                continue
+            write, f = _writer(path,['rule','by','connection'],fmt)
+            with f:
+                for rule, by, equal in zip(subsumed.rules.tolist(),subsumed.by.tolist(),subsumed.equal.tolist()):
+                    write([rule,by,(Connection.EQUAL_SAME if equal else Connection.INCLUSION_SAME).value])
+        else:
+            if fmt == 'binary':
+                out = np.lib.format.open_memmap(path,mode='w+',dtype=np.int8,shape=(graph.n,graph.n))
+                for start, block in matrix_rows(graph):
+                    out[start:start+len(block)] = block
+                out.flush()
+                del out
+                continue
+            #the codes are the indexes of the connections in the legend of the summary
+            write, f = _writer(path,['rule']+[str(j) for j in range(graph.n)] if fmt == 'csv' else ['rule','codes'],fmt)
+            with f:
+                for start, block in matrix_rows(graph):
+                    for k, row in enumerate(block.tolist()):
+                        write([start+k]+row if fmt == 'csv' else [start+k,row])
+    return paths
+
+def analyse(file_name, options):
+    ''' Compute the connections of the rules of one file and write its reports, returns its summary '''
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp:
+        packed = options.engine in ('packed','mapped')
+        directory = None
+        if options.engine == 'mapped':
+            directory = options.directory or tmp
+        ruleset = load(file_name,directory,packed)
+        stem = os.path.splitext(os.path.basename(file_name))[0]
+        prefix = os.path.join(options.output,stem)
+        subsumed = ruleset.subsumptions() if options.prune or 'redundancy' in options.reports else None
+        pruned = None
+        if options.prune:
+            #the connections are computed on the rule set without its redundant rules, written next to the reports
+            #in its own directory, whose file names would collide with the ones of the storage of the whole rule set
+            ruleset = ruleset.pruned(directory=None if directory is None else os.path.join(directory,'pruned'))
+            pruned = prefix+'.pruned'+(rulefile.EXTENSION if options.format == 'binary' else '.csv')
+            if options.format == 'binary':
+                ruleset.save(pruned)
+            else:
+                ruleset.to_csv(pruned)
+        engine = choose_engine(options.engine,ruleset.n,ruleset.m,options.memory_limit,free_disk(options.directory or tmp))
+        if engine != options.engine and engine in ('packed','mapped'):
+            ruleset = RuleSet.from_store(ruleset.store,True,(options.directory or tmp) if engine == 'mapped' else None)
+        cache = Cache(options.cache) if options.cache is not None and engine != 'sparse' else None
+        graph = connections(ruleset,engine,options.workers,cache)
+        paths = write_reports(graph,ruleset,options.reports,options.format,prefix,subsumed)
+        totals = count_connections(graph.codes)
+        totals[Connection.DISCONNECTED] = ruleset.n*(ruleset.n-1)//2 - len(graph)
+    summary = {'file': file_name, 'rules': ruleset.n, 'attributes': ruleset.m, 'engine': engine, 'workers': options.workers,
+               'seconds': time.perf_counter()-start, 'pairs': {c.value: totals[c] for c in COUNTED},
+               'conflicts': sum(totals[c] for c in CONFLICTS), 'reports': paths,
+               'legend': {int(CODES[c]): c.value for c in CONNECTIONS}}
+    if subsumed is not None:
+        summary['redundant'] = len(subsumed.redundant)
+        summary['pruned'] = pruned
+    with open(prefix+'.summary.json','w') as f:
+        json.dump(summary,f,indent=1)
+    return summary
+
+def main(args=None):
+    arg_parser = argparse.ArgumentParser(description="Compute the connections between the rules of csv or "+rulefile.EXTENSION
+                                         +" files and write reports, without the graphical interface")
+    arg_parser.add_argument('files',nargs='+',help="rule files (csv or "+rulefile.EXTENSION+")")
+    arg_parser.add_argument('--engine',choices=ENGINES,default='auto',
+                            help="dense or packed: idm and pm in memory, mapped: idm and pm in files (see --directory), "
+                                 "sparse: connected pairs only, auto: dense or packed if they fit in --memory-limit (the available memory "
+                                 "if not given), otherwise mapped if its files fit on the disk, otherwise sparse")
+    arg_parser.add_argument('--reports',choices=REPORTS,nargs='+',default=['counts','conflicts'],
+                            help="counts: connections of each kind per rule, conflicts: pairs of "
+                                 "rules with different recommendations that can apply together, clusters: groups of rules linked by conflicts, "
+                                 "matrix: code of every pair, redundancy: rules subsumed by another rule with the same recommendation")
+    arg_parser.add_argument('--prune',action='store_true',
+                            help="remove the redundant rules (see --reports redundancy) before computing the connections, the other "
+                                 "reports numbering the rules of the pruned rule set, written in <file>.pruned.csv (.rset if --format binary)")
+    arg_parser.add_argument('--format',choices=FORMATS,default='csv',help="format of the reports (binary: .npy arrays)")
+    arg_parser.add_argument('--output',default='.',help="directory of the reports")
+    arg_parser.add_argument('--workers',type=int,default=1,help="number of processes building idm and pm (0: all the cores)")
+    arg_parser.add_argument('--memory-limit',type=parse_size,help="maximal size of idm and pm in memory, e.g. 4G")
+    arg_parser.add_argument('--directory',help="directory of the files of engine 'mapped' (temporary if not given)")
+    arg_parser.add_argument('--cache',help="cache directory of idm and pm (see cache.Cache)")
+    arg_parser.add_argument('--profile',help="json file in which the time spent in each operation is written (see profiling)")
+    options = arg_parser.parse_args(args)
+    options.workers = None if options.workers == 0 else options.workers
+    if options.profile is not None:
+        profiling.enable()
+    os.makedirs(options.output,exist_ok=True)
+    status = 0
+    for file_name in options.files:
+        try:
+            summary = analyse(file_name,options)
+            print(file_name+': '+str(summary['rules'])+' rules, '+str(summary['conflicts'])+' conflicting pairs ('
+                  +summary['engine']+', %.2f s)' % summary['seconds'])
+        except (OSError, ValueError, TypeError) as e:
+            print(file_name+': '+str(e),file=sys.stderr)
+            status = 1
+    if options.profile is not None:
+        profiling.dump(options.profile)
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
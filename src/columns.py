@@ -0,0 +1,364 @@
+import hashlib
+import numpy as np
+import pandas as pd
+
+#Kinds of attributes
+INTERVAL = 'interval'
+BOOL = 'bool'
+NUMBER = 'number'
+CATEGORY = 'category' #recommendations and any other hashable value (strings)
+EMPTY = 'empty' #column without any specified value (type not known yet)
+
+#Bits used to encode the closedness of an interval
+CLOSED_LEFT = 1
+CLOSED_RIGHT = 2
+CLOSED_FLAGS = {'neither': 0, 'left': CLOSED_LEFT, 'right': CLOSED_RIGHT, 'both': CLOSED_LEFT | CLOSED_RIGHT}
+CLOSED_NAMES = {v: k for k, v in CLOSED_FLAGS.items()}
+
+#Factor by which the capacity of a column grows when a value is appended to a full column
+GROWTH = 2
+
+def is_na(val):
+    ''' True if 'val' is an unspecified value (nan or None) '''
+    return not isinstance(val,pd.Interval) and pd.isna(val)
+
+def value_kind(val):
+    ''' Returns the kind of a single value that is not nan '''
+    if isinstance(val,pd.Interval):
+        return INTERVAL
+    elif isinstance(val,(bool,np.bool_)):
+        return BOOL
+    elif isinstance(val,(int,float,np.integer,np.floating)):
+        return NUMBER
+    else:
+        return CATEGORY
+
+def _field(name):
+    ''' Property giving the view of the buffer 'name' that holds the values of the rules (unused capacity excluded) '''
+    return property(lambda self: self._buffers[name][:self.size])
+
+class Column:
+    ''' Values of one attribute stored in typed numpy arrays
+        Subclasses give the names, dtypes and missing value sentinels of their arrays in _fields, _dtypes and _missing
+        and are used directly by the IDC kernel through the attributes 'na' and 'keys' (or left/right/closed for intervals)
+        The arrays are views of buffers that may be larger (capacity) so that appending values is amortized O(1)
+    '''
+    kind = None
+    _fields = ()
+    _dtypes = ()
+    _missing = ()
+
+    def __init__(self, *arrays):
+        self._buffers = dict(zip(self._fields,arrays))
+        self.size = len(arrays[0])
+
+    @classmethod
+    def empty(cls, n):
+        ''' Returns a column of n unspecified values '''
+        return cls(*[np.full(n,miss,dtype=dt) for dt, miss in zip(cls._dtypes,cls._missing)])
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def capacity(self):
+        return len(self._buffers[self._fields[0]])
+
+    @property
+    def nbytes(self):
+        return sum(buffer.nbytes for buffer in self._buffers.values())
+
+    def take(self, idx):
+        ''' Returns a new column holding the values at indexes 'idx' (int array or boolean mask) '''
+        return self._like(*[getattr(self,field)[idx] for field in self._fields])
+
+    def reserve(self, capacity):
+        ''' Grow the buffers so that they can hold 'capacity' values '''
+        if capacity > self.capacity:
+            for field, dt, miss in zip(self._fields,self._dtypes,self._missing):
+                buffer = np.full(capacity,miss,dtype=dt)
+                buffer[:self.size] = getattr(self,field)
+                self._buffers[field] = buffer
+
+    def append(self, val):
+        ''' Add value 'val' at the end of the column, the capacity growing geometrically when it is full '''
+        self.check(val)
+        if self.size == self.capacity:
+            self.reserve(max(GROWTH*self.capacity,4))
+        self.size += 1
+        self.set(self.size-1,val)
+
+    def extend(self, other):
+        ''' Add the values of column 'other' (same kind) at the end of the column '''
+        if self.size + len(other) > self.capacity:
+            self.reserve(max(GROWTH*self.capacity,self.size+len(other)))
+        for field, values in zip(self._fields,self._values_of(other)):
+            self._buffers[field][self.size:self.size+len(other)] = values
+        self.size += len(other)
+
+    def _values_of(self, other):
+        return [getattr(other,field) for field in self._fields]
+
+    def _like(self, *arrays):
+        return type(self)(*arrays)
+
+    def check(self, val):
+        ''' Raises a TypeError if 'val' can't be stored in this column '''
+        if not is_na(val) and value_kind(val) != self.kind:
+            raise TypeError("Value "+str(val)+" of type "+str(type(val))+" can't be stored in an attribute of kind '"+self.kind+"'.")
+
+    def set(self, i, val):
+        self.check(val)
+        if is_na(val):
+            for field, miss in zip(self._fields,self._missing):
+                getattr(self,field)[i] = miss
+        else:
+            self._store(i,val)
+
+    def get(self, i):
+        if self.na[i]:
+            return float('nan')
+        return self._load(i)
+
+    def to_objects(self):
+        ''' Returns the values as a numpy array with the dtype pandas would have given them '''
+        return np.array([self.get(i) for i in range(len(self))],dtype=object)
+
+class IntervalColumn(Column):
+    ''' Intervals stored as float64 endpoints and closedness flags, nan endpoints for unspecified values '''
+    kind = INTERVAL
+    _fields = ('left','right','closed')
+    _dtypes = (np.float64,np.float64,np.uint8)
+    _missing = (np.nan,np.nan,0)
+    left = _field('left')
+    right = _field('right')
+    closed = _field('closed')
+
+    @property
+    def na(self):
+        return np.isnan(self.left)
+
+    def _store(self, i, val):
+        self.left[i] = val.left
+        self.right[i] = val.right
+        self.closed[i] = CLOSED_FLAGS[val.closed]
+
+    def _load(self, i):
+        return pd.Interval(float(self.left[i]),float(self.right[i]),CLOSED_NAMES[int(self.closed[i])])
+
+class BoolColumn(Column):
+    ''' Booleans stored as int8 with -1 for unspecified values '''
+    kind = BOOL
+    _fields = ('values',)
+    _dtypes = (np.int8,)
+    _missing = (-1,)
+    values = _field('values')
+
+    @property
+    def na(self):
+        return self.values < 0
+
+    @property
+    def keys(self):
+        return self.values
+
+    def _store(self, i, val):
+        self.values[i] = bool(val)
+
+    def _load(self, i):
+        return bool(self.values[i])
+
+    def to_objects(self):
+        if self.na.any():
+            return super().to_objects()
+        return self.values.astype(bool)
+
+class NumberColumn(Column):
+    ''' Numbers stored as float64 with nan for unspecified values '''
+    kind = NUMBER
+    _fields = ('values',)
+    _dtypes = (np.float64,)
+    _missing = (np.nan,)
+    values = _field('values')
+
+    @property
+    def na(self):
+        return np.isnan(self.values)
+
+    @property
+    def keys(self):
+        return self.values
+
+    def _store(self, i, val):
+        self.values[i] = val
+
+    def _load(self, i):
+        return float(self.values[i])
+
+    def to_objects(self):
+        return self.values.copy()
+
+class EmptyColumn(NumberColumn):
+    ''' Column in which no value has been specified yet, its kind is given by the first value stored in it '''
+    kind = EMPTY
+
+    def check(self, val):
+        pass
+
+class CategoryColumn(Column):
+    ''' Hashable values (e.g. recommendations) stored as int32 codes into a list of categories, -1 for unspecified values '''
+    kind = CATEGORY
+    _fields = ('codes',)
+    _dtypes = (np.int32,)
+    _missing = (-1,)
+    codes = _field('codes')
+
+    def __init__(self, codes, categories=None):
+        super().__init__(codes)
+        self.categories = [] if categories is None else categories
+        self._index = {c: k for k, c in enumerate(self.categories)}
+
+    def _like(self, codes):
+        return CategoryColumn(codes,list(self.categories))
+
+    def _values_of(self, other):
+        #codes of the other column translated to the categories of this one
+        mapping = np.array([self.code(c) for c in other.categories]+[-1],dtype=np.int32)
+        return [mapping[other.codes]]
+
+    @property
+    def na(self):
+        return self.codes < 0
+
+    @property
+    def keys(self):
+        return self.codes
+
+    def code(self, val):
+        ''' Returns the code of category 'val', adding it to the categories if needed '''
+        if val not in self._index:
+            self._index[val] = len(self.categories)
+            self.categories.append(val)
+        return self._index[val]
+
+    def _store(self, i, val):
+        self.codes[i] = self.code(val)
+
+    def _load(self, i):
+        return self.categories[self.codes[i]]
+
+COLUMN_TYPES = {INTERVAL: IntervalColumn, BOOL: BoolColumn, NUMBER: NumberColumn, CATEGORY: CategoryColumn, EMPTY: EmptyColumn}
+
+def encode_column(values):
+    ''' Store a sequence of values (list, numpy array or pandas.Series) in a column of the appropriate kind
+        Raises a TypeError if the values that are not nan don't all have the same kind
+    '''
+    values = list(values)
+    kind = EMPTY
+    for i in range(len(values)):
+        if not is_na(values[i]):
+            val_kind = value_kind(values[i])
+            if kind == EMPTY:
+                kind = val_kind
+            elif val_kind != kind:
+                raise TypeError("All values of an attribute should have the same type when they are not NaN. Value at position "+str(i)+": "+str(type(values[i]))+str(values[i]))
+    col = COLUMN_TYPES[kind].empty(len(values))
+    for i in range(len(values)):
+        if not is_na(values[i]):
+            col._store(i,values[i])
+    return col
+
+def fingerprint(cols):
+    ''' Hash (hex string) of the kinds and values of a list of columns '''
+    h = hashlib.sha256()
+    h.update(repr([c.kind for c in cols]).encode())
+    for c in cols:
+        for field in c._fields:
+            h.update(np.ascontiguousarray(getattr(c,field)).tobytes())
+        if c.kind == CATEGORY:
+            h.update(repr(c.categories).encode())
+    return h.hexdigest()
+
+class ColumnStore:
+    ''' Rules stored by attribute, each attribute being a typed Column '''
+    def __init__(self, names=None, cols=None):
+        self.names = [] if names is None else names
+        self.cols = [] if cols is None else cols
+
+    @classmethod
+    def from_rules(cls, rules_list):
+        ''' @rules_list: list of dictionnaries each representing a rule with their attributes as keys
+            Attributes are ordered by first appearance, missing attributes are unspecified values
+        '''
+        names = []
+        for rule in rules_list:
+            for key in rule:
+                if key not in names:
+                    names.append(key)
+        cols = [encode_column([rule.get(name,float('nan')) for rule in rules_list]) for name in names]
+        return cls(names,cols)
+
+    @property
+    def n(self):
+        return len(self.cols[0]) if len(self.cols) > 0 else 0
+
+    @property
+    def nbytes(self):
+        return sum(col.nbytes for col in self.cols)
+
+    def get(self, rule, attr):
+        return self.cols[attr].get(rule)
+
+    def set(self, rule, attr, val):
+        ''' Set value of 'rule' for attribute 'attr' (indexes), raises a TypeError if its kind doesn't match the column '''
+        col = self.cols[attr]
+        if col.kind == EMPTY and not is_na(val):
+            col = COLUMN_TYPES[value_kind(val)].empty(len(col))
+            self.cols[attr] = col
+        col.set(rule,val)
+
+    def add_column(self, name, col):
+        self.names = self.names + [name]
+        self.cols = self.cols + [col]
+
+    def delete_column(self, attr):
+        self.names = self.names[:attr] + self.names[attr+1:]
+        self.cols = self.cols[:attr] + self.cols[attr+1:]
+
+    def append_row(self, values):
+        ''' Add a rule with one value per attribute, nothing is changed if a value has an inadequate type '''
+        for col, val in zip(self.cols,values):
+            col.check(val)
+        for k, val in enumerate(values):
+            if self.cols[k].kind == EMPTY and not is_na(val):
+                self.cols[k] = COLUMN_TYPES[value_kind(val)].empty(len(self.cols[k]))
+            self.cols[k].append(val)
+
+    def append_store(self, other):
+        ''' Add the rules of ColumnStore 'other' at the end, its attributes being matched by name
+            (attributes it doesn't have are unspecified). Nothing is changed if an error is raised:
+            ValueError if it has unknown attributes, TypeError if the kind of one of its columns doesn't match.
+        '''
+        unknown = [name for name in other.names if name not in self.names]
+        if len(unknown) > 0:
+            raise ValueError("The rules added have unknown attributes: "+str(unknown))
+        cols = []
+        for name, col in zip(self.names,self.cols):
+            new = other.cols[other.names.index(name)] if name in other.names else EmptyColumn.empty(other.n)
+            if new.kind != EMPTY and col.kind != EMPTY and new.kind != col.kind:
+                raise TypeError("Values of kind '"+new.kind+"' can't be added to attribute "+str(name)+" of kind '"+col.kind+"'.")
+            cols.append(new)
+        for k, new in enumerate(cols):
+            if self.cols[k].kind == EMPTY and new.kind != EMPTY:
+                self.cols[k] = COLUMN_TYPES[new.kind].empty(len(self.cols[k]))
+            if new.kind == EMPTY:
+                new = COLUMN_TYPES[self.cols[k].kind].empty(len(new))
+            self.cols[k].extend(new)
+
+    def delete_row(self, rule):
+        keep = np.ones(self.n,dtype=bool)
+        keep[rule] = False
+        self.cols = [col.take(keep) for col in self.cols]
+
+    def to_dataframe(self):
+        return pd.DataFrame({name: col.to_objects() for name, col in zip(self.names,self.cols)},columns=self.names,index=range(self.n))
@@ -1,4 +1,7 @@
 from enum import Enum
+import numpy as np
+
+from relation import *
 
 class Connection(Enum):
     DISCONNECTED = "disconnected"
@@ -9,4 +12,45 @@ class Connection(Enum):
     OVERLAP_DIFF = "cover overlap"
     OVERLAP_SAME = "rule overlap"
     ERROR = "must build pm matrix"
-    REFERENCE = "reference"
\ No newline at end of file
+    REFERENCE = "reference"
+
+#Connections in the order of their int8 codes (code = index in this list), used by vectorized methods
+CONNECTIONS = list(Connection)
+CODES = {c: np.int8(k) for k, c in enumerate(CONNECTIONS)}
+
+#Relations counted in the PM for every pair of rules (over all attributes but the recommendation)
+PM_RELATIONS = [Relation.DIFFERENCE, Relation.INCLUSION_IJ, Relation.INCLUSION_JI, Relation.OVERLAP]
+PM_DIFF_REC = len(PM_RELATIONS) #row of the PM that is 1 when the recommendations of the pair differ
+PM_ROWS = PM_DIFF_REC + 1
+PM_DTYPE = np.uint16 #bounds the number of attributes to 65535
+
+def classify(counts):
+    ''' Returns the codes of the connections given by PM counters
+        @counts: array of shape (PM_ROWS, ...) with the counters of one or many pairs of rules
+    '''
+    diff, incl_ij, incl_ji, overlap, diff_rec = (np.asarray(c) for c in counts)
+    diff_rec = diff_rec != 0
+    conditions = [diff > 0,
+                  (overlap > 0) | ((incl_ij > 0) & (incl_ji > 0)),
+                  (incl_ij > 0) | (incl_ji > 0)]
+    choices = [CODES[Connection.DISCONNECTED],
+               np.where(diff_rec,CODES[Connection.OVERLAP_DIFF],CODES[Connection.OVERLAP_SAME]),
+               np.where(diff_rec,CODES[Connection.INCLUSION_DIFF],CODES[Connection.INCLUSION_SAME])]
+    default = np.where(diff_rec,CODES[Connection.EQUAL_DIFF],CODES[Connection.EQUAL_SAME])
+    return np.select(conditions,choices,default=default).astype(np.int8)
+
+#Connections between rules with different recommendations that can apply to the same situation
+CONFLICTS = [Connection.EQUAL_DIFF, Connection.INCLUSION_DIFF, Connection.OVERLAP_DIFF]
+
+def count_connections(codes):
+    ''' Returns a dictionnary giving for each Connection the number of times its code appears in 'codes' '''
+    counts = np.bincount(np.asarray(codes,dtype=np.int64).ravel(),minlength=len(CONNECTIONS))
+    return {c: int(counts[k]) for k, c in enumerate(CONNECTIONS)}
+
+def find_connections(codes, connections):
+    ''' Returns the indexes (as given by numpy.nonzero) of the codes that are one of 'connections'
+        @connections: a Connection or a list of them
+    '''
+    if isinstance(connections,Connection):
+        connections = [connections]
+    return np.nonzero(np.isin(codes,[CODES[c] for c in connections]))
@@ -0,0 +1,199 @@
+import collections as col
+import multiprocessing as mp
+import numpy as np
+import pandas as pd
+
+import parser
+import parallel
+import profiling
+from columns import *
+from sparse import _pairs_before
+from layout import pair_count, pair_index, pair_rows
+
+#Maximal number of (record, rule) cells tested at once, bounds the temporary arrays of a chunk
+CELLS = 1 << 22
+#Maximal number of chunks read in advance when they are evaluated by several processes
+CHUNKS_PER_WORKER = 2
+
+class Evaluation:
+    ''' Rules fired by the records of an observation file
+        @records: number of records
+        @coverage: number of records firing each rule
+        @rows, @cols, @counts: pairs of rules (rows < cols) fired together by at least one record and their number of records
+    '''
+    def __init__(self, records, coverage, rows, cols, counts):
+        self.records = records
+        self.coverage = coverage
+        self.rows = rows
+        self.cols = cols
+        self.counts = counts
+
+def fires(store, observations, records):
+    ''' Returns the boolean matrix (records x rules) of the rules of ColumnStore 'store' fired by each of 'records' records
+        @observations: typed columns of the records for the attributes of the rules, the recommendation excluded
+                       (None for attributes they don't give)
+        An unspecified value of a rule or of a record accepts every value, an interval accepts the numbers it contains
+        (endpoints included if it is closed on that side) and other values accept equal values.
+    '''
+    fired = np.ones((records,store.n),dtype=bool)
+    test = np.empty((records,store.n),dtype=bool)
+    for rules, obs in zip(store.cols[1:],observations):
+        if obs is None or obs.kind == EMPTY or rules.kind == EMPTY:
+            continue
+        rows = np.flatnonzero(~obs.na) #unspecified values of the records accept every rule
+        x = obs.keys[rows][:,None]
+        if rules.kind == INTERVAL:
+            #x is accepted iff lo <= x <= hi, open endpoints being moved to the next float inside the interval
+            lo = np.where(rules.closed & CLOSED_LEFT != 0,rules.left,np.nextafter(rules.left,np.inf))
+            hi = np.where(rules.closed & CLOSED_RIGHT != 0,rules.right,np.nextafter(rules.right,-np.inf))
+            lo[rules.na] = -np.inf
+            hi[rules.na] = np.inf
+            part = test[:len(rows)]
+            np.less_equal(lo[None,:],x,out=part)
+            part &= x <= hi[None,:]
+        else:
+            part = rules.keys[None,:] == x
+            part |= rules.na[None,:]
+        if len(rows) == records:
+            fired &= part
+        else:
+            fired[rows] &= part
+    return fired
+
+def observation_columns(store, frame):
+    ''' Returns the typed columns of a DataFrame of strings holding records, ordered as the attributes of 'store'
+        (recommendation excluded, None for attributes the records don't give, columns that aren't attributes are ignored)
+        Raises a TypeError if a column can't be compared with its attribute, a ValueError if a value can't be parsed
+    '''
+    observations = []
+    for name, rules in zip(store.names[1:],store.cols[1:]):
+        if name not in frame.columns:
+            observations.append(None)
+            continue
+        obs = parser.parse_column(frame[name].to_numpy())
+        expected = BOOL if rules.kind == BOOL else NUMBER
+        if obs.kind != EMPTY and rules.kind != EMPTY and obs.kind != expected:
+            raise TypeError("Values of attribute '"+str(name)+"' of the records must be of kind '"+expected+"', not '"+obs.kind+"'.")
+        observations.append(obs)
+    return observations
+
+def merge(pairs, counts):
+    ''' Returns the sorted distinct pairs (see layout.pair_index) of a list of arrays of pairs and the sum of their counts '''
+    pairs = np.concatenate(pairs) if pairs else np.zeros(0,dtype=np.int64)
+    counts = np.concatenate(counts) if counts else np.zeros(0,dtype=np.int64)
+    pairs, inverse = np.unique(pairs,return_inverse=True)
+    return pairs, np.bincount(inverse,weights=counts,minlength=len(pairs)).astype(np.int64)
+
+def cofiring(fired):
+    ''' Returns the pairs of rules (see layout.pair_index) fired together by at least one record of the boolean matrix
+        'fired' (records x rules) and their number of records
+        The pairs of the rules fired by each record are listed (O(sum of their squares)), at most CELLS at a time,
+        and counted in an array of all the pairs if there are at most CELLS of them, sorted otherwise.
+    '''
+    total = pair_count(fired.shape[1])
+    dense = np.zeros(total if total <= CELLS else 0,dtype=np.int64)
+    record, rule = np.nonzero(fired) #sorted by record then rule
+    per_record = np.bincount(record,minlength=len(fired))
+    end = np.repeat(np.cumsum(per_record),per_record) #end of the rules fired by the record of each position
+    partners = np.cumsum(end - np.arange(len(end)) - 1)
+    pairs, counts = [], []
+    start = 0
+    while start < len(end):
+        #positions start ... stop-1 have at most CELLS partners in total (at least one position)
+        stop = max(start+1,int(np.searchsorted(partners,partners[start-1]+CELLS if start > 0 else CELLS,side='right')))
+        P, Q = _pairs_before(end[start:stop]-start)
+        keys = pair_index(rule[P+start],rule[Q+start])
+        if len(dense) > 0:
+            dense += np.bincount(keys,minlength=total)
+        else:
+            keys, number = np.unique(keys,return_counts=True)
+            pairs.append(keys); counts.append(number)
+        start = stop
+    if len(dense) > 0:
+        keys = np.flatnonzero(dense)
+        return keys, dense[keys]
+    return merge(pairs,counts)
+
+def evaluate_chunk(store, frame, bitsets=False):
+    ''' Returns the number of records, the coverage of each rule, the co-firing pairs and counts (see cofiring)
+        and the packed bits of the rules fired by each record (None if not 'bitsets') of one chunk (DataFrame of strings)
+    '''
+    observations = observation_columns(store,frame)
+    coverage = np.zeros(store.n,dtype=np.int64)
+    pairs, counts = [], []
+    bits = [] if bitsets else None
+    step = max(1,CELLS // max(store.n,1))
+    for start in range(0,len(frame),step):
+        part = [None if obs is None else obs.take(slice(start,start+step)) for obs in observations]
+        fired = fires(store,part,min(step,len(frame)-start))
+        coverage += fired.sum(axis=0)
+        keys, number = cofiring(fired)
+        pairs.append(keys); counts.append(number)
+        if bitsets:
+            bits.append(np.packbits(fired,axis=1))
+    if bitsets:
+        bits = np.concatenate(bits) if bits else np.zeros((0,(store.n+7)//8),dtype=np.uint8)
+    return (len(frame), coverage) + merge(pairs,counts) + (bits,)
+
+_worker = {} #state of a worker process, set by _init
+
+def _init(store, bitsets):
+    _worker.update(store=store,bitsets=bitsets)
+
+def _evaluate(frame):
+    return evaluate_chunk(_worker['store'],frame,_worker['bitsets'])
+
+def read_records(csv_name, chunk_rows):
+    ''' Yields the records of a csv file by chunks of 'chunk_rows' (DataFrames of strings) '''
+    with open(csv_name,'r') as csv_file:
+        if csv_file.readline() == '':
+            return #empty file
+    with pd.read_csv(csv_name,dtype=str,keep_default_na=False,na_filter=False,index_col=False,chunksize=chunk_rows) as reader:
+        for frame in reader:
+            yield frame
+
+@profiling.timed('evaluate.evaluate')
+def evaluate(ruleset, csv_name, chunk_rows=parser.CHUNK_ROWS, workers=1, bitsets=None):
+    ''' Evaluate the rules of 'ruleset' on the records of an observation csv file (one column per attribute, values
+        written as in rule files), read by chunks of 'chunk_rows' records so that memory doesn't depend on its size.
+        @workers: number of processes evaluating the chunks (os.cpu_count() if None)
+        @bitsets: if given, name of a binary file in which, for each record, the bits of the rules it fires are written
+                  (np.packbits: rule r is bit 7 - r % 8 of byte r // 8), np.fromfile(bitsets,np.uint8).reshape(records,-1)
+        Memory holds one chunk per worker and the pairs of rules that fired together so far.
+        Returns an Evaluation
+    '''
+    workers = parallel.check_workers(workers)
+    store = ruleset.store
+    records = 0
+    coverage = np.zeros(ruleset.n,dtype=np.int64)
+    pairs = [np.zeros(0,dtype=np.int64)]
+    counts = [np.zeros(0,dtype=np.int64)]
+    out = open(bitsets,'wb') if bitsets is not None else None
+    def add(result):
+        nonlocal records
+        chunk_records, chunk_coverage, chunk_pairs, chunk_counts, bits = result
+        records += chunk_records
+        coverage[...] += chunk_coverage
+        pairs[0], counts[0] = merge([pairs[0],chunk_pairs],[counts[0],chunk_counts])
+        if out is not None:
+            out.write(bits.tobytes())
+    try:
+        chunks = read_records(csv_name,chunk_rows)
+        if workers == 1 or ruleset.n == 0:
+            for frame in parser.prefetch(chunks):
+                add(evaluate_chunk(store,frame,out is not None))
+        else:
+            with mp.get_context().Pool(workers,initializer=_init,initargs=(store,out is not None)) as pool:
+                #a bounded number of chunks is read ahead, the results are added in the order of the records
+                pending = col.deque()
+                for frame in chunks:
+                    pending.append(pool.apply_async(_evaluate,(frame,)))
+                    if len(pending) >= CHUNKS_PER_WORKER*workers:
+                        add(pending.popleft().get())
+                while pending:
+                    add(pending.popleft().get())
+    finally:
+        if out is not None:
+            out.close()
+    rows, cols = pair_rows(pairs[0])
+    return Evaluation(records,coverage,rows,cols,counts[0])
@@ -0,0 +1,141 @@
+import numpy as np
+
+from columns import is_na
+from connection import *
+
+#Rules and attributes shown at once by the table of the GUI, whose widgets are created once and rebound when it scrolls
+VISIBLE_ROWS = 25
+VISIBLE_COLS = 9
+#Empty rows and columns following the rules and attributes, in which new rules and attributes are typed
+EXTRA_ROWS = 3
+EXTRA_COLS = 3
+#Row of the cells holding the names of the attributes
+HEADER = -1
+
+def text(val):
+    ''' Text showing a value of a rule in the table, '' for unspecified values '''
+    if isinstance(val,(bool,np.bool_)):
+        return 'True' if val else 'False' #avoids a change from boolean to int
+    if is_na(val):
+        return ''
+    return str(val)
+
+class Grid:
+    ''' Virtual table of a RuleSet: one row per rule and one column per attribute (names in row HEADER), followed by
+        extra empty ones, of which only a viewport of rows x cols cells starting at (top, left) is shown.
+        The widget of cell (r,c) of the viewport shows cell (top+r,left+c) of the table (key (HEADER,c) for the names),
+        widget ('label',r) the number of its rule and widget ('connection',r) its connection with the reference rule.
+        Values are read from the rule set when they are shown, the texts typed by the user are kept in 'edits'
+        until they are applied or discarded, so that scrolling doesn't lose them.
+    '''
+    def __init__(self, rows=VISIBLE_ROWS, cols=VISIBLE_COLS, extra_rows=EXTRA_ROWS, extra_cols=EXTRA_COLS):
+        self.rows = rows
+        self.cols = cols
+        self.extra_rows = extra_rows
+        self.extra_cols = extra_cols
+        self.top = 0 #first rule shown
+        self.left = 0 #first attribute shown
+        self.edits = {} #(rule, attr) -> text typed in the cell, rule HEADER for the names of the attributes
+        self.codes = None #connections with the reference rule (see RuleSet.connections_for), None if not checked
+        self.shown = {} #key of widget -> text it shows
+        self.painted = {} #row of the viewport -> Connection whose colour its cells show
+
+    def size(self, ruleset):
+        ''' Number of rows (rules) and columns (attributes) of the table, at least the ones of the viewport '''
+        return max(ruleset.n+self.extra_rows,self.rows), max(ruleset.m+self.extra_cols,self.cols)
+
+    def limits(self, ruleset):
+        ''' Largest first rule and first attribute of the viewport '''
+        rows, cols = self.size(ruleset)
+        return max(rows-self.rows,0), max(cols-self.cols,0)
+
+    def scroll(self, ruleset, top=None, left=None):
+        ''' Move the viewport so that it starts at rule 'top' and attribute 'left' (unchanged if None), within the table '''
+        max_top, max_left = self.limits(ruleset)
+        self.top = min(max(int(self.top if top is None else top),0),max_top)
+        self.left = min(max(int(self.left if left is None else left),0),max_left)
+
+    def reset(self):
+        ''' Forget the edits and the reference rule and go back to the first cell, e.g. when a rule set is opened '''
+        self.top = self.left = 0
+        self.edits.clear()
+        self.codes = None
+
+    def original(self, ruleset, rule, attr):
+        ''' Text of cell (rule, attr) of the table given by the rule set '''
+        if attr >= ruleset.m or rule >= ruleset.n:
+            return ''
+        if rule == HEADER:
+            return str(ruleset.attr_names[attr])
+        return text(ruleset.get_val(rule,attr))
+
+    def cell(self, ruleset, rule, attr):
+        ''' Text of cell (rule, attr) of the table: the one typed by the user if any, the one of the rule set otherwise '''
+        edit = self.edits.get((rule,attr))
+        return edit if edit is not None else self.original(ruleset,rule,attr)
+
+    def values(self, ruleset):
+        ''' Mapping (rule, attr) -> text of the cells of the table (see cell) '''
+        return _Values(self,ruleset)
+
+    def read(self, ruleset, values):
+        ''' Record the texts of the widgets of the viewport ('values' as given by the window) that differ from the rule set '''
+        for r in range(HEADER,self.rows):
+            for c in range(self.cols):
+                typed = values.get((r,c))
+                if typed is None or typed == self.shown.get((r,c)):
+                    continue
+                self.shown[(r,c)] = typed
+                cell = (r if r == HEADER else self.top+r,self.left+c)
+                if typed == self.original(ruleset,*cell):
+                    self.edits.pop(cell,None)
+                else:
+                    self.edits[cell] = typed
+
+    def view(self, ruleset):
+        ''' Returns the text of every widget of the viewport: {key: text} '''
+        rows = self.size(ruleset)[0]
+        view = {}
+        for c in range(self.cols):
+            view[(HEADER,c)] = self.cell(ruleset,HEADER,self.left+c)
+        for r in range(self.rows):
+            rule = self.top + r
+            view[('label',r)] = str(rule) if rule < rows else ''
+            view[('connection',r)] = self.connection(ruleset,rule).value if self.codes is not None and rule < ruleset.n else ''
+            for c in range(self.cols):
+                view[(r,c)] = self.cell(ruleset,rule,self.left+c)
+        return view
+
+    def changes(self, ruleset):
+        ''' Returns the texts of the widgets of the viewport that must change, {key: text}, and records them as shown '''
+        changed = {key: txt for key, txt in self.view(ruleset).items() if self.shown.get(key) != txt}
+        self.shown.update(changed)
+        return changed
+
+    def connection(self, ruleset, rule):
+        ''' Connection of 'rule' with the reference rule, DISCONNECTED if none was checked or it isn't a rule '''
+        if self.codes is None or rule >= ruleset.n:
+            return Connection.DISCONNECTED
+        return CONNECTIONS[self.codes[rule]]
+
+    def repaint(self, ruleset):
+        ''' Returns the rows of the viewport whose colour must change, {row: Connection}, and records them as painted
+            Only these rows are coloured again, so that switching between reference rules or scrolling costs
+            the number of rows whose connection differs, not the size of the table.
+        '''
+        changed = {}
+        for r in range(self.rows):
+            con = self.connection(ruleset,self.top+r)
+            if self.painted.get(r) != con:
+                changed[r] = con
+        self.painted.update(changed)
+        return changed
+
+class _Values:
+    ''' Read-only mapping (rule, attr) -> text of the cells of a Grid, see Grid.values '''
+    def __init__(self, grid, ruleset):
+        self.grid = grid
+        self.ruleset = ruleset
+
+    def __getitem__(self, cell):
+        return self.grid.cell(self.ruleset,*cell)
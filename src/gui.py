@@ -1,85 +1,83 @@
 import PySimpleGUI as sg
-import pandas as pd
-import copy
 import collections as col
 
 
 import parser
+import rulefile
 from rule_set import * 
 from connection import *
+from grid import Grid, HEADER
 
 #Global variables
-nbr_rows = 12
-nbr_cols = 9
 width = 20
 ruleset = RuleSet([])
+grid = Grid() #viewport of the table, its widgets are created once and show the rules it scrolls to
 window = None
+FILE_TYPES = (("CSV Files", "*.csv"),("Rule set files", "*"+rulefile.EXTENSION))
 colors = {Connection.REFERENCE: 'orchid4', Connection.DISCONNECTED: 'white', Connection.EQUAL_DIFF:'DeepSkyBlue4' , Connection.INCLUSION_DIFF:'DeepSkyBlue3' , Connection.OVERLAP_DIFF:'SkyBlue1' , Connection.EQUAL_SAME:'SpringGreen4' , Connection.INCLUSION_SAME:'SpringGreen3' , Connection.OVERLAP_SAME:'pale green' }
+#Events of the mouse wheel over the window (Button-4/5 on Linux) and the number of rules scrolled by one step
+WHEEL_EVENTS = {'<MouseWheel>': 'wheel', '<Button-4>': 'wheel_up', '<Button-5>': 'wheel_down'}
+WHEEL_ROWS = 3
 
 def run_gui():
-    global nbr_cols
-    global nbr_rows
-    global width
     global ruleset
     global window
-    #Layout and window creation
-    #WARNING: Any change made here has to be reproduced in resized_window()
+    #Layout and window creation, the table has a fixed number of widgets (see grid.Grid)
     intro = [sg.Text('Energy rules',key = 'txt1')]
-    header_row = [[sg.Text('', size=(4,1))] + [sg.Input(size=(width,1), pad=(0,0), key=(-1,attr)) for attr in range(nbr_cols)]]
-    input_rows = [[sg.Text(str(row), size=(4,1))] + [sg.Input(size=(width,1), pad=(0,0), key=(row,attr)) for attr in range(nbr_cols)] + [sg.Text('', size=(2*width,1), key=('connection',row))] for row in range(nbr_rows)]
-    scrollable_set = [sg.Column(header_row + input_rows, size=(width*(nbr_cols+1)*8,nbr_rows*25), scrollable=True)]
+    header_row = [[sg.Text('', size=(6,1))] + [sg.Input(size=(width,1), pad=(0,0), key=(HEADER,c)) for c in range(grid.cols)]]
+    input_rows = [[sg.Text('', size=(6,1), key=('label',r))] + [sg.Input(size=(width,1), pad=(0,0), key=(r,c)) for c in range(grid.cols)] + [sg.Text('', size=(2*width,1), key=('connection',r))] for r in range(grid.rows)]
+    table = [sg.Column(header_row + input_rows), sg.Slider(range=(0,0), orientation='v', size=(grid.rows,15), disable_number_display=True, enable_events=True, key='scroll_rows')]
+    scroll_cols = [sg.Slider(range=(0,0), orientation='h', size=(width*grid.cols//3,15), disable_number_display=True, enable_events=True, key='scroll_cols')]
     actions1 = [sg.Text('Index of rule to check connections with:'), sg.Input(size=(4,1),key='to_check'),sg.Button('Check')]
     actions2 = [sg.Button('Update'), sg.Button('Delete rule:'), sg.Input(size=(4,1),key='del_rule'), sg.Button('Delete attribute:'), sg.Input(size=(width,1),key='del_attr')]
     actions3 = [sg.Open(), sg.Button('Increase Table size'), sg.Button('Remove changes'), sg.Button('Delete rule set'), sg.Button('Update & Save'), ]
 
     layout = [intro,
-            scrollable_set,
+            table,
+            scroll_cols,
             actions1,
             actions2,
             actions3
         ]
 
     window = sg.Window('Rules manager', return_keyboard_events=True, finalize=True).Layout(layout)
+    for bind_string, key in WHEEL_EVENTS.items():
+        window.bind(bind_string,key)
+    grid.shown.clear(); grid.painted.clear()
+    display_set(window)
 
-    #Boolean to remember tasks status
-    load_waiting = False
     while True:   
         event, values = window.read()
-        #Execution of events that needed a modification of the window
-        if load_waiting: #display loaded ruleset in table
-            print("in load waiting")
-            display_set(window)
-            load_waiting = False
         if event in (sg.WIN_CLOSED, 'Cancel'):
             break
+        grid.read(ruleset,values) #texts typed in the table since the last event
+        if event in ('scroll_rows','scroll_cols'):
+            grid.scroll(ruleset,values['scroll_rows'],values['scroll_cols'])
+            display_set(window)
+        elif event in WHEEL_EVENTS.values():
+            up = event == 'wheel_up' or (event == 'wheel' and window.user_bind_event.delta > 0)
+            grid.scroll(ruleset,grid.top + (-WHEEL_ROWS if up else WHEEL_ROWS))
+            display_set(window)
         elif event == 'Open':
-            filename = sg.popup_get_file('filename to open', no_window=True, file_types=(("CSV Files", "*.csv"),))
+            filename = sg.popup_get_file('filename to open', no_window=True, file_types=FILE_TYPES)
             if filename is not None and type(filename) in (str,bytes):
                 try:
-                    rules = parser.parse_csv(filename)
-                    ruleset = RuleSet(rules)
-                except ValueError:
+                    if filename.endswith(rulefile.EXTENSION):
+                        ruleset = RuleSet.load(filename)
+                    else:
+                        ruleset = RuleSet.from_store(parser.parse_columns(filename))
+                except (ValueError, TypeError):
                     sg.popup_ok("File selected doesn't contain values in the right format",non_blocking=True)
                     pass
                 except FileNotFoundError:
                     pass
                 #print(ruleset)
-                if ruleset.n >= nbr_rows or ruleset.m >= nbr_cols:
-                    #create a window of appropriate size
-                    #nbr_rows = ruleset.n + 3; nbr_cols = ruleset.m + 3
-                    resize_window(ruleset.n + 3, ruleset.m + 3)
-                    load_waiting = True  #remember that the data has yet to be loaded, which has to wait for the next pass through the while loop
-                    sg.popup_ok("Resizing of window ongoing. Press any key as soon as new window appears in order to display the ruleset.", non_blocking=True, keep_on_top=True)
-                else:
-                    erase(window,headers=True,values=True,connections=True)
-                    display_set(window)
+                grid.reset()
+                display_set(window)
         elif event == 'Check':
             if ruleset.n < 2:
                 sg.popup_ok("You must have a ruleset with at least two rules to compare them.")
             else:
-                if len(ruleset.idm) == 0:
-                    ruleset.build_IDM()
-                    ruleset.build_PM()
                 ref = values['to_check']
                 if ref == '':
                     sg.popup_ok("You need to input the index of the reference rule.")
@@ -89,24 +87,24 @@ def run_gui():
                         if ref < 0 or ref >= ruleset.n:
                             sg.popup_ok("Input value must be a valid rule index (integer in [0," + str(ruleset.n-1) + "]")
                         else:
-                            for i in range(ruleset.n):
-                                con = ruleset.connection(ref,i)
-                                con_elem = window[('connection',i)]
-                                con_elem.update(con.value)
-                                for j in range(ruleset.m):
-                                    window[(i,j)].Widget.configure(background=colors[con])
+                            grid.codes = ruleset.connections_for(ref) #computed without building idm and pm
+                            display_set(window)
                     except ValueError as ve:
                         sg.popup_ok(str(ve) + "\nInput value must be an integer")
         elif event == 'Update':
-            success = update(values)
+            success = update(grid.values(ruleset))
             if success:
-                erase(window,connections=True)
+                erase(window)
         elif event == 'Update & Save':
-            success = update(values)
+            success = update(grid.values(ruleset))
             if success:
-                erase(window,connections=True)
-                file_name = sg.popup_get_file("Save the ruleset in a new or existing file.",save_as=True,file_types=(("CSV Files", "*.csv"),))
-                ruleset.to_csv(file_name)
+                erase(window)
+                file_name = sg.popup_get_file("Save the ruleset in a new or existing file.",save_as=True,file_types=FILE_TYPES)
+                if file_name:
+                    if file_name.endswith(rulefile.EXTENSION):
+                        ruleset.save(file_name)
+                    else:
+                        ruleset.to_csv(file_name)
         elif event == 'Delete rule:':
             del_rule = values['del_rule']
             if del_rule == '':
@@ -118,8 +116,7 @@ def run_gui():
                         sg.popup_ok("Input value must be a valid rule index (integer in [0," + str(ruleset.n-1) + "]")
                     else:
                         ruleset.delete_rule(del_rule)
-                        erase(window,True,True,True)
-                        display_set(window)
+                        erase(window)
                 except ValueError as ve:
                     sg.popup_ok(str(ve) + "\nInput value must be an integer")
         elif event == 'Delete attribute:':
@@ -140,87 +137,61 @@ def run_gui():
                 if del_ok:
                     try:
                         ruleset.delete_attr(del_attr)
-                        erase(window,True,True,True)
-                        display_set(window)
+                        erase(window)
                     except ValueError as ve:
                         sg.popup_ok(ve)
         elif event == 'Increase Table size':
-            resize_window(nbr_rows + 3, nbr_cols + 3)
-            load_waiting = True  #remember that the ruleset needs to be displayed again, which has to wait for the next pass through the while loop
-            sg.popup_ok("Resizing of window ongoing. Press any key as soon as new window appears in order to display the ruleset.", non_blocking=True, keep_on_top=True)
-        elif event == 'Remove changes':
-            erase(window,headers=True,values=True,connections=True)
+            #more empty rows and columns to add rules and attributes, the window is kept
+            grid.extra_rows += 3; grid.extra_cols += 3
             display_set(window)
+        elif event == 'Remove changes':
+            erase(window)
         elif event == 'Delete rule set':
             answer = sg.popup_ok_cancel("No unsaved changes will be saved. Proceed to clear?")
             print(answer)
             if answer == 'OK':
                 ruleset = RuleSet([])
-                erase(window,headers=True,values=True,connections=True)
+                grid.reset()
+                display_set(window)
 
     window.close()
 
-def erase(window,headers=False,values=False,connections=False):
-    if headers:
-        [window[(-1,j)].update('') for j in range(nbr_cols)] #empty headers
-    if values:
-        [window[(i,j)].update('') for j in range(nbr_cols) for i in range(nbr_rows)] #empty values
-    if connections:
-        [window[('connection',i)].update('') for i in range(nbr_rows)] #empty connections
-        for i in range(nbr_rows):
-            for j in range(nbr_cols):
-                window[(i,j)].Widget.configure(background='white')         
+def erase(window):
+    ''' Discard the texts typed in the table and the connections shown, then show the rule set again '''
+    grid.edits.clear()
+    grid.codes = None
+    display_set(window)
 
-def resize_window(rows,cols):
-    global nbr_rows
-    global nbr_cols
-    global width
-    global window
-    nbr_rows = rows; nbr_cols = cols
-    intro = [sg.Text('Energy rules',key = 'txt1')]
-    header_row = [[sg.Text('', size=(4,1))] + [sg.Input(size=(width,1), pad=(0,0), key=(-1,attr)) for attr in range(nbr_cols)]]
-    input_rows = [[sg.Text(str(row), size=(4,1))] + [sg.Input(size=(width,1), pad=(0,0), key=(row,attr)) for attr in range(nbr_cols)] + [sg.Text('', size=(2*width,1), key=('connection',row))] for row in range(nbr_rows)]
-    n = min(25,nbr_rows); m = min(15,nbr_cols)
-    scrollable_set = [sg.Column(header_row + input_rows, size=(width*m*8,n*25), scrollable=True)]
-    actions1 = [sg.Text('Index of rule to check connections with:'), sg.Input(size=(4,1),key='to_check'),sg.Button('Check')]
-    actions2 = [sg.Button('Update'), sg.Button('Delete rule:'), sg.Input(size=(4,1),key='del_rule'), sg.Button('Delete attribute:'), sg.Input(size=(width,1),key='del_attr')]
-    actions3 = [sg.Open(), sg.Button('Increase Table size'), sg.Button('Remove changes'), sg.Button('Delete rule set'), sg.Button('Update & Save'), ]
-    layout = [intro, scrollable_set, actions1, actions2, actions3]
-    new_window = sg.Window('Window Title', return_keyboard_events=True).Layout(layout)
-    window.close()
-    window = new_window
-    
 def display_set(window):
-    global ruleset
-    for k in range(ruleset.m):
-        elem = window[(-1,k)]
-        val = ruleset.attr_names[k]
-        elem.update(val)
-    for i in range(ruleset.n):
-        for j in range(ruleset.m):
-            try:
-                elem = window[(i,j)]
-                val = ruleset.get_val(i,j)
-                if elem is not None:# and val is not float('nan'):
-                    if type(val) is bool:
-                        #Necessary to avoid a change from boolean to int
-                        if val: elem.update('True')
-                        else: elem.update('False')
-                    else:
-                        elem.update(val)
-            except:
-                pass
+    ''' Show the viewport of the table: only the widgets whose text changed are updated, the rule set is never copied '''
+    grid.scroll(ruleset) #the table may have shrunk
+    max_top, max_left = grid.limits(ruleset)
+    window['scroll_rows'].update(value=grid.top,range=(0,max_top))
+    window['scroll_cols'].update(value=grid.left,range=(0,max_left))
+    for key, txt in grid.changes(ruleset).items():
+        window[key].update(txt)
+    for r, con in grid.repaint(ruleset).items():
+        paint(window,r,colors[con])
+
+def paint(window, r, color):
+    ''' Set the background of the cells of row r of the table with a single Tcl script instead of one call per cell '''
+    widgets = [window[(r,c)].Widget for c in range(grid.cols)]
+    widgets[0].tk.eval(''.join(str(w)+' configure -background {'+color+'}\n' for w in widgets))
 
 def update(values):
+    ''' Apply the texts typed in the table to the rule set, all of them or none if one is wrong
+        @values: mapping (rule, attr) -> text of the cells of the table (see grid.Grid.values)
+    '''
     global ruleset
-    global nbr_rows
-    global nbr_cols
-    print("start update")
     problem = False
     name_change = False
     rule_to_add = False
     attr_to_add = False
-    old_set = copy.deepcopy(ruleset)
+    old_set = ruleset #replaced if the ruleset is created from an empty one
+    old_n = ruleset.n; old_m = ruleset.m
+    old_names = list(ruleset.attr_names)
+    nbr_rows, nbr_cols = grid.size(ruleset)
+    edited = sorted(cell for cell in grid.edits if cell[0] != HEADER) #the other cells hold the values of the rule set
     warning = "\nNo changes were saved. Try again after fixing values."
 
     #filling in ruleset that was empty, no previous loop has been entered since self.m == 0 and self.n == 0
@@ -249,20 +220,21 @@ def update(values):
                     sg.popup_ok(str(ve) + " Position: ("+str(i)+","+str(j)+")"+warning)
                     break
             rule_dict = col.OrderedDict({k:v for k,v in zip(attributes,vals)})
-            print("rule dict: "+str(rule_dict))
             rules_list += [rule_dict]
             i+=1
         ruleset = RuleSet(rules_list)
-        print("ruleset has been created with rule list:" + str(rules_list))
+    #modifications are recorded to be undone if a problem is found (and idm/pm are refreshed once at the end)
+    transaction = ruleset.transaction()
     
     #Check for change in attribute names
-    for j in range(old_set.m):
-        if values[(-1,j)] != old_set.attr_names[j]:
-            old_set.attr_names[j] = values[(-1,j)]
+    new_names = list(old_names)
+    for j in range(old_m):
+        if values[(-1,j)] != old_names[j]:
+            new_names[j] = values[(-1,j)]
             name_change = True
     if name_change:
         try:
-            ruleset.update_attr(old_set.attr_names)
+            ruleset.update_attr(new_names)
         except ValueError as ve:
             problem = True
             sg.popup_ok(str(ve)+warning)
@@ -287,7 +259,6 @@ def update(values):
                         sg.popup_ok("Value in new rule doesn't have an appropriate format. Value: "+str(input_str)+ " Position: ("+str(i)+","+str(j)+")"+warning)
                 if rule_to_add:
                     try:
-                        print("rule to add: " + str(rec_str)+" "+str(val_list))
                         ruleset.add_rule(rec_str,val_list)
                     except ValueError as ve:
                         problem = True
@@ -298,7 +269,6 @@ def update(values):
 
     #Check for new attributes (without verifying compatibility of attribute value types)
     for j in range(ruleset.m,nbr_cols):
-        print(ruleset.m)
         if values[(-1,j)] != '':
             if ruleset.n > 0 and j != ruleset.m:
                 problem = True
@@ -325,75 +295,46 @@ def update(values):
                         problem = True
                         sg.popup_ok(str(te)+warning)
 
-    print("n: "+str(ruleset.n))
-    
-    #Check for changes in values and verifies compatibility between types (includes values of new rules and attributes to include them in the type compatibility check)
+    #Check for changes in values of the rules, only the edited cells can differ from the rule set
     if not problem:
-        #Check in recommendations (type is string so no verification to perform)
-        for i in range(old_set.n):
-            input_str = values[(i,0)]
-            if input_str != ruleset.get_val(i,0): #recommendation has been changed
-                ruleset.update_val(i,0,input_str)
-        #Check for other values
-        for j in range(1,ruleset.m):
-            col_type = None
-            for i in range(ruleset.n):
-                input_str = values[(i,j)]
-                try:
-                    input_val = parser.parse_val(input_str)
-                    old_val = ruleset.get_val(i,j)
-                    #Check for type mismatch within column
-                    if col_type is None and not pd.isna(input_val):
-                        col_type = type(input_val)
-                    if (not pd.isna(input_val)) and (col_type is not None) and (not ruleset.has_type(input_val,col_type)):
-                            problem = True
-                            sg.popup_ok("Wrong value type for attribute " + ruleset.attr_names[j] + " in rule " + str(i) + " or a preceding one."+warning)
-                            print("inputval: "+str(type(input_val))+str(input_val)+" old_val: "+str(type(old_val))+str(old_val)+ " col_type: "+str(col_type))
-                            print("ruleset.same_type(input_val,col_type): " + str(ruleset.same_type(input_val,col_type)))
-                            break #Avoid to show error for every following rule
-                    else:
-                        #Check for value change. Necessary to check for types to notice difference between int 1 or 0 and booleans
-                        if input_val != old_val or not ruleset.same_type(input_val,old_val):
-                            #print("input_val type: " +str(type(input_val)) + "old_val type: " +str(type(old_val)))
-                            try:
-                                #print("input_val type: " +str(type(input_val)) + str(input_val)+ "old_val type: " +str(type(old_val))+str(old_val) + " col_type "+str(col_type))
-                                ruleset.update_val(i,j,input_val)
-                            except TypeError as te:
-                                problem = True
-                                sg.popup_ok("All values of an attribute must have the same type which can't be modified after it has been defined.\nError for attribute " + ruleset.attr_names[j] +warning)
-                except ValueError as ve:
-                    problem = True
-                    sg.popup_ok(str(ve) + " Position: ("+str(i)+","+str(j)+")"+warning)
+        for i, j in edited:
+            if i >= old_n or j >= old_m:
+                continue #new rules and attributes were added above
+            input_str = values[(i,j)]
+            if j == 0:
+                #Check in recommendations (type is string so no verification to perform)
+                if input_str != ruleset.get_val(i,0): #recommendation has been changed
+                    ruleset.update_val(i,0,input_str)
+                continue
+            try:
+                input_val = parser.parse_val(input_str)
+                old_val = ruleset.get_val(i,j)
+                #Check for value change. Necessary to check for types to notice difference between int 1 or 0 and booleans
+                if input_val != old_val or not ruleset.same_type(input_val,old_val):
+                    try:
+                        ruleset.update_val(i,j,input_val)
+                    except TypeError as te:
+                        problem = True
+                        sg.popup_ok("All values of an attribute must have the same type which can't be modified after it has been defined.\nError for attribute " + ruleset.attr_names[j] + " in rule " + str(i) +warning)
+                        break #Avoid to show error for every following rule
+            except ValueError as ve:
+                problem = True
+                sg.popup_ok(str(ve) + " Position: ("+str(i)+","+str(j)+")"+warning)
 
     #check for the presence of inputs outside of the range of considered rules and attributes
     if not problem:
-        for i in range(ruleset.n,nbr_rows):
-            for j in range(1,nbr_cols):
-                if values[(i,j)] != '':
-                    sg.popup_ok("The input at position ("+str(i)+","+str(j)+") falls outside of the considered rules and attributes and was not saved in the ruleset.")
-        for j in range(ruleset.m,nbr_cols):
-            for i in range(ruleset.n):
-                if values[(i,j)] != '':
-                    sg.popup_ok("The input at position ("+str(i)+","+str(j)+") falls outside of the considered rules and attributes and was not saved in the ruleset.")
+        for i, j in edited:
+            outside = (i >= ruleset.n and j >= 1) or (j >= ruleset.m and i < ruleset.n)
+            if outside and values[(i,j)] != '':
+                sg.popup_ok("The input at position ("+str(i)+","+str(j)+") falls outside of the considered rules and attributes and was not saved in the ruleset.")
 
     if problem:
         # update could not be completed => restore original state of ruleset in memory
-        ruleset = copy.deepcopy(old_set)
-        print("problem")
-        print(ruleset)
-        print("n: "+str(ruleset.n))
-        #print("---idm---")
-        #print(ruleset.idm)
-        #print("---pm---")
-        #print(ruleset.pm)
+        transaction.rollback()
+        ruleset = old_set
         return False
     else:
-        print("success")
-        print(ruleset)
-        #print("---idm---")
-        #print(ruleset.idm)
-        #print("---pm---")
-        #print(ruleset.pm)
+        transaction.commit()
         return True
 
 
@@ -0,0 +1,96 @@
+import numpy as np
+
+from relation import *
+from columns import *
+
+#Number of rows compared at once when filling a whole layer (bounds the size of temporary arrays)
+TILE = 1024
+
+############################################
+# Computation of Inter-Difference Criteria #
+############################################
+
+def idc_pairs(col, I, J, rec=False):
+    ''' Returns the IDC of every pair of values (I[k],J[k]) of column 'col'
+        @I, @J: integer arrays of row indexes (broadcasted against each other)
+        @rec: True if 'col' holds the recommendations, in which case SAME_REC/DIFF_REC are returned
+        The result is an int8 array with the shape of the broadcast of I and J
+    '''
+    I = np.asarray(I); J = np.asarray(J)
+    na1 = col.na[I]; na2 = col.na[J]
+    if rec:
+        same = (col.keys[I] == col.keys[J]) & ~na1 & ~na2
+        return np.where(same,Relation.SAME_REC.value,Relation.DIFF_REC.value).astype(np.int8)
+    if col.kind == INTERVAL:
+        res = _intervals_idc(col.left[I],col.right[I],col.closed[I],col.left[J],col.right[J],col.closed[J])
+    elif col.kind == EMPTY:
+        res = np.zeros(np.broadcast(I,J).shape,dtype=np.int8)
+    else:
+        res = np.where(col.keys[I] == col.keys[J],Relation.EQUALITY.value,Relation.DIFFERENCE.value).astype(np.int8)
+    #unspecified values include any other value
+    res[na1 & na2] = Relation.EQUALITY.value
+    res[na1 & ~na2] = Relation.INCLUSION_JI.value
+    res[~na1 & na2] = Relation.INCLUSION_IJ.value
+    return res
+
+def _intervals_idc(l1, r1, c1, l2, r2, c2):
+    ''' Vectorized version of RuleSet._intervals_IDC_ on arrays of endpoints and closedness flags '''
+    #order the intervals so that a.left <= b.left, the inclusion relations being swapped accordingly
+    swap = l1 > l2
+    al = np.where(swap,l2,l1); ar = np.where(swap,r2,r1); ac = np.where(swap,c2,c1)
+    bl = np.where(swap,l1,l2); br = np.where(swap,r1,r2); bc = np.where(swap,c1,c2)
+    incl_ij = np.where(swap,Relation.INCLUSION_JI.value,Relation.INCLUSION_IJ.value)
+    incl_ji = np.where(swap,Relation.INCLUSION_IJ.value,Relation.INCLUSION_JI.value)
+    alc = (ac & CLOSED_LEFT) != 0; arc = (ac & CLOSED_RIGHT) != 0
+    blc = (bc & CLOSED_LEFT) != 0; brc = (bc & CLOSED_RIGHT) != 0
+    both = CLOSED_LEFT | CLOSED_RIGHT
+    #same definition of overlap as pandas.Interval.overlaps
+    overlaps = ((al < br) | ((al == br) & alc & brc)) & ((bl < ar) | ((bl == ar) & blc & arc))
+    same_left = al == bl
+    same_bounds = same_left & (ar == br)
+    conditions = [~overlaps,
+                  same_bounds & (ac == bc), # a,b a,b
+                  same_bounds & (ac == both), #a = [a,b], b included
+                  same_bounds & (bc == both), #b = [a,b], a included
+                  same_bounds & (ac == 0), #a = (a,b), a included
+                  same_bounds & (bc == 0), #b = (a,b), b included
+                  same_bounds, # (a,b] [a,b)
+                  same_left & (alc != blc), # (a,b [a,c with c > b
+                  same_left & (ar < br), #a,b a,c with b < c
+                  same_left, #a,b a,c with b > c
+                  ar >= br] #a.left < b.left
+    choices = [Relation.DIFFERENCE.value,
+               Relation.EQUALITY.value,
+               incl_ji,
+               incl_ij,
+               incl_ij,
+               incl_ji,
+               Relation.OVERLAP.value,
+               Relation.OVERLAP.value,
+               incl_ij,
+               incl_ji,
+               incl_ji]
+    return np.select(conditions,choices,default=Relation.OVERLAP.value).astype(np.int8)
+
+def idc_upper(col, out, rec=False, tile=TILE):
+    ''' Fill the strict upper triangle of the n x n array 'out' with the IDC of every pair (i,j), i < j
+        Rows are processed by tiles of 'tile' rows to bound the memory used by temporary arrays
+    '''
+    n = len(col)
+    for start in range(0,n-1,tile):
+        stop = min(start+tile,n-1)
+        I = np.arange(start,stop)[:,None]
+        J = np.arange(start+1,n)[None,:]
+        block = idc_pairs(col,I,J,rec)
+        block[J <= I] = 0
+        out[start:stop,start+1:] = block
+
+def idc_row(col, rule, rec=False):
+    ''' Returns the IDC between rule 'rule' and every rule of the column
+        Element i holds IDC(i,rule) if i < rule and IDC(rule,i) if i > rule, which are the values
+        stored in the upper triangle of the IDM. Element 'rule' is set to 0.
+    '''
+    idx = np.arange(len(col))
+    res = idc_pairs(col,np.minimum(idx,rule),np.maximum(idx,rule),rec)
+    res[rule] = 0
+    return res
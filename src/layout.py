@@ -0,0 +1,172 @@
+import numpy as np
+
+import kernel
+
+#Number of pairs computed at once when filling a packed layer
+PACKED_TILE = 1 << 20
+
+#Factor by which the number of rules an idm or pm buffer can hold grows when a rule is added to a full buffer
+GROWTH = 1.25
+
+def pair_count(n):
+    ''' Number of pairs (i,j) with i < j among n rules '''
+    return n*(n-1)//2
+
+def pair_index(i, j):
+    ''' Index of pair (i,j), i < j, in a packed triangle
+        Pairs are ordered by j then i, so that the index doesn't depend on the number of rules
+        and adding a rule only appends its pairs at the end
+    '''
+    return j*(j-1)//2 + i
+
+def pair_rows(idx):
+    ''' Inverse of pair_index: returns the arrays (i,j) of the pairs at indexes 'idx' '''
+    idx = np.asarray(idx,dtype=np.int64)
+    j = ((1 + np.sqrt(1 + 8*idx.astype(np.float64)))//2).astype(np.int64)
+    #correct rounding errors of the square root for large indexes
+    j -= (j*(j-1)//2 > idx)
+    j += ((j+1)*j//2 <= idx)
+    return idx - j*(j-1)//2, j
+
+def rule_pairs(n, rule):
+    ''' Indexes in a packed triangle of the pairs made of 'rule' and every rule i != rule (ordered by i)
+        Element 'rule' of the returned array is -1
+    '''
+    idx = np.arange(n,dtype=np.int64)
+    res = pair_index(np.minimum(idx,rule),np.maximum(idx,rule))
+    res[rule] = -1
+    return res
+
+class Layout:
+    ''' Operations shared by the layouts
+        Buffers may hold more rules (capacity) than the rule set, view() gives the part used by its n rules.
+        The pairs of the unused capacity are kept at 0 so that a buffer only needs to be grown when it is full.
+    '''
+    axes = 0 #number of axes used for the pairs
+
+    def alloc(self, prefix, n, dtype):
+        return np.zeros(tuple(prefix)+self.shape(n),dtype=dtype)
+
+    def reserve(self, a, n, growth=GROWTH, alloc=None):
+        ''' Returns 'a' if it can hold n rules, otherwise a copy of it whose capacity is grown geometrically
+            @alloc: function (prefix, n, dtype) allocating the copy (self.alloc if None), which is filled layer by layer
+        '''
+        cap = self.capacity(a)
+        if n <= cap:
+            return a
+        new = (alloc or self.alloc)(a.shape[:-self.axes],max(n,int(cap*growth)),a.dtype)
+        for k in range(len(a)):
+            self.view(new[k],cap)[...] = self.view(a[k],cap)
+        return new
+
+class DenseLayout(Layout):
+    ''' Values of the pairs stored in the upper triangle of n x n matrices (last two axes of the arrays) '''
+    packed = False
+    axes = 2
+
+    def shape(self, n):
+        ''' Shape of the axes holding the pairs of n rules '''
+        return (n,n)
+
+    def capacity(self, a):
+        return a.shape[-1]
+
+    def view(self, a, n):
+        return a[...,:n,:n]
+
+    def fill_layer(self, col, out, rec=False, tile=PACKED_TILE):
+        kernel.idc_upper(col,out,rec,tile=max(1,tile // max(len(col),1)))
+
+    def tiles(self, n, tile=PACKED_TILE):
+        ''' Yields (rows, pairs): slices of about 'tile' entries of the layers of n rules (a[...,rows,:] for a layer a)
+            and the boolean mask of their entries that hold a pair of rules, so that no temporary array is n x n
+        '''
+        step = max(1,tile // max(n,1))
+        for start in range(0,n,step):
+            stop = min(start+step,n)
+            yield slice(start,stop), np.arange(n)[None,:] > np.arange(start,stop)[:,None]
+
+    def get(self, a, i, j):
+        return a[...,i,j]
+
+    def row(self, a, rule, n):
+        ''' Values of the pairs made of 'rule' and every other rule, 0 for 'rule' itself (last axis) '''
+        res = np.zeros(a.shape[:-2]+(n,),dtype=a.dtype)
+        res[...,:rule] = a[...,:rule,rule]
+        res[...,rule+1:] = a[...,rule,rule+1:]
+        return res
+
+    def set_row(self, a, rule, row):
+        a[...,:rule,rule] = row[...,:rule]
+        a[...,rule,rule+1:] = row[...,rule+1:]
+
+    def select(self, a, rules, out=None, tile=PACKED_TILE):
+        ''' Returns the values of the pairs of 'rules' (sorted array of rules), written in 'out' if given (a new array otherwise)
+            by tiles of rows so that only the pages of the current tile are in memory when the arrays are mapped files
+        '''
+        if out is None:
+            out = self.alloc(a.shape[:-2],len(rules),a.dtype)
+        step = max(1,tile // max(len(rules),1))
+        for start in range(0,len(rules),step):
+            out[...,start:start+step,:] = a[...,rules[start:start+step,None],rules[None,:]]
+        return out
+
+    def to_dense(self, a, n):
+        return a
+
+class PackedLayout(Layout):
+    ''' Values of the pairs stored in a packed triangle of n*(n-1)/2 entries (last axis of the arrays), see pair_index '''
+    packed = True
+    axes = 1
+
+    def shape(self, n):
+        return (pair_count(n),)
+
+    def capacity(self, a):
+        return int(pair_rows(a.shape[-1])[1])
+
+    def view(self, a, n):
+        return a[...,:pair_count(n)]
+
+    def fill_layer(self, col, out, rec=False, tile=PACKED_TILE):
+        for start in range(0,len(out),tile):
+            stop = min(start+tile,len(out))
+            I, J = pair_rows(np.arange(start,stop))
+            out[start:stop] = kernel.idc_pairs(col,I,J,rec)
+
+    def tiles(self, n, tile=PACKED_TILE):
+        for start in range(0,pair_count(n),tile):
+            yield slice(start,min(start+tile,pair_count(n))), True
+
+    def get(self, a, i, j):
+        return a[...,pair_index(i,j)]
+
+    def row(self, a, rule, n):
+        idx = rule_pairs(n,rule)
+        res = a[...,idx]
+        res[...,rule] = 0
+        return res
+
+    def set_row(self, a, rule, row):
+        idx = rule_pairs(row.shape[-1],rule)
+        mask = idx >= 0
+        a[...,idx[mask]] = row[...,mask]
+
+    def select(self, a, rules, out=None, tile=PACKED_TILE):
+        if out is None:
+            out = self.alloc(a.shape[:-1],len(rules),a.dtype)
+        for start in range(0,out.shape[-1],tile):
+            stop = min(start+tile,out.shape[-1])
+            I, J = pair_rows(np.arange(start,stop))
+            out[...,start:stop] = a[...,pair_index(rules[I],rules[J])]
+        return out
+
+    def to_dense(self, a, n):
+        ''' Returns the values as n x n matrices (upper triangle filled) '''
+        res = np.zeros(a.shape[:-1]+(n,n),dtype=a.dtype)
+        I, J = np.triu_indices(n,k=1)
+        res[...,I,J] = a[...,pair_index(I,J)]
+        return res
+
+DENSE = DenseLayout()
+PACKED = PackedLayout()
@@ -0,0 +1,105 @@
+import os
+import json
+import numpy as np
+
+import parallel
+import columns
+from connection import *
+
+class Storage:
+    ''' Directory holding idm and pm in .npy files mapped in memory (np.memmap), for rule sets too large for the RAM
+        Each allocation creates a new file, the files of a name are deleted when the second next one is allocated
+        (the previous buffer being still read while the new one is filled).
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory,exist_ok=True)
+        self.files = {} #name -> paths of the files allocated for that name, the last one being in use
+        self.generation = 0
+
+    def path(self, file_name):
+        return os.path.join(self.directory,file_name)
+
+    def _track(self, name, path):
+        ''' Record that 'path' holds the buffer 'name' and delete the files of 'name' that are no longer used '''
+        paths = self.files.setdefault(name,[])
+        while len(paths) > 1:
+            old = paths.pop(0)
+            if os.path.exists(old) and old != path:
+                os.remove(old) #the pages still mapped stay readable until the array is released
+        paths.append(path)
+
+    def alloc(self, name, shape, dtype):
+        ''' Returns a new zeroed np.memmap of the given shape stored in the directory '''
+        self.generation += 1
+        path = self.path(name+'.'+str(self.generation)+'.npy')
+        a = np.lib.format.open_memmap(path,mode='w+',dtype=dtype,shape=tuple(shape))
+        self._track(name,path)
+        return a
+
+    def _build_paths(self, generation):
+        ''' Paths of the files of idm, pm and of the tiles that are done for the build of a generation '''
+        return {name: self.path(name+'.'+str(generation)+'.npy') for name in ['idm','pm','progress']}
+
+    def build(self, cols, layout, n, workers=1, tile=parallel.TASK_PAIRS):
+        ''' Returns idm and pm (np.memmap) of the rules held by 'cols' (typed columns, the recommendation first),
+            computed tile by tile so that only the pages of the current tiles need to be in memory.
+            The tiles that are done are recorded in a checkpoint (flushed after each tile): if the build is interrupted,
+            calling build again with the same rules resumes it. The checkpoint is removed once the build is complete.
+            Like alloc, each build writes new files, only the files of a matching checkpoint are reused.
+            @workers: number of processes computing the tiles (see parallel.run)
+        '''
+        workers = parallel.check_workers(workers)
+        key = fingerprint(cols,layout,n)
+        tasks = parallel.tasks(n,layout.packed,1,tile)
+        checkpoint = self.path('build.json')
+        state = None
+        if os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                state = json.load(f)
+        resume = False
+        if state is not None and 'generation' in state:
+            paths = self._build_paths(state['generation'])
+            resume = state['key'] == key and state['tasks'] == len(tasks) and all(os.path.exists(p) for p in paths.values())
+            if not resume:
+                #files of an interrupted build of other rules, unless they are in use
+                in_use = [p for used in self.files.values() for p in used]
+                for p in paths.values():
+                    if os.path.exists(p) and p not in in_use:
+                        os.remove(p)
+        if resume:
+            #the files of the checkpoint are kept, the next ones are numbered after them
+            self.generation = max(self.generation,state['generation'])
+            idm, pm, progress = [np.load(paths[name],mmap_mode='r+') for name in ['idm','pm','progress']]
+        else:
+            #new files, so that the matrices and the views of a previous build still mapped in memory are left intact
+            self.generation += 1
+            paths = self._build_paths(self.generation)
+            idm = np.lib.format.open_memmap(paths['idm'],mode='w+',dtype=np.int8,shape=(len(cols),)+layout.shape(n))
+            pm = np.lib.format.open_memmap(paths['pm'],mode='w+',dtype=PM_DTYPE,shape=(PM_ROWS,)+layout.shape(n))
+            progress = np.lib.format.open_memmap(paths['progress'],mode='w+',dtype=np.uint8,shape=(len(tasks),))
+            with open(checkpoint,'w') as f:
+                json.dump({'key': key, 'tasks': len(tasks), 'generation': self.generation},f)
+        todo = [(t, task) for t, task in enumerate(tasks) if not progress[t]]
+        if workers == 1:
+            for t, task in todo:
+                parallel.fill_task(cols,n,layout.packed,idm,pm,task)
+                idm.flush()
+                pm.flush()
+                progress[t] = 1
+                progress.flush()
+        else:
+            specs = [('file',paths['idm'],None,None),('file',paths['pm'],None,None)]
+            for t in parallel.run(cols,n,layout.packed,specs,todo,workers):
+                progress[t] = 1 #the worker flushed the tile before returning
+                progress.flush()
+        del progress
+        os.remove(checkpoint)
+        os.remove(paths['progress'])
+        self._track('idm',paths['idm'])
+        self._track('pm',paths['pm'])
+        return idm, pm
+
+def fingerprint(cols, layout, n):
+    ''' Hash of the values of the rules and of the layout, identifying the matrices computed from them '''
+    return columns.fingerprint(cols) + ('-packed' if layout.packed else '-dense') + '-' + str(n)
@@ -0,0 +1,146 @@
+import os
+import numpy as np
+import multiprocessing as mp
+
+import kernel
+from relation import *
+from connection import *
+from layout import pair_count, pair_rows
+
+#Number of tasks given to each worker on average, the pool balances them between the workers
+TASKS_PER_WORKER = 4
+#Maximal number of pairs of a task (bounds the size of the temporary arrays of each worker)
+TASK_PAIRS = 1 << 18
+
+_worker = {} #state of a worker process, set by _init
+
+def _shared(shape, dtype):
+    ''' Returns a new zeroed array in shared memory and the SharedMemory holding it '''
+    from multiprocessing import shared_memory #python 3.8+, only needed with several workers
+    shm = shared_memory.SharedMemory(create=True,size=max(int(np.prod(shape))*np.dtype(dtype).itemsize,1))
+    a = np.ndarray(shape,dtype=dtype,buffer=shm.buf)
+    a[...] = 0
+    return a, shm
+
+def _attach(spec):
+    ''' Returns the array described by 'spec': ('shm', name, shape, dtype) for shared memory
+        or ('file', path, shape, dtype) for a .npy file mapped in memory
+    '''
+    kind, name, shape, dtype = spec
+    if kind == 'file':
+        return np.load(name,mmap_mode='r+'), None
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape,dtype=dtype,buffer=shm.buf), shm
+
+def _init(cols, n, packed, idm_spec, pm_spec):
+    ''' Initializer of the worker processes: attach the shared idm and pm, the columns are only sent once per worker '''
+    _worker['cols'] = cols
+    _worker['n'] = n
+    _worker['packed'] = packed
+    for key, spec in [('idm',idm_spec),('pm',pm_spec)]:
+        #the SharedMemory keeps the memory mapped as long as the worker lives
+        _worker[key], _worker[key+'_shm'] = _attach(spec)
+
+def _fill(task):
+    ''' Fill one task in a worker process and return its number '''
+    number, pairs = task
+    fill_task(_worker['cols'],_worker['n'],_worker['packed'],_worker['idm'],_worker['pm'],pairs)
+    if isinstance(_worker['idm'],np.memmap):
+        _worker['idm'].flush()
+        _worker['pm'].flush()
+    return number
+
+def fill_task(cols, n, packed, idm, pm, task):
+    ''' Compute the IDC's of all attributes and the PM counters (unless pm is None) of the pairs of one task.
+        @task: (start, stop) range of pairs (packed) or of rows of the upper triangle (dense), a dense task may also be
+               (start, stop, first) to only compute the columns first ... n-1 of its rows
+        Tasks cover disjoint pairs, so the result doesn't depend on the order in which they are done,
+        and the counters of the task are reset first, so that a task can be computed again (see mapped.Storage.build).
+    '''
+    start, stop = task[:2]
+    if packed:
+        I, J = pair_rows(np.arange(start,stop))
+        pairs = (Ellipsis,slice(start,stop))
+        valid = True
+    else:
+        #rows start ... stop-1 of the upper triangle
+        first = task[2] if len(task) > 2 else start+1
+        I = np.arange(start,stop)[:,None]
+        J = np.arange(first,n)[None,:]
+        pairs = (Ellipsis,slice(start,stop),slice(first,n))
+        valid = J > I
+    if pm is not None:
+        pm[pairs] = 0
+    for k in range(len(cols)):
+        idc = kernel.idc_pairs(cols[k],I,J,rec=(k == 0))
+        idc = np.where(valid,idc,0).astype(np.int8)
+        idm[k][pairs] = idc
+        if pm is None:
+            continue
+        elif k == 0:
+            pm[PM_DIFF_REC][pairs] = (idc == Relation.DIFF_REC.value) & valid
+        else:
+            for r, rel in enumerate(PM_RELATIONS):
+                pm[r][pairs] += (idc == rel.value) & valid
+
+def tasks(n, packed, workers, tile=TASK_PAIRS):
+    ''' Split the pairs of n rules in tasks of about the same number of pairs (at most 'tile')
+        Returns a list of (start, stop): ranges of pair indexes (packed) or of rows of the upper triangle (dense)
+    '''
+    total = pair_count(n)
+    size = max(1,min(tile,-(-total//(TASKS_PER_WORKER*workers))))
+    if packed:
+        return [(start,min(start+size,total)) for start in range(0,total,size)]
+    #row i holds n-1-i pairs, rows are cut where the number of pairs before them crosses a multiple of 'size'
+    before = np.cumsum(np.arange(n-1,-1,-1)) - np.arange(n-1,-1,-1)
+    bounds = np.unique(np.concatenate(([0],np.searchsorted(before,np.arange(size,total,size)),[n-1])))
+    return [(int(start),int(stop)) for start, stop in zip(bounds[:-1],bounds[1:])]
+
+def new_rules_tasks(start, n, packed, tile=TASK_PAIRS):
+    ''' Tasks (see fill_task) computing the pairs made of rules start ... n-1 and the rules before them
+        (the pairs of rules that are added at the end of a rule set)
+    '''
+    if packed:
+        return [(a,min(a+tile,pair_count(n))) for a in range(pair_count(start),pair_count(n),tile)]
+    rows = max(1,tile//max(n-start,1))
+    return [(a,min(a+rows,n-1),start) for a in range(0,n-1,rows)]
+
+def check_workers(workers):
+    ''' Returns the number of workers to use (os.cpu_count() if None), raises a ValueError if it is lower than 1 '''
+    workers = os.cpu_count() if workers is None else workers
+    if workers < 1:
+        raise ValueError("The number of workers must be at least 1. workers="+str(workers))
+    return workers
+
+def run(cols, n, packed, specs, numbered_tasks, workers):
+    ''' Compute the tasks (number, (start, stop)) with a pool of 'workers' processes writing in the arrays
+        described by specs (see _attach), yields the number of each task once it is done
+    '''
+    with mp.get_context().Pool(workers,initializer=_init,initargs=(cols,n,packed)+tuple(specs)) as pool:
+        for number in pool.imap_unordered(_fill,numbered_tasks):
+            yield number
+
+def build(cols, layout, n, workers=None):
+    ''' Returns the idm and pm of the rules held by 'cols' (typed columns, the recommendation first) with 'layout',
+        computed by a pool of 'workers' processes (os.cpu_count() if None).
+        The workers write directly into idm and pm in shared memory, only the columns are sent to them.
+        The returned arrays are copies of the shared ones, which are released before returning.
+    '''
+    workers = check_workers(workers)
+    idm, idm_shm = _shared((len(cols),)+layout.shape(n),np.int8)
+    try:
+        pm, pm_shm = _shared((PM_ROWS,)+layout.shape(n),PM_DTYPE)
+        try:
+            specs = [('shm',shm.name,a.shape,a.dtype) for shm, a in [(idm_shm,idm),(pm_shm,pm)]]
+            for done in run(cols,n,layout.packed,specs,list(enumerate(tasks(n,layout.packed,workers))),workers):
+                pass
+            return np.array(idm), np.array(pm)
+        finally:
+            del pm
+            pm_shm.close()
+            pm_shm.unlink()
+    finally:
+        del idm
+        idm_shm.close()
+        idm_shm.unlink()
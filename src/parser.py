@@ -1,7 +1,17 @@
 import pandas as pd
 import csv
+import queue
+import threading
 import numpy as np
 
+from columns import *
+import profiling
+
+#Names of the column holding the recommendations, whose values are kept as strings
+REC_NAMES = ('Rec','Recommendation')
+#Number of rules of the chunks read by read_chunks
+CHUNK_ROWS = 10000
+
 def parse_val(val):
     '''Parse string value and change it to appropriate type to be manipulated by RuleSet functions
         Accepted formats: "false" and "true" case insensitive, 'nan', '', "*", string representation of pandas.Interval
@@ -33,7 +43,7 @@ def parse_interval(val):
     #get left value
     left_str = ''
     i = 1
-    while val[i] is not ',':
+    while val[i] != ',':
         left_str += val[i]
         i+=1
         if i==len(val):
@@ -54,6 +64,7 @@ def parse_interval(val):
         raise ValueError("Value given doesn't have the proper format for pandas.Interval: " + str(val))
     return pd.Interval(left_val, right_val, closed)
 
+@profiling.timed('parser.parse_csv')
 def parse_csv(csv_name):
     #Possible to improve this function by checking that values in one column all have the same type
     ''' Parse csv and returns list of dictionnaries representing the rules'''
@@ -72,3 +83,163 @@ def parse_csv(csv_name):
     return rules
 
 
+
+def parse_cell(val):
+    ''' Parse one value of a csv file the way parse_csv does '''
+    try:
+        return float(val)
+    except ValueError:
+        return parse_val(val)
+
+def parse_column(strings):
+    ''' Returns the typed column (see columns.py) holding the values of a sequence of strings read from a csv file
+        Cells are classified and converted by vectorized numpy operations (wildcard, bool, number, interval).
+        Columns with values of different kinds or that can't be converted are parsed cell by cell by parse_cell,
+        so that they are accepted or rejected (ValueError, TypeError) as by parse_csv.
+    '''
+    arr = np.asarray(strings,dtype=str)
+    col = _vectorized_column(arr)
+    if col is None:
+        col = encode_column([parse_cell(val) for val in arr])
+    return col
+
+def _vectorized_column(arr):
+    ''' Returns the typed column of an array of strings converted by vectorized operations (see parse_column),
+        None if its values have different kinds or can't be converted that way
+    '''
+    #only the strings that may be 'nan', 'true' or 'false' are lowered
+    words = np.flatnonzero((np.char.str_len(arr) >= 3) & (np.char.str_len(arr) <= 5))
+    low = np.full(len(arr),'',dtype='U5')
+    low[words] = np.char.lower(arr[words])
+    wild = (arr == '') | (arr == '*') | (low == 'nan')
+    is_bool = (low == 'true') | (low == 'false')
+    is_interval = np.isin(arr.astype('U1'),['(','[',']']) #first character
+    is_number = ~(wild | is_bool | is_interval)
+    kinds = [kind for kind, mask in [(NUMBER,is_number),(BOOL,is_bool),(INTERVAL,is_interval)] if mask.any()]
+    col = None
+    if len(kinds) == 0:
+        col = EmptyColumn.empty(len(arr))
+    elif len(kinds) > 1:
+        pass #different kinds, TypeError raised by encode_column
+    elif kinds[0] == NUMBER:
+        try:
+            values = np.where(wild,'nan',arr).astype(np.float64)
+            #strings such as ' nan' are converted to unspecified values
+            col = EmptyColumn.empty(len(arr)) if np.isnan(values).all() else NumberColumn(values)
+        except ValueError:
+            pass
+    elif kinds[0] == BOOL:
+        col = BoolColumn(np.where(is_bool,low == 'true',-1).astype(np.int8))
+    else:
+        intervals = _parse_intervals(arr[is_interval])
+        if intervals is not None:
+            col = IntervalColumn.empty(len(arr))
+            col.left[is_interval], col.right[is_interval], col.closed[is_interval] = intervals
+    return col
+
+def _parse_intervals(arr):
+    ''' Returns the arrays (left, right, closed) of an array of strings representing intervals (see parse_interval),
+        None if one of them can't be converted (parse_interval then gives the error)
+        Strings are handled as a 2D array of characters, in which the endpoints are cut out around the comma
+    '''
+    n = len(arr)
+    w = arr.dtype.itemsize // 4
+    chars = np.ascontiguousarray(arr).view(np.uint32).reshape(n,w)
+    length = np.count_nonzero(chars,axis=1)
+    last = chars[np.arange(n),length-1]
+    is_comma = chars == ord(',')
+    if not ((is_comma.sum(axis=1) == 1) & np.isin(last,[ord(')'),ord(']'),ord('[')])).all():
+        return None
+    comma = is_comma.argmax(axis=1)[:,None]
+    pos = np.arange(w)[None,:]
+    #left endpoint: characters 1 ... comma-1, right endpoint: characters comma+1 ... length-2
+    left_chars = np.where(pos[:,:-1] < comma - 1,chars[:,1:],np.uint32(0))
+    idx = np.minimum(comma + 1 + pos,w-1)
+    right_chars = np.where(comma + 1 + pos < length[:,None] - 1,chars[np.arange(n)[:,None],idx],np.uint32(0))
+    try:
+        left = left_chars.view((np.str_,w-1)).ravel().astype(np.float64)
+        right = right_chars.view((np.str_,w)).ravel().astype(np.float64)
+    except ValueError:
+        return None
+    if not (left <= right).all(): #also false for nan endpoints
+        return None
+    closed = np.where(chars[:,0] == ord('['),CLOSED_LEFT,0) | np.where(last == ord(']'),CLOSED_RIGHT,0)
+    return left, right, closed.astype(np.uint8)
+
+@profiling.timed('parser.parse_columns')
+def parse_columns(csv_name):
+    ''' Parse csv and returns a ColumnStore holding the rules, built column by column without creating one object per value
+        (same values and errors as RuleSet(parse_csv(csv_name)), see parse_column)
+    '''
+    with open(csv_name,'r') as csv_file:
+        if csv_file.readline() == '':
+            return ColumnStore() #empty file
+    frame = pd.read_csv(csv_name,dtype=str,keep_default_na=False,na_filter=False,index_col=False)
+    return _parse_frame(frame)
+
+def _parse_frame(frame):
+    ''' Returns the ColumnStore of a DataFrame of strings read from a csv file '''
+    if len(frame) == 0:
+        return ColumnStore()
+    names = list(frame.columns)
+    cols = []
+    for name in names:
+        if name in REC_NAMES:
+            codes, categories = pd.factorize(frame[name])
+            cols.append(CategoryColumn(codes.astype(np.int32),list(categories)))
+        else:
+            cols.append(_vectorized_column(np.asarray(frame[name],dtype=str)))
+    slow = [k for k in range(len(cols)) if cols[k] is None]
+    if len(slow) > 0:
+        #cells parsed row by row before the kinds of the columns are checked, so that the first error
+        #is the one of parse_csv: the first value that can't be parsed, otherwise the first column mixing kinds
+        rows = [[parse_cell(val) for val in row] for row in zip(*[frame[names[k]] for k in slow])]
+        for i, k in enumerate(slow):
+            cols[k] = encode_column([row[i] for row in rows])
+    return ColumnStore(names,cols)
+
+def read_chunks(csv_name, chunk_rows=CHUNK_ROWS):
+    ''' Parse csv by chunks of 'chunk_rows' rules, yields a ColumnStore per chunk (see parse_columns)
+        Only one chunk is in memory at a time, they can be given to RuleSet.from_chunks
+    '''
+    with open(csv_name,'r') as csv_file:
+        if csv_file.readline() == '':
+            return #empty file
+    with pd.read_csv(csv_name,dtype=str,keep_default_na=False,na_filter=False,index_col=False,chunksize=chunk_rows) as reader:
+        for frame in reader:
+            yield _parse_frame(frame)
+
+def prefetch(iterable, depth=1):
+    ''' Iterate over 'iterable' in a background thread producing up to 'depth' items in advance,
+        so that producing them (e.g. reading and parsing a file) overlaps with their use.
+        Exceptions raised by the producer are raised again to the consumer.
+    '''
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item,timeout=0.1)
+                return
+            except queue.Full:
+                pass
+    def produce():
+        try:
+            for item in iterable:
+                put((True,item))
+                if stop.is_set():
+                    return
+            put((False,None))
+        except BaseException as e:
+            put((False,e))
+    threading.Thread(target=produce,daemon=True).start()
+    try:
+        while True:
+            more, item = items.get()
+            if not more:
+                if item is not None:
+                    raise item
+                return
+            yield item
+    finally:
+        stop.set() #the producer stops if the consumer stops early
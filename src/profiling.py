@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import atexit
+import functools
+import tracemalloc
+
+#Environment variable holding the name of a json file: if it is set, profiling is enabled at import and dumped at exit
+ENVIRONMENT_VARIABLE = 'RIT_PROFILE'
+
+class _Profile:
+    ''' Statistics of the operations recorded while profiling is enabled '''
+    def __init__(self, memory):
+        self.memory = memory #if True, allocated bytes are traced (tracemalloc), which slows down allocations
+        self.tracing = False #True if tracemalloc was started by this profile
+        self.operations = {} #name -> {'calls', 'seconds', 'bytes'}
+        self.stack = [] #peak of traced memory of the operations in progress, the innermost last
+
+_profile = None #current _Profile, None when profiling is disabled
+_last = None #last _Profile, kept when profiling is disabled
+_offset = 0 #memory traced before tracemalloc was last restarted by _reset_peak, added to what it measures
+
+def _traced():
+    ''' Returns the current and peak traced memory (bytes) '''
+    current, peak = tracemalloc.get_traced_memory()
+    return current + _offset, peak + _offset
+
+def _reset_peak():
+    ''' Set the peak of traced memory to the current traced memory '''
+    global _offset
+    if hasattr(tracemalloc,'reset_peak'):
+        tracemalloc.reset_peak()
+    else:
+        #Python < 3.9: restarting the tracing resets the peak, the memory traced so far is kept as an offset
+        _offset += tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        tracemalloc.start()
+
+def enable(memory=True):
+    ''' Start recording the operations (see timed and section), discarding the previous statistics
+        @memory: if True, the peak of bytes allocated by each operation is recorded too
+    '''
+    global _profile, _offset
+    disable()
+    _profile = _Profile(memory)
+    _offset = 0
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _profile.tracing = True
+
+def disable():
+    ''' Stop recording, the statistics recorded stay available (see stats) '''
+    global _profile, _last
+    if _profile is not None:
+        if _profile.tracing:
+            tracemalloc.stop()
+        _last = _profile
+        _profile = None
+
+def enabled():
+    return _profile is not None
+
+def stats():
+    ''' Returns the statistics recorded by the current or last profiling:
+        {name: {'calls': number of calls, 'seconds': total wall time,
+                'bytes': sum over the calls of the peak of memory allocated during the call (None if not traced)}}
+        Operations are named after their method (e.g. 'RuleSet.build_IDM'),
+        the sections of an operation after it (e.g. 'RuleSet.build_IDM/Rec' for the IDC's of attribute Rec)
+    '''
+    profile = _profile if _profile is not None else _last
+    if profile is None:
+        return {}
+    return {name: dict(op) for name, op in sorted(profile.operations.items())}
+
+def dump(file_name):
+    ''' Write the statistics (see stats) in a json file '''
+    with open(file_name,'w') as f:
+        json.dump(stats(),f,indent=1)
+
+class _Record:
+    ''' Context manager recording one call of operation 'name' in the current profile '''
+    __slots__ = ('name','profile','start','base')
+
+    def __init__(self, name):
+        self.name = name
+        self.profile = _profile
+
+    def __enter__(self):
+        profile = self.profile
+        if profile.memory:
+            current, peak = _traced()
+            if profile.stack:
+                profile.stack[-1] = max(profile.stack[-1],peak) #the peak of the enclosing operation so far
+            _reset_peak()
+            profile.stack.append(current)
+            self.base = current
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        profile = self.profile
+        if profile is not _profile: #disabled or enabled again during the operation
+            return False
+        op = profile.operations.get(self.name)
+        if op is None:
+            op = profile.operations[self.name] = {'calls': 0, 'seconds': 0.0, 'bytes': 0 if profile.memory else None}
+        op['calls'] += 1
+        op['seconds'] += seconds
+        if profile.memory:
+            peak = max(profile.stack.pop(),_traced()[1])
+            op['bytes'] += peak - self.base
+            if profile.stack:
+                profile.stack[-1] = max(profile.stack[-1],peak)
+            _reset_peak()
+        return False
+
+class _Nothing:
+    ''' Context manager doing nothing, returned by section when profiling is disabled '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_nothing = _Nothing()
+
+def section(name):
+    ''' Context manager recording the block it holds as operation 'name' if profiling is enabled '''
+    if _profile is None:
+        return _nothing
+    return _Record(name)
+
+def timed(name):
+    ''' Decorator recording each call of the function as operation 'name' if profiling is enabled
+        When it is disabled, the only overhead is one test per call.
+    '''
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if _profile is None:
+                return f(*args,**kwargs)
+            with _Record(name):
+                return f(*args,**kwargs)
+        return wrapper
+    return decorator
+
+if os.environ.get(ENVIRONMENT_VARIABLE):
+    enable()
+    atexit.register(lambda: dump(os.environ[ENVIRONMENT_VARIABLE]))
@@ -0,0 +1,162 @@
+import numpy as np
+
+from columns import *
+
+#Fraction of the rules that may be missing from the index of an attribute (added or modified since it was built)
+#before it is rebuilt, these rules being checked one by one by the queries
+REBUILD_FRACTION = 1/16
+#Number of such rules that never triggers a rebuild
+REBUILD_MIN = 64
+
+def accepts(col, rules, x):
+    ''' Returns the boolean mask of the rules (array of indexes) whose value of 'col' accepts value 'x'
+        (unspecified values accept everything, intervals accept the numbers they contain, other values are compared)
+    '''
+    if col.kind == EMPTY:
+        return np.ones(len(rules),dtype=bool)
+    na = col.na[rules]
+    if col.kind == INTERVAL:
+        left, right, closed = col.left[rules], col.right[rules], col.closed[rules]
+        above = (left < x) | ((left == x) & (closed & CLOSED_LEFT != 0))
+        below = (x < right) | ((x == right) & (closed & CLOSED_RIGHT != 0))
+        return na | (above & below)
+    if col.kind == CATEGORY:
+        return na | (col.codes[rules] == col._index.get(x,-2))
+    return na | (col.keys[rules] == x)
+
+def check_value(col, name, x):
+    ''' Raises a TypeError if value 'x' of an observation can't be compared with the values of column 'col' '''
+    if col.kind == INTERVAL or col.kind == NUMBER:
+        ok = isinstance(x,(int,float,np.integer,np.floating)) and not isinstance(x,(bool,np.bool_))
+    elif col.kind == BOOL:
+        ok = isinstance(x,(bool,np.bool_))
+    else:
+        ok = True
+    if not ok:
+        raise TypeError("Value "+str(x)+" of type "+str(type(x))+" can't be matched with attribute '"+str(name)+"' of kind '"+col.kind+"'.")
+
+class AttributeIndex:
+    ''' Index of the values of rules 0 ... size-1 for one attribute:
+        intervals sorted by left endpoint and by right endpoint, other values sorted by key, and the unspecified values.
+        The rules modified since the index was built are 'dirty': the index ignores them and queries check them directly.
+    '''
+    def __init__(self, col):
+        self.size = len(col)
+        self.dirty = set()
+        self.wild = np.flatnonzero(col.na)
+        specified = np.flatnonzero(~col.na)
+        if col.kind == INTERVAL:
+            self.by_left = specified[np.argsort(col.left[specified],kind='stable')]
+            self.lefts = col.left[self.by_left]
+            self.by_right = specified[np.argsort(col.right[specified],kind='stable')]
+            self.rights = col.right[self.by_right]
+        elif col.kind != EMPTY:
+            keys = col.codes if col.kind == CATEGORY else col.keys
+            self.rules = specified[np.argsort(keys[specified],kind='stable')]
+            self.keys = keys[self.rules]
+
+    def _range(self, col, x):
+        ''' Returns the rules of the index whose values may accept x (a superset for intervals) '''
+        if col.kind == EMPTY:
+            return self.wild[:0]
+        if col.kind == INTERVAL:
+            #left <= x and right >= x, from the smallest of the two sets
+            p = np.searchsorted(self.lefts,x,side='right')
+            q = np.searchsorted(self.rights,x,side='left')
+            return self.by_left[:p] if p <= len(self.rights) - q else self.by_right[q:]
+        key = col._index.get(x,-2) if col.kind == CATEGORY else x
+        return self.rules[np.searchsorted(self.keys,key,side='left'):np.searchsorted(self.keys,key,side='right')]
+
+    def count(self, col, x):
+        ''' Upper bound of the number of indexed rules accepting x, in O(log n) '''
+        return len(self._range(col,x)) + len(self.wild)
+
+    def candidates(self, col, x):
+        ''' Returns the indexed rules (dirty ones excluded) whose values accept x, in no particular order '''
+        rules = self._range(col,x)
+        rules = np.concatenate((rules[accepts(col,rules,x)],self.wild))
+        if self.dirty:
+            rules = rules[~np.isin(rules,np.fromiter(self.dirty,dtype=np.int64))]
+        return rules
+
+    def pending(self, n):
+        ''' Rules missing from the index (dirty or added after it was built) '''
+        return np.concatenate((np.fromiter(sorted(self.dirty),dtype=np.int64),np.arange(self.size,n,dtype=np.int64)))
+
+    def delete(self, rule):
+        ''' Remove 'rule' from the index, the following rules being numbered one less '''
+        if rule >= self.size:
+            return
+        def remove(rules):
+            rules = rules[rules != rule]
+            return rules - (rules > rule)
+        self.wild = remove(self.wild)
+        for name in [('by_left','lefts'),('by_right','rights'),('rules','keys')]:
+            if hasattr(self,name[0]):
+                rules = getattr(self,name[0])
+                keep = rules != rule
+                setattr(self,name[1],getattr(self,name[1])[keep])
+                setattr(self,name[0],remove(rules))
+        self.dirty = {d - (d > rule) for d in self.dirty if d != rule}
+        self.size -= 1
+
+class RuleIndex:
+    ''' Indexes of the attributes of a rule set answering which rules accept an observation (see match)
+        The index of an attribute is built the first time it is queried and kept up to date by the RuleSet
+        (changed, deleted): added and modified rules are checked directly until they are too many, then it is rebuilt.
+    '''
+    def __init__(self):
+        self.attributes = {} #attr -> AttributeIndex
+
+    def changed(self, rule, attr):
+        ''' The value of 'rule' for attribute 'attr' was modified '''
+        index = self.attributes.get(attr)
+        if index is not None and rule < index.size:
+            index.dirty.add(rule)
+
+    def deleted(self, rule):
+        for index in self.attributes.values():
+            index.delete(rule)
+
+    def _index(self, store, attr):
+        index = self.attributes.get(attr)
+        missing = 0 if index is None else len(index.dirty) + store.n - index.size
+        if index is None or missing > max(REBUILD_MIN,REBUILD_FRACTION*store.n):
+            index = self.attributes[attr] = AttributeIndex(store.cols[attr])
+        return index
+
+    def match(self, store, values):
+        ''' Returns the sorted array of the rules of ColumnStore 'store' accepting every value of the observation 'values'
+            @values: dictionnary {attribute name: value}, unspecified values (nan or None) and missing attributes accept all rules
+            The candidates of the most selective attribute (estimated from its index) are listed,
+            then filtered by the values of the other attributes: O(log n + k.m) for k candidates.
+            Raises a ValueError for unknown attributes or the recommendation, a TypeError for values of the wrong type.
+        '''
+        conditions = []
+        for name, x in values.items():
+            if name not in store.names:
+                raise ValueError("Attribute given doesn't exist. attr="+str(name))
+            attr = store.names.index(name)
+            if attr == 0:
+                raise ValueError("The recommendation can't be a condition of a query")
+            if is_na(x):
+                continue
+            col = store.cols[attr]
+            check_value(col,name,x)
+            if col.kind != EMPTY:
+                conditions.append((attr,col,x))
+        if len(conditions) == 0:
+            return np.arange(store.n)
+        estimates = []
+        for attr, col, x in conditions:
+            index = self._index(store,attr)
+            estimates.append(index.count(col,x) + len(index.dirty) + store.n - index.size)
+        order = np.argsort(estimates,kind='stable')
+        attr, col, x = conditions[order[0]]
+        index = self.attributes[attr]
+        pending = index.pending(store.n)
+        rules = np.concatenate((index.candidates(col,x),pending[accepts(col,pending,x)]))
+        for k in order[1:]:
+            attr, col, x = conditions[k]
+            rules = rules[accepts(col,rules,x)]
+        return np.sort(rules)
@@ -0,0 +1,92 @@
+import numpy as np
+
+import kernel
+import sparse
+from layout import pair_count, pair_rows
+from relation import *
+from columns import ColumnStore
+
+class Subsumptions:
+    ''' Rules subsumed by another rule with the same recommendation, i.e. whose value of every attribute is equal to
+        or included in the value of the other rule (connections EQUAL_SAME and INCLUSION_SAME)
+        @rules, @by: rule rules[k] is subsumed by rule by[k], sorted by rules then by
+        @equal: True for the pairs of equal rules, in which case by[k] < rules[k] (the first of equal rules is kept)
+    '''
+    def __init__(self, n, rules, by, equal):
+        self.n = n
+        self.rules = rules
+        self.by = by
+        self.equal = equal
+
+    def __len__(self):
+        return len(self.rules)
+
+    @property
+    def redundant(self):
+        ''' Sorted array of the rules subsumed by at least one other rule, which can be removed without changing
+            the recommendations given for any situation
+        '''
+        return np.unique(self.rules)
+
+    @property
+    def kept(self):
+        ''' Boolean mask of the rules that are not redundant '''
+        keep = np.ones(self.n,dtype=bool)
+        keep[self.rules] = False
+        return keep
+
+def _group_pairs(cols, n):
+    ''' Returns the pairs (I,J), I < J, of the n rules of one group (columns of its attributes) such that the value of every
+        attribute of one rule is within the value of the other, and whether I is within J and J within I
+        Candidates are listed for the attribute with the fewest of them from its sorted endpoints (see sparse.candidate_pairs),
+        then filtered by the other attributes from the most to the least selective
+    '''
+    attrs = sorted(range(len(cols)),key=lambda k: sparse.estimate_pairs(cols[k]))
+    if len(attrs) == 0:
+        I, J = pair_rows(np.arange(pair_count(n)))
+    else:
+        I, J = sparse.candidate_pairs(cols[attrs[0]])
+    ij = np.ones(len(I),dtype=bool)
+    ji = np.ones(len(I),dtype=bool)
+    for k in attrs:
+        idc = kernel.idc_pairs(cols[k],I,J)
+        equal = idc == Relation.EQUALITY.value
+        ij &= equal | (idc == Relation.INCLUSION_IJ.value)
+        ji &= equal | (idc == Relation.INCLUSION_JI.value)
+        keep = ij | ji
+        I = I[keep]; J = J[keep]; ij = ij[keep]; ji = ji[keep]
+    return I, J, ij, ji
+
+def subsumptions(store):
+    ''' Returns the Subsumptions of the rules of ColumnStore 'store' (recommendation first), without building idm and pm
+        Rules are grouped by recommendation code (rules without recommendation are never subsumed, as in the PM)
+        and the pairs of each group are found by a sweep over its sorted endpoints: O(n log n + k.m)
+        for k candidate pairs of the most selective attribute of each group.
+    '''
+    n = store.n
+    rules, by, equal = [np.zeros(0,dtype=np.int64)], [np.zeros(0,dtype=np.int64)], [np.zeros(0,dtype=bool)]
+    if n < 2:
+        return Subsumptions(n,rules[0],by[0],equal[0])
+    recs = store.cols[0]
+    specified = np.flatnonzero(~recs.na)
+    order = specified[np.argsort(recs.keys[specified],kind='stable')]
+    codes, starts, sizes = np.unique(recs.keys[order],return_index=True,return_counts=True)
+    for start, size in zip(starts,sizes):
+        if size < 2:
+            continue
+        group = order[start:start+size] #sorted rules, so that I < J in the group means I < J in the rule set
+        I, J, ij, ji = _group_pairs([col.take(group) for col in store.cols[1:]],size)
+        I, J = group[I], group[J]
+        same = ij & ji
+        #the later of two equal rules is subsumed by the first one
+        rules.append(np.concatenate((I[ij & ~ji],J[ji])))
+        by.append(np.concatenate((J[ij & ~ji],I[ji])))
+        equal.append(np.concatenate((np.zeros(int(np.sum(ij & ~ji)),dtype=bool),same[ji])))
+    rules, by, equal = np.concatenate(rules), np.concatenate(by), np.concatenate(equal)
+    order = np.lexsort((by,rules))
+    return Subsumptions(n,rules[order],by[order],equal[order])
+
+def pruned_store(store, subsumed):
+    ''' Returns a ColumnStore holding the rules of 'store' that are not redundant (see Subsumptions.redundant) '''
+    keep = subsumed.kept
+    return ColumnStore(list(store.names),[col.take(keep) for col in store.cols])
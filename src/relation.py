@@ -8,4 +8,8 @@ class Relation(Enum):
     OVERLAP = 6 #Overlap must equal to INCLUSION_IJ*INCLUSION_JI
     SAME_REC = 1
     DIFF_REC = -1
-    #SAME_REC and DIFF_REC must have opposite signe and have absolute value of 1
\ No newline at end of file
+    #SAME_REC and DIFF_REC must have opposite signe and have absolute value of 1
+
+#Version of the semantics of the relations and of the matrices computed from them (idm, pm),
+#to increase when they change so that the matrices stored by cache.Cache are not used anymore
+SEMANTICS_VERSION = 1
@@ -1,46 +1,256 @@
 import numpy as np
 import pandas as pd
+import collections as col
 
 from relation import *
 from connection import *
+import kernel
+import sparse
+import parallel
+import mapped
+import parser
+import rulefile
+import profiling
+import query
+import redundancy
+from layout import DENSE, PACKED
+from columns import ColumnStore, encode_column, EMPTY
+
+#Number of connection vectors of reference rules kept by RuleSet.connections_for
+REFERENCE_CACHE_SIZE = 16
+#Fraction of deleted rules in the buffers of idm and pm above which RuleSet.delete_rule compacts them
+DELETED_FRACTION = 0.25
 
 class RuleSet:
+    ''' Rules are numbered from 0 to n-1 in the order they were added (the order of the rows shown by the GUI).
+        Deleting rule r gives numbers r ... n-2 to the rules that followed it, all methods use this numbering.
+        Internally, deleted rules are only marked as such in idm and pm (tombstones) until they are compacted.
+    '''
     #############################
     # Methods to build rule set #
     #############################
-    def __init__(self,rules_list):
-        ''' @rules_list: list of ordered dictionnaries each representing a rule with their attributes as keys'''
-        self.set = pd.DataFrame(rules_list)
-        if len(rules_list) > 0:
-            self.m = len(rules_list[0]) #number of attributes (considering the recommendation)
-        else:
-             self.m = 0
+    def __init__(self,rules_list,packed=False,directory=None):
+        ''' @rules_list: list of ordered dictionnaries each representing a rule with their attributes as keys
+            @packed: if True, idm and pm only store the n*(n-1)/2 pairs of rules (see layout.PackedLayout)
+                     instead of n x n matrices
+            @directory: if given, idm and pm are kept in files of this directory mapped in memory (see mapped.Storage)
+        '''
+        self.store = ColumnStore.from_rules(rules_list) #typed columns holding the values of the rules
+        self._frame = None #DataFrame view of the rules, built on demand
+        self.m = len(self.store.names) #number of attributes (considering the recommendation)
         self.n = len(rules_list) #number of rules
-        self.idm = np.empty(0) #Inter-Difference Matrix
-        self.pm = np.empty(0) #Product Matrix (holds products of IDC for each pair of rules)
-        self.attr_names = self.set.columns.tolist()
+        self._idm = np.empty(0) #buffer of idm, may hold more rules than n (see layout.Layout.reserve)
+        self._pm = np.empty(0) #buffer of pm
+        self._rows = 0 #number of rules in the buffers of idm and pm, deleted ones included
+        self._slots = None #position in the buffers of each rule if some deleted rules are not compacted yet, None otherwise
+        self.layout = PACKED if packed else DENSE #storage of the pairs of rules in idm and pm
+        self.storage = None if directory is None else mapped.Storage(directory) #files holding idm and pm, None to keep them in memory
+        self.attr_names = self.store.names
+        self._references = col.OrderedDict() #LRU cache of connections_for, rule -> codes
+        self._transaction = None #Transaction recording the modifications, if any
+        self._index = query.RuleIndex() #indexes of the values answering match, built on demand
+
+    @classmethod
+    def from_store(cls, store, packed=False, directory=None):
+        ''' Returns a RuleSet holding the rules of a ColumnStore (e.g. from parser.parse_columns) '''
+        ruleset = cls([],packed,directory)
+        ruleset.store = store
+        ruleset.m = len(store.names)
+        ruleset.n = store.n
+        ruleset._changed()
+        return ruleset
+
+    @classmethod
+    def load(cls, file_name, directory=None):
+        ''' Returns the RuleSet saved in a rule set file (see save), its arrays being mapped in memory (see rulefile.read) '''
+        store, packed, idm, pm = rulefile.read(file_name)
+        ruleset = cls.from_store(store,packed,directory)
+        if idm is not None and ruleset.n > 1:
+            ruleset._idm = ruleset._copy_layers('idm',idm,range(len(idm)),ruleset.n) if ruleset.storage is not None else idm
+            ruleset._pm = ruleset._copy_layers('pm',pm,range(len(pm)),ruleset.n) if ruleset.storage is not None else pm
+            ruleset._rows = ruleset.n
+        return ruleset
+
+    @classmethod
+    def from_chunks(cls, chunks, packed=False, directory=None, build=True):
+        ''' Returns a RuleSet holding the rules of an iterable of chunks, each chunk being a ColumnStore
+            or a list of rule dictionnaries (e.g. parser.read_chunks or a generator producing rules on the fly)
+            Chunks are produced in a background thread while the previous one is added (see parser.prefetch).
+            @build: if True, idm and pm are computed as the chunks are added (see add_rules)
+        '''
+        ruleset = cls([],packed,directory)
+        for chunk in parser.prefetch(chunks):
+            ruleset.add_rules(chunk)
+            if build and len(ruleset._idm) == 0 and ruleset.n > 1:
+                ruleset.build()
+        return ruleset
+
+    @property
+    def set(self):
+        ''' Read-only pandas.DataFrame view of the rules (built from self.store when needed).
+            Modifications must be done through the methods of RuleSet.
+        '''
+        if self._frame is None:
+            self._frame = self.store.to_dataframe()
+        return self._frame
+
+    @property
+    def idm(self):
+        ''' Inter-Difference Matrix (int8 codes of Relation), view of the n rules in its buffer (compacted first) '''
+        self.compact()
+        if len(self._idm) == 0:
+            return self._idm
+        return self.layout.view(self._idm,self.n)
+
+    @idm.setter
+    def idm(self, a):
+        self.compact()
+        self._idm = a
+
+    @property
+    def pm(self):
+        ''' Pair Matrix (holds for each pair of rules the number of attributes with each relation of PM_RELATIONS),
+            view of the n rules in its buffer (compacted first)
+        '''
+        self.compact()
+        if len(self._pm) == 0:
+            return self._pm
+        return self.layout.view(self._pm,self.n)
+
+    @pm.setter
+    def pm(self, a):
+        self.compact()
+        self._pm = a
+
+    @property
+    def built(self):
+        ''' True if pm is built (see build), so that connections are read from it '''
+        return len(self._pm) > 0
+
+    def _alloc(self, name, prefix, n, dtype):
+        ''' Returns a new zeroed buffer for idm or pm ('name') holding n rules, in memory or in a file of self.storage '''
+        if self.storage is None:
+            return self.layout.alloc(prefix,n,dtype)
+        return self.storage.alloc(name,tuple(prefix)+self.layout.shape(n),dtype)
+
+    def _copy_layers(self, name, a, layers, n, extra=0):
+        ''' Returns a new buffer of capacity n holding the given layers of buffer 'a' (copied one at a time)
+            followed by 'extra' zeroed layers
+        '''
+        new = self._alloc(name,(len(layers)+extra,),n,a.dtype)
+        for k, layer in enumerate(layers):
+            new[k] = a[layer]
+        return new
+
+    def _buffer(self, a):
+        ''' View of the rules held by buffer 'a' (of idm or pm), deleted ones included '''
+        return self.layout.view(a,self._rows)
 
+    def _position(self, rule):
+        ''' Position of 'rule' in the buffers of idm and pm '''
+        return rule if self._slots is None else int(self._slots[rule])
+
+    def compact(self):
+        ''' Remove the deleted rules from idm and pm in one pass (see delete_rule) '''
+        if self._slots is not None:
+            for name in ['_idm','_pm']:
+                a = getattr(self,name)
+                if len(a) > 0:
+                    new = self._alloc(name[1:],a.shape[:-self.layout.axes],len(self._slots),a.dtype)
+                    for k in range(len(a)):
+                        self.layout.select(self._buffer(a[k]),self._slots,out=new[k])
+                    setattr(self,name,new)
+            self._slots = None
+        self._rows = self.n
+
+    def _changed(self):
+        ''' Must be called after any modification of self.store '''
+        self._frame = None
+        self._references.clear()
+        self.attr_names = self.store.names
+
+    @profiling.timed('RuleSet.build_IDM')
     def build_IDM(self):
         if self.n > 1: #needs at least two rules to compare them
-            self.idm = np.zeros((self.m, self.n, self.n))
-            #fill in IDC's for all attributes relationships
-            for k in range(1,self.m):
-                for i in range(self.n):
-                    for j in range(i+1,self.n):
-                        self.idm[k,i,j] = self._val_IDC(self.set.iloc[i,k],self.set.iloc[j,k])
-            #fill in IDC's for recommendation relationships
-            for i in range(self.n):
-                for j in range(i+1,self.n):
-                    self.idm[0,i,j] = self._rec_IDC(self.set.iloc[i,0],self.set.iloc[j,0])
+            self._idm = np.empty(0)
+            self.compact()
+            self._idm = self._alloc('idm',(self.m,),self.n,np.int8)
+            #fill in IDC's for all attributes relationships, the recommendation being attribute 0
+            for k in range(self.m):
+                with profiling.section('RuleSet.build_IDM/'+str(self.attr_names[k])):
+                    self.layout.fill_layer(self._encode(k),self._idm[k],rec=(k == 0))
     
+    @profiling.timed('RuleSet.build_PM')
     def build_PM(self):
-        if(len(self.idm) > 0):
-            self.pm = np.prod(self.idm,axis=0)
+        ''' Count for each pair of rules the attributes in each relation of PM_RELATIONS (row PM_DIFF_REC flags different recommendations) '''
+        if(len(self._idm) > 0):
+            idm = self._buffer(self._idm)
+            self._pm = self._alloc('pm',(PM_ROWS,),self._rows,PM_DTYPE)
+            for k in range(1,self.m):
+                self._count_layer(idm[k],1)
+            for rows, _ in self.layout.tiles(self._rows):
+                self._pm[PM_DIFF_REC][rows] = idm[0][rows] == Relation.DIFF_REC.value
             return True
         else:
             return False
 
+    @profiling.timed('RuleSet.build')
+    def build(self, workers=1, cache=None):
+        ''' Build idm and pm
+            @workers: number of processes computing them (all the cores if None), see parallel.build
+            @cache: cache.Cache in which they are looked up before being computed, and stored after
+            With a storage directory, they are computed tile by tile in their files and an interrupted build
+            is resumed by calling build again (see mapped.Storage.build)
+        '''
+        if cache is not None and self.n > 1:
+            key = cache.key(self.store.cols[:self.m],self.layout.packed)
+            found = cache.get(key)
+            if found is not None:
+                self._idm = np.empty(0)
+                self._pm = np.empty(0)
+                self.compact()
+                idm, pm = found
+                self._idm = self._copy_layers('idm',idm,range(len(idm)),self.n) if self.storage is not None else idm
+                self._pm = self._copy_layers('pm',pm,range(len(pm)),self.n) if self.storage is not None else pm
+            else:
+                self.build(workers)
+                cache.put(key,self.idm,self.pm)
+        elif self.n <= 1 or (workers == 1 and self.storage is None):
+            self.build_IDM()
+            self.build_PM()
+        else:
+            self._idm = np.empty(0)
+            self._pm = np.empty(0)
+            self.compact()
+            if self.storage is None:
+                self._idm, self._pm = parallel.build(self.store.cols[:self.m],self.layout,self.n,workers)
+            else:
+                self._idm, self._pm = self.storage.build(self.store.cols[:self.m],self.layout,self.n,workers)
+
+    def _count_layer(self, layer, sign):
+        ''' Add (sign = 1) or remove (sign = -1) the relations of one attribute layer of idm from the counters of pm '''
+        pm = self._buffer(self._pm)
+        for rows, pairs in self.layout.tiles(self._rows): #bounds the temporary arrays, e.g. when pm is a mapped file
+            block = layer[rows]
+            for r, rel in enumerate(PM_RELATIONS):
+                counts = pm[r][rows]
+                if sign > 0:
+                    counts += (block == rel.value) & pairs
+                else:
+                    counts -= (block == rel.value) & pairs
+
+    def _count_row(self, old, new):
+        ''' Returns the change of the counters of pm when a row of IDC's of one attribute goes from 'old' to 'new' (1D arrays) '''
+        delta = np.zeros((PM_ROWS,len(new)),dtype=PM_DTYPE)
+        for r, rel in enumerate(PM_RELATIONS):
+            delta[r] = (new == rel.value).astype(PM_DTYPE) - (old == rel.value).astype(PM_DTYPE)
+        return delta
+
     # Helper methods to build rule set
+    def _encode(self, attr):
+        ''' Returns the typed column holding the values of attribute 'attr' (index) '''
+        return self.store.cols[attr]
+
     def _val_IDC(self, val1, val2):
         #Check for nan values
         if pd.isna(val1) and pd.isna(val2):
@@ -141,11 +351,9 @@ class RuleSet:
         if type(attr) is str:
             if attr not in self.attr_names:
                 raise ValueError("Attribute given doesn't exist. attr="+attr)
-            return self.set[attr][rule]
+            return self.store.get(rule,self.attr_names.index(attr))
         elif type(attr) is int and attr >= 0 and attr < self.m:
-            #print("set before set.iloc:")
-            #print(self.set)
-            return self.set.iloc[rule,attr]
+            return self.store.get(rule,attr)
         else:
             raise ValueError("'attr' must be either an integer in [0,"+str(self.m-1)+"] or an existing attribute name")
 
@@ -154,7 +362,7 @@ class RuleSet:
             or the enum ERROR if the PM matrix hasn't been built yet
             rules indexes start at 0; r1 and r2 may be given in any order
         '''
-        if len(self.pm) == 0: #build_PM needs to be called to create PM matrix
+        if len(self._pm) == 0: #build_PM needs to be called to create PM matrix
             return Connection.ERROR
         elif r1 >= self.n or r2 >= self.n:
             raise ValueError("indexes given for connections are too high r1:"+str(r1)+" r2:"+str(r1)+" maxVal:"+str(self.n-1))
@@ -163,17 +371,101 @@ class RuleSet:
                 return Connection.REFERENCE
             if r1 > r2:
                 r = r1; r1 = r2; r2 = r
-            p = self.pm[r1][r2]
-            #print("r1: "+str(r1)+" r2: "+str(r2)+" p: "+str(p))
-            if p == Relation.DIFFERENCE.value: return Connection.DISCONNECTED
-            elif p == Relation.EQUALITY.value : return Connection.EQUAL_SAME
-            elif p == -Relation.EQUALITY.value : return Connection.EQUAL_DIFF
-            elif p % Relation.OVERLAP.value == 0 and p > 0: return Connection.OVERLAP_SAME
-            elif p % Relation.OVERLAP.value == 0 and p < 0 : return Connection.OVERLAP_DIFF
-            elif (p % Relation.INCLUSION_IJ.value == 0 or p % Relation.INCLUSION_JI.value == 0) and p*Relation.SAME_REC.value > 0 : return Connection.INCLUSION_SAME
-            elif (p % Relation.INCLUSION_IJ.value == 0 or p % Relation.INCLUSION_JI.value == 0) and p*Relation.DIFF_REC.value > 0 : return Connection.INCLUSION_DIFF
-            else:
-                raise ValueError("pm has illegal value at indices ["+str(r1)+","+str(r2)+']')
+            return CONNECTIONS[classify(self.layout.get(self._pm,self._position(r1),self._position(r2)))]
+
+    def connections_for(self, ref):
+        ''' Returns the codes (see connection.CONNECTIONS) of the connections between rule 'ref' and every rule,
+            the code of 'ref' itself being the one of Connection.REFERENCE
+            Read from pm if it is built, computed directly from the values of the rules (O(m.n)) otherwise.
+            The last REFERENCE_CACHE_SIZE results are cached until the rule set is modified, they are read-only.
+        '''
+        if not isinstance(ref,(int,np.integer)) or ref < 0 or ref >= self.n:
+            raise ValueError("'ref' must be an integer in [0,"+str(self.n-1)+"]")
+        if ref in self._references:
+            self._references.move_to_end(ref)
+            return self._references[ref]
+        if len(self._pm) > 0:
+            counts = self.layout.row(self._buffer(self._pm),self._position(ref),self._rows)
+            if self._slots is not None:
+                counts = counts[:,self._slots]
+        else:
+            counts = np.zeros((PM_ROWS,self.n),dtype=PM_DTYPE)
+            for k in range(1,self.m):
+                row = kernel.idc_row(self._encode(k),ref)
+                for r, rel in enumerate(PM_RELATIONS):
+                    counts[r] += row == rel.value
+            counts[PM_DIFF_REC] = kernel.idc_row(self._encode(0),ref,rec=True) == Relation.DIFF_REC.value
+        codes = classify(counts)
+        codes[ref] = CODES[Connection.REFERENCE]
+        codes.flags.writeable = False
+        self._references[ref] = codes
+        if len(self._references) > REFERENCE_CACHE_SIZE:
+            self._references.popitem(last=False)
+        return codes
+
+    def connection_matrix(self):
+        ''' Returns the codes (see connection.CONNECTIONS) of the connections between all rules, classified from pm in one pass
+            With the dense layout, the result is a symmetric n x n int8 matrix with the code of REFERENCE on its diagonal.
+            With the packed layout, it holds the code of every pair of rules (i,j), i < j, at index layout.pair_index(i,j).
+            Use connection.count_connections and connection.find_connections to count or select connections.
+        '''
+        if len(self._pm) == 0:
+            raise ValueError("pm must be built (build_IDM and build_PM) before classifying all connections")
+        pm = self.pm #compacted
+        if self.layout.packed:
+            return classify(pm)
+        codes = np.zeros((self.n,self.n),dtype=np.int8)
+        for start in range(0,self.n,kernel.TILE):
+            stop = min(start+kernel.TILE,self.n)
+            codes[start:stop] = np.triu(classify(pm[:,start:stop,:]),k=start+1)
+        codes += codes.T
+        np.fill_diagonal(codes,CODES[Connection.REFERENCE])
+        return codes
+
+    def match(self, values):
+        ''' Returns the sorted array of the rules that apply to an observation, i.e. whose value of every attribute
+            accepts the value of the observation (see query.RuleIndex.match)
+            @values: dictionnary {attribute name: value}, e.g. {'Age': 42.0, 'Smoker': False}
+        '''
+        return self._index.match(self.store,values)
+
+    def connection_graph(self):
+        ''' Returns a sparse.ConnectionGraph holding only the pairs of rules that are not DISCONNECTED
+            It is computed with a sweep over the sorted values of the attributes, without building idm and pm,
+            which makes it usable for rule sets too large for them
+        '''
+        return sparse.build_graph(self)
+
+    def clusters(self, conflicts=False, min_size=2):
+        ''' Returns the groups of rules that are connected, directly or through other rules, as a list of sparse.Cluster
+            (rules, size and number of rules per recommendation), largest first
+            The edges are the connected pairs read from pm if it is built, found by connection_graph otherwise,
+            so that the n x n matrix of connections is never needed.
+            @conflicts: if True, only the connections in connection.CONFLICTS are edges
+            @min_size: smallest number of rules of the returned clusters
+        '''
+        if self.n == 0:
+            return []
+        elif len(self._pm) > 0:
+            graph = sparse.graph_from_pm(self.pm,self.layout,self.n)
+        else:
+            graph = self.connection_graph()
+        return sparse.clusters(graph,self.store.cols[0],CONFLICTS if conflicts else None,min_size)
+
+    @profiling.timed('RuleSet.subsumptions')
+    def subsumptions(self):
+        ''' Returns the redundancy.Subsumptions of the rule set: the pairs of rules with the same recommendation
+            (connections EQUAL_SAME and INCLUSION_SAME) in which one rule is within the other, and the redundant rules
+            They are found from the sorted values of the rules of each recommendation, without building idm and pm.
+        '''
+        return redundancy.subsumptions(self.store)
+
+    def pruned(self, packed=None, directory=None):
+        ''' Returns a new RuleSet without the redundant rules (see subsumptions), the first of equal rules being kept
+            @packed: layout of the new rule set, the one of this rule set if None
+        '''
+        packed = self.layout.packed if packed is None else packed
+        return RuleSet.from_store(redundancy.pruned_store(self.store,self.subsumptions()),packed,directory)
 
     def same_type(self,val1,val2):
         ''' Redefine same type relationships to ignore difference between numpy and regular types '''
@@ -207,51 +499,70 @@ class RuleSet:
 
     def recompute_m(self):
         ''' recompute the matrix idm and pm if they already exist'''
-        if len(self.idm) > 0:
+        if len(self._idm) > 0:
                 self.build_IDM()
-                if len(self.pm) > 0:
+                if len(self._pm) > 0:
                     self.build_PM()
 
+    @profiling.timed('RuleSet.update_idm')
     def update_idm(self,rule,attr):
-        if len(self.idm) > 0:
-            #update idm
-            for i in range(self.n):
-                #update of regular value
-                if attr > 0 and i < rule:
-                    self.idm[attr,i,rule] = self._val_IDC(self.set.iloc[i,attr],self.set.iloc[rule,attr])
-                elif attr > 0 and i > rule:
-                    self.idm[attr,rule,i] = self._val_IDC(self.set.iloc[rule,attr],self.set.iloc[i,attr])
-                #update of recommendation
-                if attr == 0 and i < rule:
-                    self.idm[attr,i,rule] = self._rec_IDC(self.set.iloc[i,attr],self.set.iloc[rule,attr])
-                elif attr == 0 and i > rule:
-                    #print("update_idm : i="+str(i)+" attr="+str(attr)+"rule="+str(rule)+str(self.n))
-                    #print("-- set in update_idm --")
-                    #print(self.set)
-                    #print("-- ism in update_idm --")
-                    #print(self.idm)
-                    self.idm[attr,rule,i] = self._rec_IDC(self.set.iloc[i,attr],self.set.iloc[rule,attr])
+        ''' Recompute the IDC's between 'rule' and the other rules for attribute 'attr'
+            If pm is built, its counters are adjusted for the IDC's that changed (O(n))
+        '''
+        if len(self._idm) > 0:
+            new = kernel.idc_row(self._encode(attr),rule,rec=(attr == 0))
+            if self._slots is not None: #the pairs made with deleted rules are left to 0
+                new_row = np.zeros(self._rows,dtype=new.dtype)
+                new_row[self._slots] = new
+                new = new_row
+            pos = self._position(rule)
+            idm = self._buffer(self._idm)
+            if len(self._pm) > 0:
+                pm = self._buffer(self._pm)
+                old = self.layout.row(idm[attr],pos,self._rows)
+                pm_row = self.layout.row(pm,pos,self._rows)
+                if attr == 0:
+                    pm_row[PM_DIFF_REC] = new == Relation.DIFF_REC.value
+                else:
+                    pm_row += self._count_row(old,new) #unsigned overflow of negative changes wraps back to the right count
+                self.layout.set_row(pm,pos,pm_row)
+            self.layout.set_row(idm[attr],pos,new)
     
+    @profiling.timed('RuleSet.update_pm')
     def update_pm(self,rule):
-        if len(self.pm) > 0:
-            #update pm
-            self.pm[rule,:] = np.prod(self.idm[:,rule,:],axis=0)
-            self.pm[:,rule] = np.prod(self.idm[:,:,rule],axis=0)
+        ''' Recompute the counters of pm between 'rule' and the other rules from idm (O(m.n)) '''
+        if len(self._pm) > 0:
+            pos = self._position(rule)
+            rows = self.layout.row(self._buffer(self._idm),pos,self._rows)
+            pm_row = np.zeros((PM_ROWS,self._rows),dtype=PM_DTYPE)
+            for r, rel in enumerate(PM_RELATIONS):
+                pm_row[r] = np.count_nonzero(rows[1:] == rel.value,axis=0)
+            pm_row[PM_DIFF_REC] = rows[0] == Relation.DIFF_REC.value
+            self.layout.set_row(self._buffer(self._pm),pos,pm_row)
 
+    @profiling.timed('RuleSet.update_val')
     def update_val(self, rule, attr, val, update=True):
         ''' Update value of an attribute by setting value in position [rule,attr] in de DataFrame rules to value val
             if update = True, recompute self.idm and self.pm, leave them unchanged otherwise
+            (during a transaction, they are recomputed when it is committed)
             rule and attr must be int with rule < n and 0 <attr < m
-            val must either be nan or have the same type as the rest of the values in the column
-            (No checks are performed on val for performance reasons)
+            val must either be nan or have the same type as the rest of the values in the column (TypeError raised otherwise)
             (Method designed for attributes and not for the recommendation)
         '''
         if attr >= self.m or rule >= self.n:
             raise ValueError("Index condition not respected: rule ("+str(rule)+") must be lower than "+str(self.n)+" and attr ("+str(attr)+") must be lower than "+str(self.m))
-        self.set.iloc[rule,attr] = val
-        if update:
-            self.update_idm(rule,attr)
-            self.update_pm(rule)
+        old_val = self.store.get(rule,attr)
+        old_col = self.store.cols[attr]
+        self.store.set(rule,attr,val)
+        self._changed()
+        self._index.changed(rule,attr)
+        if self._transaction is not None:
+            #an empty column is replaced by a typed one when a value is set, the empty one is restored on rollback
+            self._transaction.log.append(('val',rule,attr,old_val,old_col if old_col.kind == EMPTY else None))
+            if update:
+                self._transaction.touched.add((rule,attr))
+        elif update:
+            self.update_idm(rule,attr) #also updates pm
             
     def update_attr(self,attr_list):
         ''' update attr by giving a new attr list
@@ -264,8 +575,10 @@ class RuleSet:
                     raise ValueError("Two attributes can't have the same name.")
         if attr_list[0] != 'Rec' and attr_list[0] != 'Recommendation':
             raise ValueError("First column must have name 'Rec' or 'Recommendation")
-        self.set.columns = attr_list
-        self.attr_names = attr_list
+        if self._transaction is not None:
+            self._transaction.log.append(('names',self.store.names))
+        self.store.names = attr_list
+        self._changed()
     
     '''
     def update_attr(self,new_attr,position):
@@ -278,8 +591,8 @@ class RuleSet:
     '''
    
     def add_attr(self,attr_name,val_list=None):
-        ''' @val_list: list containing the value of that attribute for each rule
-            verification of correct type is not guaranteed because is only done if idm > 0
+        ''' @val_list: list containing the value of that attribute for each rule (unspecified values if None)
+            raises a TypeError if the values don't all have the same type
         '''
         if self.n == 0:
             raise ValueError("Cannot add attribute to empty ruleset. Add a rule first.")
@@ -288,38 +601,32 @@ class RuleSet:
         if attr_name in self.attr_names:
             raise ValueError("The new attribute name must not already be used. Error with attr_name="+str(attr_name))
         if val_list is None:
-            self.set[attr_name] = pd.Series(float('nan'),index=range(self.n))
-            #new idm layer for this attr has 1's for all rules since all values are the same
-            if len(self.idm) > 0:
-                new_idm_layer = np.zeros((1,self.n,self.n))
-                for i in range(1,self.n):
-                    for j in range(i+1,self.n):
-                        new_idm_layer[0,i,j] = 1
-                self.idm = np.concatenate((self.idm,new_idm_layer))
-            #No changes to pm needed since all new values are one's
-        else:
-            if len(val_list) != self.n:
-                raise ValueError("Length of list value ("+str(len(val_list))+") must be equal to number of rules ("+str(self.n)+")")
-            self.set[attr_name] = pd.Series(val_list)
-            #build new idm layer and add it to idm
-            if len(self.idm) > 0:
-                new_idm_layer = np.zeros((1,self.n,self.n))
-                for i in range(0,self.n):
-                    for j in range(i+1,self.n):
-                        try:
-                            new_idm_layer[0,i,j] = self._val_IDC(self.set[attr_name][i],self.set[attr_name][j])
-                        except TypeError:
-                            raise TypeError("New attribute contains values with different types.")
-                self.idm = np.concatenate((self.idm,new_idm_layer))
-                #recompute pm
-                if len(self.pm) > 0:
-                    self.build_PM()        
+            val_list = [float('nan')]*self.n
+        if len(val_list) != self.n:
+            raise ValueError("Length of list value ("+str(len(val_list))+") must be equal to number of rules ("+str(self.n)+")")
+        try:
+            col = encode_column(val_list)
+        except TypeError:
+            raise TypeError("New attribute contains values with different types.")
+        self.store.add_column(attr_name,col)
+        if self._transaction is not None:
+            self._transaction.log.append(('attr',))
+        #build new idm layer and add it to idm
+        if len(self._idm) > 0:
+            self.compact() #the layer is computed from the values of the rules that are not deleted
+            self._idm = self._copy_layers('idm',self._idm,range(self.m),self.layout.capacity(self._idm),extra=1)
+            layer = self.layout.view(self._idm[self.m],self.n)
+            self.layout.fill_layer(col,layer)
+            #add relations of the new attribute to pm
+            if len(self._pm) > 0:
+                self._count_layer(layer,1)
         self.m += 1
-        self.attr_names = self.set.columns.tolist()
+        self._changed()
     
+    @profiling.timed('RuleSet.add_rule')
     def add_rule(self,rec,val_list=None):
         ''' @val_list: list containing the values for all attributes of this rule (recommendation excluded)
-            verification of correct type is not guaranteed because is only done if idm > 0
+            raises a TypeError if a value doesn't have the type of its attribute (the rule is then not added)
         '''
         if self.n == 0:
             names = ['Recommendation']
@@ -329,54 +636,115 @@ class RuleSet:
                     names += ['Attr '+str(i+1)]
                 values = [rec] + val_list
             rule_dict = {k:v for k,v in zip(names,values)}
-            self.set = pd.DataFrame([rule_dict])[names]
+            if self._transaction is not None:
+                self._transaction.log.append(('store',self.store,self.m))
+            self.store = ColumnStore.from_rules([rule_dict])
             self.m = len(names)
             self.n = 1
-            self.attr_names = names
+            self._changed()
+            self._index = query.RuleIndex()
         else:
             old_n = self.n
-            new_n = self.n+1
-            self.n += 1 #update needs to be done before call to update_idm()
             if val_list == None:
-                rule = pd.DataFrame(None,index=[old_n])
-                self.set = pd.concat([self.set,rule],sort=False)
-                self.set.iloc[old_n,0] = rec
+                values = [rec] + [float('nan')]*(self.m-1)
             else:
                 if len(val_list) != self.m-1:
-                    self.n = old_n
                     raise ValueError("The number of values given ("+str(len(val_list))+") is not the same as the number of attributes ("+str(self.m-1)+").")
-                keys = self.attr_names
                 values = [rec] + val_list
-                val_dict = {k:v for k,v in zip(keys,values)}
-                rule = pd.DataFrame(val_dict,index=[old_n])
-                self.set = pd.concat([self.set,rule],sort=False)
-            #add new rows and columns to idm
-            if len(self.idm) > 0:
-                rows = np.zeros((self.m,1,old_n))
-                self.idm = np.concatenate((self.idm,rows),axis=1)
-                cols = np.zeros((self.m,old_n+1,1))
-                self.idm = np.concatenate((self.idm,cols),axis=2)
+            empty = {k: c for k, c in enumerate(self.store.cols) if c.kind == EMPTY} #may get a type from the new values
+            try:
+                self.store.append_row(values)
+            except TypeError:
+                raise TypeError("New rule contains value with inadequate type.")
+            if self._transaction is not None:
+                self._transaction.log.append(('rule',empty))
+            self.n += 1 #update needs to be done before call to update_idm()
+            self._changed()
+            #add new rows and columns to idm, its buffer is only reallocated when full (amortized O(m.n) per rule)
+            if len(self._idm) > 0:
+                self._rows += 1
+                if self._slots is not None:
+                    self._slots = np.append(self._slots,self._rows-1)
+                self._idm = self.layout.reserve(self._idm,self._rows,alloc=lambda prefix, n, dtype: self._alloc('idm',prefix,n,dtype))
+                #add new rows and columns in pm, with counters matching the empty idm row
+                if len(self._pm) > 0:
+                    self._pm = self.layout.reserve(self._pm,self._rows,alloc=lambda prefix, n, dtype: self._alloc('pm',prefix,n,dtype))
+                    self.update_pm(old_n)
                 for attr in range(self.m):
-                    try:
-                        #print("-- ruleset--")
-                        #print(self.set)
-                        #print("i: "+str(old_n)+" attr: "+str(attr))
-                        #print("-- idm --")
-                        #print(self.idm)
-                        #print()
-                        self.update_idm(old_n,attr)
-                    except TypeError:
-                        self.n = old_n
-                        raise TypeError("New rule contains value with inadequate type.")
-                #add new rows and columns in pm
-                if len(self.pm) > 0:
-                    rows = np.zeros((old_n,1))
-                    self.pm = np.concatenate((self.pm,rows),axis=1)
-                    cols = np.zeros((1,old_n+1))
-                    self.pm = np.concatenate((self.pm,cols),axis=0)
-                    self.pm[:,old_n] = np.prod(self.idm[:,:,old_n],axis=0)
+                    self.update_idm(old_n,attr)
+
+    def transaction(self):
+        ''' Returns a Transaction recording the modifications made by update_val, update_attr, add_rule and add_attr
+            so that they can be undone by replaying its log (rollback) instead of copying the whole rule set.
+            The IDC's of the values changed by update_val are recomputed once, when the transaction is committed.
+            Used as a context manager, it is committed at the end of the block, or rolled back if an exception is raised.
+        '''
+        if self._transaction is not None:
+            raise ValueError("A transaction is already in progress on this rule set")
+        self._transaction = Transaction(self)
+        return self._transaction
+
+    def _undo(self, entry):
+        ''' Undo one modification recorded in the log of a transaction '''
+        if entry[0] == 'val':
+            op, rule, attr, old_val, old_col = entry
+            if old_col is not None:
+                self.store.cols[attr] = old_col
+            else:
+                self.store.set(rule,attr,old_val)
+        elif entry[0] == 'names':
+            self.store.names = entry[1]
+        elif entry[0] == 'rule':
+            self.delete_rule(self.n-1)
+            for attr, old_col in entry[1].items():
+                #the column may have been extended in place by the rule if its value was unspecified
+                self.store.cols[attr] = old_col.take(slice(0,self.n))
+        elif entry[0] == 'attr':
+            self.delete_attr(self.m-1)
+        elif entry[0] == 'store':
+            self.store = entry[1]
+            self.m = entry[2]
+            self.n = 0
+        self._changed()
+        self._index = query.RuleIndex()
+
+    @profiling.timed('RuleSet.add_rules')
+    def add_rules(self, chunk):
+        ''' Add the rules of 'chunk' (ColumnStore or list of rule dictionnaries) at the end, attributes being matched by name
+            If idm is built, only the pairs made of the new rules are computed: the pairs within the chunk
+            and the pairs of the chunk and the rules already in the set (see parallel.new_rules_tasks)
+            raises a ValueError if the chunk has unknown attributes or a TypeError if a value has an inadequate type
+            (the rules are then not added)
+        '''
+        if self._transaction is not None:
+            raise ValueError("Rules can't be added by chunks during a transaction")
+        if not isinstance(chunk,ColumnStore):
+            chunk = ColumnStore.from_rules(chunk)
+        if chunk.n == 0:
+            return
+        if self.n == 0:
+            self.store = ColumnStore(list(chunk.names),list(chunk.cols))
+            self.m = len(chunk.names)
+            self._index = query.RuleIndex()
+        else:
+            self.compact()
+            self.store.append_store(chunk)
+        start = self.n
+        self.n += chunk.n
+        self._changed()
+        if len(self._idm) > 0:
+            self._rows = self.n
+            self._idm = self.layout.reserve(self._idm,self.n,alloc=lambda prefix, n, dtype: self._alloc('idm',prefix,n,dtype))
+            if len(self._pm) > 0:
+                self._pm = self.layout.reserve(self._pm,self.n,alloc=lambda prefix, n, dtype: self._alloc('pm',prefix,n,dtype))
+            idm = self._buffer(self._idm)
+            pm = self._buffer(self._pm) if len(self._pm) > 0 else None
+            for task in parallel.new_rules_tasks(start,self.n,self.layout.packed):
+                parallel.fill_task(self.store.cols[:self.m],self.n,self.layout.packed,idm,pm,task)
 
     def delete_attr(self,attr):
+        if self._transaction is not None:
+            raise ValueError("Attributes can't be deleted during a transaction")
         if attr == 0 or attr == 'Rec' or attr == 'Recommendation':
             raise ValueError("Recommendation cannot be deleted from ruleset")
         if isinstance(attr,int):
@@ -391,33 +759,86 @@ class RuleSet:
             else:
                 index = self.attr_names.index(attr)
                 name = attr
-        del self.set[name]
-        self.attr_names = self.set.columns.tolist()
+        self.store.delete_column(index)
+        self._changed()
+        self._index = query.RuleIndex()
         self.m -= 1 #has to be before update of idm
-        if len(self.idm) > 0:
-            self.idm = np.delete(self.idm,index,axis=0)
-            if len(self.pm) > 0:
-                self.build_PM()
+        if len(self._idm) > 0:
+            #remove relations of the deleted attribute from pm
+            if len(self._pm) > 0:
+                self._count_layer(self._buffer(self._idm)[index],-1)
+            self._idm = self._copy_layers('idm',self._idm,[k for k in range(self.m+1) if k != index],self.layout.capacity(self._idm))
 
+    @profiling.timed('RuleSet.delete_rule')
     def delete_rule(self,rule):
-        '''  '''
+        ''' Delete rule 'rule', the rules that followed it are renumbered (see RuleSet)
+            The rule is only marked as deleted in idm and pm, which are compacted in one pass
+            when more than DELETED_FRACTION of their rules are deleted or when compact is called
+        '''
+        if self._transaction is not None:
+            raise ValueError("Rules can't be deleted during a transaction")
         if rule < 0 or rule >= self.n:
             raise ValueError("The rule index for deletion has to be in [0,"+str(self.m-1)+"]. rule="+str(rule))
         self.n -= 1 #has to be before update of set indexes
-        new_set = self.set.drop(rule)
-        self.set = new_set
-        new_set.index = range(self.n)
-        if len(self.idm) > 0:
+        self.store.delete_row(rule)
+        self._index.deleted(rule)
+        self._changed()
+        if len(self._idm) > 0:
             if self.n > 1: #needs at least two rules to compare them in idm and pm
-                temp_idm = np.delete(self.idm,rule,axis=1)
-                self.idm = np.delete(temp_idm,rule,axis=2)
-                if len(self.pm) > 0:
-                    temp_pm = np.delete(self.pm,rule,axis=0)
-                    self.pm = np.delete(temp_pm,rule,axis=1)
+                if self._slots is None:
+                    self._slots = np.arange(self._rows)
+                self._slots = np.delete(self._slots,rule)
+                if self._rows - self.n > DELETED_FRACTION*self._rows:
+                    self.compact()
             else:
-                self.idm = np.empty(0)
-                self.pm = np.empty(0)
+                self._idm = np.empty(0)
+                self._pm = np.empty(0)
+                self._slots = None
+                self._rows = self.n
                 
     
     def to_csv(self,file_name):
         self.set.to_csv(file_name,index=False)
+
+    def save(self, file_name, matrices=True):
+        ''' Write the rule set in a binary rule set file (see rulefile.write), with idm and pm if 'matrices' and they are built '''
+        if matrices:
+            rulefile.write(file_name,self.store,self.layout.packed,self.idm,self.pm)
+        else:
+            rulefile.write(file_name,self.store,self.layout.packed)
+
+
+class Transaction:
+    ''' Modifications of a RuleSet that can be committed or rolled back, see RuleSet.transaction '''
+    def __init__(self, ruleset):
+        self.ruleset = ruleset
+        self.log = [] #undo log, one entry per modification
+        self.touched = set() #(rule,attr) of the values whose IDC's are recomputed on commit
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.ruleset._transaction is self:
+            if exc_type is None:
+                self.commit()
+            else:
+                self.rollback()
+        return False
+
+    def _end(self):
+        if self.ruleset._transaction is not self:
+            raise ValueError("The transaction is already finished")
+        self.ruleset._transaction = None
+
+    def commit(self):
+        ''' Recompute idm and pm for the values changed during the transaction (O(n) per value) '''
+        self._end()
+        for rule, attr in sorted(self.touched):
+            self.ruleset.update_idm(rule,attr)
+
+    def rollback(self):
+        ''' Undo the modifications of the transaction in reverse order '''
+        self._end()
+        for entry in reversed(self.log):
+            self.ruleset._undo(entry)
@@ -0,0 +1,92 @@
+import os
+import json
+import numpy as np
+
+from columns import *
+from relation import *
+
+#Extension of the rule set files
+EXTENSION = '.rset'
+#First bytes of a rule set file, the last one being the version of the format
+MAGIC = b'RULESET\x01'
+#Alignment (bytes) of the arrays in the file
+ALIGN = 64
+
+def _aligned(offset):
+    return -(-offset//ALIGN)*ALIGN
+
+def write(file_name, store, packed=False, idm=None, pm=None):
+    ''' Write the typed columns of ColumnStore 'store' (names, kinds, categories and arrays), and idm and pm if given,
+        in a rule set file: MAGIC, the length of a json header (8 bytes little endian), the header
+        and the raw arrays, each one starting at a multiple of ALIGN so that they can be mapped in memory (see read).
+        The file is written next to 'file_name' then renamed, so that a rule set mapped from it stays readable.
+        Raises a TypeError if a category can't be written in json.
+    '''
+    arrays = []
+    attributes = []
+    for name, c in zip(store.names,store.cols):
+        attribute = {'name': name, 'kind': c.kind, 'fields': []}
+        if c.kind == CATEGORY:
+            attribute['categories'] = c.categories
+        for field in c._fields:
+            attribute['fields'].append(len(arrays))
+            arrays.append(getattr(c,field))
+        attributes.append(attribute)
+    header = {'n': store.n, 'attributes': attributes, 'packed': packed, 'semantics': SEMANTICS_VERSION}
+    if idm is not None and pm is not None and len(idm) > 0 and len(pm) > 0:
+        header['idm'] = len(arrays)
+        header['pm'] = len(arrays)+1
+        arrays += [idm,pm]
+    #the offsets of the arrays depend on the length of the header holding them, which grows with them
+    start = 0
+    while True:
+        header['arrays'] = []
+        offset = start
+        for a in arrays:
+            offset = _aligned(offset)
+            header['arrays'].append({'dtype': a.dtype.str, 'shape': list(a.shape), 'offset': offset})
+            offset += a.nbytes
+        text = json.dumps(header).encode()
+        if len(MAGIC)+8+len(text) <= start:
+            break
+        start = _aligned(len(MAGIC)+8+len(text))
+    tmp = file_name + '.tmp'
+    with open(tmp,'wb') as f:
+        f.write(MAGIC)
+        f.write(len(text).to_bytes(8,'little'))
+        f.write(text)
+        for a, entry in zip(arrays,header['arrays']):
+            f.write(b'\0'*(entry['offset']-f.tell()))
+            f.write(np.ascontiguousarray(a).tobytes())
+    os.replace(tmp,file_name)
+
+def read(file_name):
+    ''' Returns (store, packed, idm, pm) read from a rule set file (see write), idm and pm being None if it has none
+        or if they were computed with another SEMANTICS_VERSION.
+        The arrays are mapped in memory (copy on write) instead of being read: loading is O(size of the header),
+        the pages are read when they are used and modifying them doesn't modify the file.
+        Raises a ValueError if the file isn't a rule set file.
+    '''
+    with open(file_name,'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("File "+str(file_name)+" isn't a rule set file (or has another version).")
+        header = json.loads(f.read(int.from_bytes(f.read(8),'little')))
+    arrays = []
+    for entry in header['arrays']:
+        dtype, shape = np.dtype(entry['dtype']), tuple(entry['shape'])
+        if np.prod(shape) == 0:
+            arrays.append(np.zeros(shape,dtype=dtype)) #empty arrays can't be mapped
+        else:
+            arrays.append(np.memmap(file_name,dtype=dtype,mode='c',offset=entry['offset'],shape=shape))
+    names, cols = [], []
+    for attribute in header['attributes']:
+        fields = [arrays[a] for a in attribute['fields']]
+        if attribute['kind'] == CATEGORY:
+            cols.append(CategoryColumn(*fields,categories=attribute['categories']))
+        else:
+            cols.append(COLUMN_TYPES[attribute['kind']](*fields))
+        names.append(attribute['name'])
+    idm = pm = None
+    if 'idm' in header and header['semantics'] == SEMANTICS_VERSION:
+        idm, pm = arrays[header['idm']], arrays[header['pm']]
+    return ColumnStore(names,cols), header['packed'], idm, pm
@@ -0,0 +1,197 @@
+import numpy as np
+
+import kernel
+from layout import pair_count, pair_rows, PACKED_TILE
+from relation import *
+from connection import *
+from columns import INTERVAL, EMPTY, CATEGORY
+
+class ConnectionGraph:
+    ''' Sparse representation of the connections between n rules, only the pairs that are not DISCONNECTED are stored
+        @rows, @cols: rules of each pair (rows < cols)
+        @codes: code of the connection of each pair (see connection.CONNECTIONS)
+        The neighbours of every rule are also indexed in CSR format (indptr, indices, neighbour_codes)
+    '''
+    def __init__(self, n, rows, cols, codes):
+        order = np.lexsort((cols,rows))
+        self.n = n
+        self.rows = rows[order]
+        self.cols = cols[order]
+        self.codes = codes[order]
+        #symmetric adjacency lists
+        src = np.concatenate((self.rows,self.cols))
+        dst = np.concatenate((self.cols,self.rows))
+        order = np.lexsort((dst,src))
+        self.indices = dst[order]
+        self.neighbour_codes = np.concatenate((self.codes,self.codes))[order]
+        self.indptr = np.zeros(n+1,dtype=np.int64)
+        np.cumsum(np.bincount(src,minlength=n),out=self.indptr[1:])
+
+    def __len__(self):
+        return len(self.codes)
+
+    def neighbours(self, rule):
+        ''' Returns the rules connected to 'rule' and the codes of their connections '''
+        start, stop = self.indptr[rule], self.indptr[rule+1]
+        return self.indices[start:stop], self.neighbour_codes[start:stop]
+
+    def connection(self, r1, r2):
+        if r1 == r2:
+            return Connection.REFERENCE
+        rules, codes = self.neighbours(r1)
+        k = np.searchsorted(rules,r2)
+        if k < len(rules) and rules[k] == r2:
+            return CONNECTIONS[codes[k]]
+        return Connection.DISCONNECTED
+
+def _pairs_before(end):
+    ''' Returns the pairs of positions (p,q) with p < q < end[p] '''
+    p = np.arange(len(end))
+    counts = np.maximum(end - p - 1,0)
+    P = np.repeat(p,counts)
+    offsets = np.repeat(np.cumsum(counts) - counts,counts)
+    Q = np.arange(len(P)) - offsets + P + 1
+    return P, Q
+
+def _sweep(col):
+    ''' Sort the specified values of 'col' and return (order, end) where the candidates of the value at position p
+        of the sorted values are the ones at positions p+1 ... end[p]-1
+    '''
+    specified = np.flatnonzero(~col.na)
+    if col.kind == INTERVAL:
+        #intervals sorted by left endpoint can only overlap the ones starting before their right endpoint
+        order = specified[np.argsort(col.left[specified],kind='stable')]
+        end = np.searchsorted(col.left[order],col.right[order],side='right')
+    else:
+        #other values can only be equal to the ones with the same key
+        order = specified[np.argsort(col.keys[specified],kind='stable')]
+        end = np.searchsorted(col.keys[order],col.keys[order],side='right')
+    return order, end
+
+def estimate_pairs(col):
+    ''' Number of candidate pairs produced by candidate_pairs(col), computed in O(n log n) '''
+    n = len(col)
+    if col.kind == EMPTY:
+        return pair_count(n)
+    w = int(col.na.sum())
+    order, end = _sweep(col)
+    return int(np.maximum(end - np.arange(len(end)) - 1,0).sum()) + pair_count(n) - pair_count(n-w)
+
+def candidate_pairs(col):
+    ''' Returns the pairs (I,J), I < J, of rules whose values of 'col' are not in DIFFERENCE
+        Specified values are sorted so that only the O(k) pairs that may be connected are listed (sweep line),
+        unspecified values being paired with every other rule
+    '''
+    n = len(col)
+    if col.kind == EMPTY:
+        return pair_rows(np.arange(pair_count(n)))
+    order, end = _sweep(col)
+    P, Q = _pairs_before(end)
+    I = order[P]; J = order[Q]
+    keep = kernel.idc_pairs(col,I,J) != Relation.DIFFERENCE.value
+    I = I[keep]; J = J[keep]
+    #pairs made of an unspecified value and any other value
+    wild = np.flatnonzero(col.na)
+    A = np.repeat(wild,n); B = np.tile(np.arange(n),len(wild))
+    keep = (A != B) & (~col.na[B] | (B > A))
+    A = A[keep]; B = B[keep]
+    return np.concatenate((np.minimum(I,J),np.minimum(A,B))), np.concatenate((np.maximum(I,J),np.maximum(A,B)))
+
+def build_graph(ruleset):
+    ''' Returns the ConnectionGraph of a rule set without building its IDM or PM, in O(n log n + k.m)
+        where k is the number of candidate pairs of the most selective attribute
+        Candidates are listed for the attribute with the fewest of them, then filtered by the other attributes
+        (from the most to the least selective) and the remaining pairs are classified
+    '''
+    n = ruleset.n
+    cols = ruleset.store.cols[:ruleset.m]
+    if n < 2:
+        return ConnectionGraph(n,np.zeros(0,dtype=np.int64),np.zeros(0,dtype=np.int64),np.zeros(0,dtype=np.int8))
+    attrs = sorted(range(1,ruleset.m),key=lambda k: estimate_pairs(cols[k]))
+    if len(attrs) == 0:
+        I, J = pair_rows(np.arange(pair_count(n)))
+    else:
+        I, J = candidate_pairs(cols[attrs[0]])
+    counts = np.zeros((PM_ROWS,len(I)),dtype=PM_DTYPE)
+    for k in attrs:
+        idc = kernel.idc_pairs(cols[k],I,J)
+        keep = idc != Relation.DIFFERENCE.value
+        I = I[keep]; J = J[keep]; idc = idc[keep]; counts = counts[:,keep]
+        for r, rel in enumerate(PM_RELATIONS):
+            counts[r] += idc == rel.value
+    counts[PM_DIFF_REC] = kernel.idc_pairs(cols[0],I,J,rec=True) == Relation.DIFF_REC.value
+    return ConnectionGraph(n,I,J,classify(counts))
+
+def graph_from_pm(pm, layout, n):
+    ''' Returns the ConnectionGraph of the pairs of n rules classified from their pm (view of n rules with 'layout'),
+        tile by tile so that only the connected pairs are kept in memory
+    '''
+    rows, cols, codes = [], [], []
+    if layout.packed:
+        for start in range(0,pair_count(n),PACKED_TILE):
+            tile = classify(pm[:,start:start+PACKED_TILE])
+            idx = np.flatnonzero(tile != CODES[Connection.DISCONNECTED])
+            I, J = pair_rows(idx+start)
+            rows.append(I); cols.append(J); codes.append(tile[idx])
+    else:
+        for start in range(0,n,kernel.TILE):
+            tile = classify(pm[:,start:start+kernel.TILE,:])
+            I, J = np.nonzero(np.triu(tile != CODES[Connection.DISCONNECTED],k=start+1))
+            rows.append(I+start); cols.append(J); codes.append(tile[I,J])
+    if len(rows) == 0:
+        return ConnectionGraph(n,np.zeros(0,dtype=np.int64),np.zeros(0,dtype=np.int64),np.zeros(0,dtype=np.int8))
+    return ConnectionGraph(n,np.concatenate(rows).astype(np.int64),np.concatenate(cols).astype(np.int64),np.concatenate(codes))
+
+def components(graph, connections=None):
+    ''' Returns the component of every rule in the graph whose edges are the pairs of 'graph' (only the ones whose connection
+        is one of 'connections', a list of Connection, if given), each component being labelled by its smallest rule.
+        Union-find over all edges at once: the roots of the two rules of every edge are linked (the larger one under
+        the smaller one) and paths are compressed, the edges within a component being dropped at each round.
+        Near-linear: O((n+k) log n) in the worst case for k edges, a few rounds in practice.
+    '''
+    rows, cols = graph.rows, graph.cols
+    if connections is not None:
+        keep = np.isin(graph.codes,[CODES[c] for c in connections])
+        rows, cols = rows[keep], cols[keep]
+    parent = np.arange(graph.n)
+    while True:
+        #path compression: every rule points to its root
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand,parent):
+                break
+            parent = grand
+        a, b = parent[rows], parent[cols]
+        apart = a != b
+        if not apart.any():
+            return parent
+        rows, cols, a, b = rows[apart], cols[apart], a[apart], b[apart]
+        np.minimum.at(parent,np.maximum(a,b),np.minimum(a,b))
+
+class Cluster:
+    ''' Rules of one component of the connection graph
+        @rules: sorted array of rules
+        @recommendations: dictionnary {recommendation: number of rules of the cluster with it}
+    '''
+    def __init__(self, rules, recommendations):
+        self.rules = rules
+        self.recommendations = recommendations
+
+    @property
+    def size(self):
+        return len(self.rules)
+
+def clusters(graph, recs, connections=None, min_size=2):
+    ''' Returns the components (see components) of at least 'min_size' rules as a list of Cluster, largest first
+        @recs: CategoryColumn of the recommendations of the rules
+    '''
+    labels = components(graph,connections)
+    order = np.argsort(labels,kind='stable')
+    roots, starts, sizes = np.unique(labels[order],return_index=True,return_counts=True)
+    result = []
+    for k in np.flatnonzero(sizes >= min_size):
+        rules = order[starts[k]:starts[k]+sizes[k]]
+        codes, counts = np.unique(recs.codes[rules] if recs.kind == CATEGORY else np.full(len(rules),-1),return_counts=True)
+        result.append(Cluster(rules,{(recs.categories[c] if c >= 0 else float('nan')): int(count) for c, count in zip(codes,counts)}))
+    result.sort(key=lambda cluster: -cluster.size)
+    return result
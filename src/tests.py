@@ -3,9 +3,29 @@ import pandas as pd
 import numpy as np
 import collections as col
 import copy
+import os
+import tempfile
+import json
+import sys
+import subprocess
+import tracemalloc
 
 import parser
 import rule_set as rs
+import kernel
+import columns
+import layout
+import parallel
+import mapped
+import cache
+import rulefile
+import benchmark
+import profiling
+import cli
+import evaluate
+import sparse
+import redundancy
+import grid
 from relation import *
 from connection import *
 
@@ -68,12 +88,44 @@ class TestparserMethods(unittest.TestCase):
         #print(checked.set.sort_index(axis=1))
         self.assertTrue(checked.set.sort_index(axis=1).equals(ref.set.sort_index(axis=1)))
 
+def product_connection(p):
+    ''' Connection given by a product of IDC's (former representation of the PM, kept as reference for the tests) '''
+    if p == Relation.DIFFERENCE.value: return Connection.DISCONNECTED
+    elif p == Relation.EQUALITY.value : return Connection.EQUAL_SAME
+    elif p == -Relation.EQUALITY.value : return Connection.EQUAL_DIFF
+    elif p % Relation.OVERLAP.value == 0 and p > 0: return Connection.OVERLAP_SAME
+    elif p % Relation.OVERLAP.value == 0 and p < 0 : return Connection.OVERLAP_DIFF
+    elif p > 0: return Connection.INCLUSION_SAME
+    else: return Connection.INCLUSION_DIFF
+
+def pm_from_products(products):
+    ''' Returns PM counters giving the same connections as a matrix of products of IDC's '''
+    n = len(products)
+    pm = np.zeros((rs.PM_ROWS,n,n),dtype=rs.PM_DTYPE)
+    for i in range(n):
+        for j in range(i+1,n):
+            p = abs(products[i][j])
+            if p == 0:
+                pm[rs.PM_RELATIONS.index(Relation.DIFFERENCE),i,j] = 1
+            while p > 0 and p % Relation.INCLUSION_IJ.value == 0:
+                pm[rs.PM_RELATIONS.index(Relation.INCLUSION_IJ),i,j] += 1; p //= Relation.INCLUSION_IJ.value
+            while p > 0 and p % Relation.INCLUSION_JI.value == 0:
+                pm[rs.PM_RELATIONS.index(Relation.INCLUSION_JI),i,j] += 1; p //= Relation.INCLUSION_JI.value
+            pm[rs.PM_DIFF_REC,i,j] = products[i][j] < 0
+    return pm
+
 class TestMiniSet(unittest.TestCase):
     def setUp(self):
         self.csv_name = "data/RuleSetMini.csv"
         self.rules = parser.parse_csv(self.csv_name)
         self.ruleset = rs.RuleSet(self.rules)
 
+    def assertPM(self, ref_pm):
+        ''' Check that pm gives the connections encoded as products of IDC's in 'ref_pm' '''
+        for i in range(self.ruleset.n):
+            for j in range(i+1,self.ruleset.n):
+                self.assertEqual(self.ruleset.connection(i,j),product_connection(ref_pm[i][j]))
+
     def test_init(self):
         self.assertEqual(self.ruleset.m,len(self.rules[0]))
         self.assertEqual(self.ruleset.n,len(self.rules))
@@ -111,10 +163,11 @@ class TestMiniSet(unittest.TestCase):
                     self.assertEqual(checked[i,j,k],ref_IDM[i,j,k])
         #building pm with existing idm
         self.assertTrue(self.ruleset.build_PM())
-        checked = self.ruleset.pm
-        for i in range(b):
-            for j in range(c):
-                self.assertEqual(checked[i,j],ref_PM[i,j])
+        self.assertPM(ref_PM)
+        #counters of DIFFERENCE, INCLUSION_IJ, INCLUSION_JI, OVERLAP and different recommendations
+        self.assertEqual(self.ruleset.pm[:,0,1].tolist(),[0,2,1,0,1])
+        self.assertEqual(self.ruleset.pm[:,0,2].tolist(),[1,0,1,0,1])
+        self.assertEqual(self.ruleset.pm[:,1,2].tolist(),[0,1,2,0,0])
         
     def test_connection(self):
         #Warning, value hardcoded that would need to change if values changes in class Relation
@@ -122,7 +175,7 @@ class TestMiniSet(unittest.TestCase):
         dummy_pm1 = [[0, 1, -1],
                     [0, 0, 0],
                     [0, 0, 0]]
-        self.ruleset.pm = dummy_pm1
+        self.ruleset.pm = pm_from_products(dummy_pm1)
         self.assertEqual(self.ruleset.connection(0,0),Connection.REFERENCE)
         self.assertEqual(self.ruleset.connection(0,1),Connection.EQUAL_SAME)
         self.assertEqual(self.ruleset.connection(2,0),Connection.EQUAL_DIFF)
@@ -132,14 +185,14 @@ class TestMiniSet(unittest.TestCase):
         dummy_pm2 = [[0, -2, 4],
                     [0, 0, -66],
                     [0, 0, 0]]
-        self.ruleset.pm = dummy_pm2
+        self.ruleset.pm = pm_from_products(dummy_pm2)
         self.assertEqual(self.ruleset.connection(0,1),Connection.INCLUSION_DIFF)
         self.assertEqual(self.ruleset.connection(0,2),Connection.INCLUSION_SAME)
         self.assertEqual(self.ruleset.connection(2,1),Connection.OVERLAP_DIFF)
         dummy_pm3 = [[0, 9, -27],
                     [0, 0, 18],
                     [0, 0, 0]]
-        self.ruleset.pm = dummy_pm3
+        self.ruleset.pm = pm_from_products(dummy_pm3)
         self.assertEqual(self.ruleset.connection(1,0),Connection.INCLUSION_SAME)
         self.assertEqual(self.ruleset.connection(2,0),Connection.INCLUSION_DIFF)
         self.assertEqual(self.ruleset.connection(1,2),Connection.OVERLAP_SAME)
@@ -289,7 +342,7 @@ class TestMiniSet(unittest.TestCase):
         self.ruleset.build_IDM()
         self.ruleset.build_PM()
         ref_idm = copy.copy(self.ruleset.idm)
-        ref_pm = copy.copy(self.ruleset.pm)
+        ref_pm = np.prod(self.ruleset.idm,axis=0,dtype=np.float64) #products of the IDC's (former representation of the PM)
 
         self.ruleset.update_val(2,3,val2,update=False)
         self.assertEqual(self.ruleset.get_val(2,3),val2)
@@ -310,9 +363,7 @@ class TestMiniSet(unittest.TestCase):
             for i in range(self.ruleset.n):
                 for j in range(self.ruleset.n):
                     self.assertEqual(self.ruleset.idm[k,i,j],ref_idm[k,i,j])
-        for i in range(self.ruleset.n):
-            for j in range(self.ruleset.n):
-                self.assertEqual(self.ruleset.pm[i,j],ref_pm[i,j])
+        self.assertPM(ref_pm)
         
         self.ruleset.update_val(0,1,val1)
         ref_idm[1,0,1] = 1; ref_idm[1,0,2] = 2
@@ -326,9 +377,7 @@ class TestMiniSet(unittest.TestCase):
             for i in range(self.ruleset.n):
                 for j in range(self.ruleset.n):
                     self.assertEqual(self.ruleset.idm[k,i,j],ref_idm[k,i,j])
-        for i in range(self.ruleset.n):
-            for j in range(self.ruleset.n):
-                self.assertEqual(self.ruleset.pm[i,j],ref_pm[i,j])
+        self.assertPM(ref_pm)
         
         self.ruleset.update_val(1,3,val2)
         ref_idm[3,0,1] = 0; ref_idm[3,1,2] = 1
@@ -342,9 +391,7 @@ class TestMiniSet(unittest.TestCase):
             for i in range(self.ruleset.n):
                 for j in range(self.ruleset.n):
                     self.assertEqual(self.ruleset.idm[k,i,j],ref_idm[k,i,j])
-        for i in range(self.ruleset.n):
-            for j in range(self.ruleset.n):
-                self.assertEqual(self.ruleset.pm[i,j],ref_pm[i,j])
+        self.assertPM(ref_pm)
         
         self.ruleset.update_val(0,0,'rec2')
         self.ruleset.update_val(2,0,'rec1')
@@ -356,9 +403,7 @@ class TestMiniSet(unittest.TestCase):
             for i in range(self.ruleset.n):
                 for j in range(self.ruleset.n):
                     self.assertEqual(self.ruleset.idm[k,i,j],ref_idm[k,i,j])
-        for i in range(self.ruleset.n):
-            for j in range(self.ruleset.n):
-                self.assertEqual(self.ruleset.pm[i,j],ref_pm[i,j])
+        self.assertPM(ref_pm)
 
     def test_update_attr(self):
         new_attr = ['Recommendation', 'Attr1', 'Attr2', 'Attr3']
@@ -395,9 +440,7 @@ class TestMiniSet(unittest.TestCase):
             for i in range(self.ruleset.n):
                 for j in range(self.ruleset.n):
                     self.assertEqual(self.ruleset.idm[k,i,j],ref_idm[k][i][j])
-        for i in range(self.ruleset.n):
-            for j in range(self.ruleset.n):
-                self.assertEqual(self.ruleset.pm[i,j],ref_pm[i][j])
+        self.assertPM(ref_pm)
         
         self.ruleset.update_val(0,2,pd.Interval(25,200,'neither'))
         new_attr2 = 'New2'
@@ -419,9 +462,7 @@ class TestMiniSet(unittest.TestCase):
             for i in range(self.ruleset.n):
                 for j in range(self.ruleset.n):
                     self.assertEqual(self.ruleset.idm[k,i,j],ref_idm[k][i][j])
-        for i in range(self.ruleset.n):
-            for j in range(self.ruleset.n):
-                self.assertEqual(self.ruleset.pm[i,j],ref_pm[i][j])
+        self.assertPM(ref_pm)
 
         new_attr3 = 'New3'; attr_list = [1,2,3]
         ref_idm = [[[0,-1,-1],[0,0,1],[0,0,0]],[[0,3,3],[0,0,2],[0,0,0]],[[0,2,3],[0,0,3],[0,0,0]],[[0,2,1],[0,0,3],[0,0,0]],[[0,1,1],[0,0,1],[0,0,0]],[[0,2,3],[0,0,3],[0,0,0]],[[0,0,0],[0,0,0],[0,0,0]]]
@@ -441,9 +482,7 @@ class TestMiniSet(unittest.TestCase):
             for i in range(self.ruleset.n):
                 for j in range(self.ruleset.n):
                     self.assertEqual(self.ruleset.idm[k,i,j],ref_idm[k][i][j])
-        for i in range(self.ruleset.n):
-            for j in range(self.ruleset.n):
-                self.assertEqual(self.ruleset.pm[i,j],ref_pm[i][j])
+        self.assertPM(ref_pm)
 
         new_attr3 = 'New3'
         self.assertRaises(ValueError,self.ruleset.add_attr,new_attr3)
@@ -470,9 +509,7 @@ class TestMiniSet(unittest.TestCase):
             for i in range(self.ruleset.n):
                 for j in range(self.ruleset.n):
                     self.assertEqual(self.ruleset.idm[k,i,j],ref_idm[k][i][j])
-        for i in range(self.ruleset.n):
-            for j in range(self.ruleset.n):
-                self.assertEqual(self.ruleset.pm[i,j],ref_pm[i][j])
+        self.assertPM(ref_pm)
         
         rec_name2 = 'rec4'; new_vals = [pd.Interval(30,100),float('nan'),float('nan')]
         self.ruleset.add_rule(rec_name2, new_vals)
@@ -487,9 +524,7 @@ class TestMiniSet(unittest.TestCase):
             for i in range(self.ruleset.n):
                 for j in range(self.ruleset.n):
                     self.assertEqual(self.ruleset.idm[k,i,j],ref_idm[k][i][j])
-        for i in range(self.ruleset.n):
-            for j in range(self.ruleset.n):
-                self.assertEqual(self.ruleset.pm[i,j],ref_pm[i][j])
+        self.assertPM(ref_pm)
 
         rec_name3 = 'rec1'; new_vals = [float('nan'),pd.Interval(100,175),False]
         self.ruleset.add_rule(rec_name3, new_vals)
@@ -504,9 +539,7 @@ class TestMiniSet(unittest.TestCase):
             for i in range(self.ruleset.n):
                 for j in range(self.ruleset.n):
                     self.assertEqual(self.ruleset.idm[k,i,j],ref_idm[k][i][j])
-        for i in range(self.ruleset.n):
-            for j in range(self.ruleset.n):
-                self.assertEqual(self.ruleset.pm[i,j],ref_pm[i][j])
+        self.assertPM(ref_pm)
         
         self.assertRaises(ValueError,self.ruleset.add_rule,'hello',[3.0])
 
@@ -528,9 +561,7 @@ class TestMiniSet(unittest.TestCase):
             for i in range(self.ruleset.n):
                 for j in range(self.ruleset.n):
                     self.assertEqual(self.ruleset.idm[k,i,j],ref_idm[k][i][j])
-        for i in range(self.ruleset.n):
-            for j in range(self.ruleset.n):
-                self.assertEqual(self.ruleset.pm[i,j],ref_pm[i][j])
+        self.assertPM(ref_pm)
 
         del_attr2 = 'InCommunity'
         self.ruleset.delete_attr(del_attr2)
@@ -545,9 +576,7 @@ class TestMiniSet(unittest.TestCase):
             for i in range(self.ruleset.n):
                 for j in range(self.ruleset.n):
                     self.assertEqual(self.ruleset.idm[k,i,j],ref_idm[k][i][j])
-        for i in range(self.ruleset.n):
-            for j in range(self.ruleset.n):
-                self.assertEqual(self.ruleset.pm[i,j],ref_pm[i][j])
+        self.assertPM(ref_pm)
         
         del_attr3 = 'AvgNightCons'
         self.ruleset.delete_attr(1)
@@ -562,9 +591,7 @@ class TestMiniSet(unittest.TestCase):
             for i in range(self.ruleset.n):
                 for j in range(self.ruleset.n):
                     self.assertEqual(self.ruleset.idm[k,i,j],ref_idm[k][i][j])
-        for i in range(self.ruleset.n):
-            for j in range(self.ruleset.n):
-                self.assertEqual(self.ruleset.pm[i,j],ref_pm[i][j])
+        self.assertPM(ref_pm)
 
         self.assertRaises(ValueError,self.ruleset.delete_attr,2)
         self.assertRaises(ValueError,self.ruleset.delete_attr,'Hello')
@@ -591,9 +618,7 @@ class TestMiniSet(unittest.TestCase):
             for i in range(self.ruleset.n):
                 for j in range(self.ruleset.n):
                     self.assertEqual(self.ruleset.idm[k,i,j],ref_idm[k][i][j])
-        for i in range(self.ruleset.n):
-            for j in range(self.ruleset.n):
-                self.assertEqual(self.ruleset.pm[i,j],ref_pm[i][j])
+        self.assertPM(ref_pm)
 
         self.ruleset.delete_rule(1) #rule at the end
         ref_idm = [[[0],[0]],[[0],[0]],[[0],[0]],[[0],[0]]]
@@ -636,9 +661,7 @@ class TestMiniSet(unittest.TestCase):
             for i in range(self.ruleset.n):
                 for j in range(self.ruleset.n):
                     self.assertEqual(self.ruleset.idm[k,i,j],ref_idm[k][i][j])
-        for i in range(self.ruleset.n):
-            for j in range(self.ruleset.n):
-                self.assertEqual(self.ruleset.pm[i,j],ref_pm[i][j])
+        self.assertPM(ref_pm)
 
     def test_same_type(self):
         b1 = True; b2 = False; b1np = np.array([True]); b2np = np.array([False])
@@ -706,5 +729,1229 @@ class TestExtremeCases(unittest.TestCase):
         
 
 
+class TestKernel(unittest.TestCase):
+    def setUp(self):
+        #intervals sharing endpoints with every combination of closedness, plus unspecified values
+        closed = ['both','neither','left','right']
+        self.intervals = [pd.Interval(l,r,c) for (l,r) in [(1,6),(1,3),(3,6),(6,8),(1,10),(-np.inf,6),(2,4)] for c in closed]
+        self.intervals += [float('nan')]
+        self.ruleset = rs.RuleSet([])
+
+    def test_intervals_match_scalar(self):
+        col = columns.encode_column(self.intervals)
+        n = len(self.intervals)
+        I, J = np.meshgrid(np.arange(n),np.arange(n),indexing='ij')
+        checked = kernel.idc_pairs(col,I,J)
+        for i in range(n):
+            for j in range(n):
+                self.assertEqual(checked[i,j],self.ruleset._val_IDC(self.intervals[i],self.intervals[j]),msg=str(self.intervals[i])+" "+str(self.intervals[j]))
+
+    def test_other_kinds(self):
+        nan = float('nan')
+        bools = columns.encode_column([True,False,nan,True])
+        self.assertEqual(bools.kind,columns.BOOL)
+        self.assertEqual(kernel.idc_row(bools,0).tolist(),[0,0,2,1])
+        floats = columns.encode_column(np.array([3.4,nan,3.4]))
+        self.assertEqual(floats.kind,columns.NUMBER)
+        self.assertEqual(kernel.idc_row(floats,1).tolist(),[2,0,3])
+        recs = columns.encode_column(['rec1','rec2','rec1'])
+        self.assertEqual(kernel.idc_row(recs,0,rec=True).tolist(),[0,-1,1])
+        empty = columns.encode_column([nan,nan])
+        self.assertEqual(empty.kind,columns.EMPTY)
+        self.assertEqual(kernel.idc_row(empty,0).tolist(),[0,1])
+        self.assertRaises(TypeError,columns.encode_column,[3.4,pd.Interval(0,1)])
+        self.assertRaises(TypeError,columns.encode_column,[True,nan,1.0])
+
+    def test_upper_tiles(self):
+        col = columns.encode_column(self.intervals)
+        n = len(self.intervals)
+        ref = np.zeros((n,n)); checked = np.zeros((n,n))
+        kernel.idc_upper(col,ref)
+        kernel.idc_upper(col,checked,tile=3)
+        self.assertTrue(np.array_equal(ref,checked))
+        for i in range(n):
+            for j in range(n):
+                if j > i:
+                    self.assertEqual(ref[i,j],self.ruleset._val_IDC(self.intervals[i],self.intervals[j]))
+                else:
+                    self.assertEqual(ref[i,j],0)
+
+
+class TestColumnStore(unittest.TestCase):
+    def setUp(self):
+        self.ruleset = rs.RuleSet(parser.parse_csv("data/RuleSetSmall.csv"))
+
+    def test_kinds(self):
+        kinds = [col.kind for col in self.ruleset.store.cols]
+        self.assertEqual(kinds,[columns.CATEGORY,columns.INTERVAL,columns.INTERVAL,columns.INTERVAL,columns.INTERVAL,columns.BOOL])
+        self.assertEqual(self.ruleset.store.cols[5].values.dtype,np.int8)
+        self.assertEqual(self.ruleset.store.cols[1].left.dtype,np.float64)
+
+    def test_values(self):
+        self.assertEqual(self.ruleset.get_val(0,0),'Rec1')
+        self.assertEqual(self.ruleset.get_val(0,1),pd.Interval(0,50,'both'))
+        self.assertTrue(pd.isna(self.ruleset.get_val(0,3)))
+        self.assertIs(self.ruleset.get_val(1,5),True)
+        self.assertTrue(pd.isna(self.ruleset.get_val(3,5)))
+        self.assertEqual(self.ruleset.set['A'][4],pd.Interval(10,30,'both'))
+
+    def test_update_kind(self):
+        self.ruleset.update_val(0,1,float('nan'))
+        self.assertTrue(pd.isna(self.ruleset.get_val(0,1)))
+        self.assertRaises(TypeError,self.ruleset.update_val,0,1,True)
+        self.assertRaises(TypeError,self.ruleset.add_rule,'Rec5',[True,float('nan'),float('nan'),float('nan'),False])
+        self.assertEqual(self.ruleset.n,9)
+        #a column without values takes the kind of the first value given
+        self.ruleset.add_attr('F')
+        self.assertEqual(self.ruleset.store.cols[6].kind,columns.EMPTY)
+        self.ruleset.update_val(2,6,4.5)
+        self.assertEqual(self.ruleset.store.cols[6].kind,columns.NUMBER)
+        self.assertEqual(self.ruleset.get_val(2,'F'),4.5)
+
+    def test_to_csv(self):
+        file_name = "data/_test_store.csv"
+        try:
+            self.ruleset.to_csv(file_name)
+            checked = rs.RuleSet(parser.parse_csv(file_name))
+        finally:
+            os.remove(file_name)
+        self.assertTrue(checked.set.equals(self.ruleset.set))
+
+
+class TestPackedLayout(unittest.TestCase):
+    files = ["data/RuleSetMini.csv","data/RuleSetSmall.csv","data/RulesExample_bad_connections.csv","data/RulesExamples_good_connections.csv","data/all_colors_4.csv","data/mini_colors.csv","data/new_ruleset.csv"]
+
+    def assertSameConnections(self, checked, ref):
+        self.assertEqual(checked.n,ref.n)
+        for i in range(ref.n):
+            for j in range(ref.n):
+                self.assertEqual(checked.connection(i,j),ref.connection(i,j))
+
+    def build(self, ruleset):
+        ruleset.build_IDM()
+        ruleset.build_PM()
+        return ruleset
+
+    def test_pair_index(self):
+        idx = np.array([0,1,2,3,10,4999*5000//2-1,(1 << 40) + 12345])
+        I, J = layout.pair_rows(idx)
+        self.assertTrue((I < J).all())
+        self.assertTrue(np.array_equal(layout.pair_index(I,J),idx))
+        n = 7
+        self.assertEqual(sorted(layout.rule_pairs(n,3)[[0,1,2,4,5,6]].tolist()),sorted([layout.pair_index(min(i,3),max(i,3)) for i in range(n) if i != 3]))
+
+    def test_same_as_dense(self):
+        for file_name in self.files:
+            rules = parser.parse_csv(file_name)
+            dense = self.build(rs.RuleSet(rules))
+            packed = self.build(rs.RuleSet(rules,packed=True))
+            self.assertEqual(packed.idm.dtype,np.int8)
+            self.assertEqual(packed.idm.shape,(packed.m,packed.n*(packed.n-1)//2))
+            self.assertTrue(np.array_equal(packed.layout.to_dense(packed.idm,packed.n),dense.idm))
+            self.assertSameConnections(packed,dense)
+
+    def test_modifications(self):
+        rules = parser.parse_csv("data/RuleSetSmall.csv")
+        packed = self.build(rs.RuleSet(rules,packed=True))
+        packed.add_rule('Rec5',[pd.Interval(20,40),float('nan'),float('nan'),pd.Interval(0,20,'left'),True])
+        packed.update_val(2,1,pd.Interval(10,30,'both'))
+        packed.delete_rule(0)
+        packed.add_attr('F',[float(i % 2) for i in range(packed.n)])
+        packed.add_rule('Rec6')
+        packed.delete_rule(4)
+        packed.delete_attr('B')
+        ref = self.build(rs.RuleSet([packed.set.iloc[i].to_dict() for i in range(packed.n)]))
+        self.assertSameConnections(packed,ref)
+
+
+class TestPairMatrix(unittest.TestCase):
+    def test_many_attributes(self):
+        #the product of 2000 inclusions can't be represented exactly by a float
+        m = 2000
+        r1 = col.OrderedDict([('Rec','rec1')] + [('A'+str(k),pd.Interval(0,10)) for k in range(m)])
+        r2 = col.OrderedDict([('Rec','rec1')] + [('A'+str(k),pd.Interval(2,8)) for k in range(m)])
+        ruleset = rs.RuleSet([r1,r2])
+        ruleset.build_IDM()
+        ruleset.build_PM()
+        self.assertEqual(ruleset.connection(0,1),Connection.INCLUSION_SAME)
+        ruleset.update_val(1,m,pd.Interval(5,20))
+        self.assertEqual(ruleset.connection(0,1),Connection.OVERLAP_SAME)
+        ruleset.update_val(1,m,pd.Interval(20,30))
+        self.assertEqual(ruleset.connection(0,1),Connection.DISCONNECTED)
+        ruleset.update_val(1,m,pd.Interval(2,8))
+        self.assertEqual(ruleset.connection(0,1),Connection.INCLUSION_SAME)
+
+    def test_incremental_updates(self):
+        for packed in [False,True]:
+            ruleset = rs.RuleSet(parser.parse_csv("data/RuleSetSmall.csv"),packed=packed)
+            ruleset.build_IDM()
+            ruleset.build_PM()
+            ruleset.update_val(0,1,pd.Interval(0,40,'both'))
+            ruleset.update_val(3,0,'Rec1')
+            ruleset.update_val(8,3,float('nan'))
+            ruleset.add_rule('Rec2',[pd.Interval(0,50,'both'),float('nan'),float('nan'),float('nan'),True])
+            ruleset.add_attr('F',[float(i % 3) for i in range(ruleset.n)])
+            ruleset.update_val(2,6,float('nan'))
+            ruleset.delete_attr('C')
+            ruleset.delete_rule(4)
+            incremental = ruleset.pm.copy()
+            ruleset.build_PM()
+            self.assertTrue(np.array_equal(incremental,ruleset.pm))
+
+
+def random_rules(n, seed, wildcards=0.3):
+    ''' Returns a list of n random rules mixing intervals sharing endpoints, booleans, numbers and unspecified values '''
+    rng = np.random.default_rng(seed)
+    closed = ['both','neither','left','right']
+    rules = []
+    for i in range(n):
+        rule = col.OrderedDict({'Rec': 'rec'+str(rng.integers(3))})
+        for k in range(3):
+            left = float(rng.integers(10)); right = left + float(rng.integers(1,6))
+            rule['I'+str(k)] = pd.Interval(left,right,closed[rng.integers(4)])
+        rule['B'] = bool(rng.integers(2))
+        rule['F'] = float(rng.integers(3))
+        for key in list(rule)[1:]:
+            if rng.random() < wildcards:
+                rule[key] = float('nan')
+        rules.append(rule)
+    return rules
+
+class TestConnectionGraph(unittest.TestCase):
+    def assertSameConnections(self, graph, ruleset):
+        connected = 0
+        for i in range(ruleset.n):
+            for j in range(ruleset.n):
+                self.assertEqual(graph.connection(i,j),ruleset.connection(i,j))
+                if i < j and ruleset.connection(i,j) != Connection.DISCONNECTED:
+                    connected += 1
+        self.assertEqual(len(graph),connected)
+
+    def test_same_as_pm(self):
+        files = ["data/RuleSetMini.csv","data/RuleSetSmall.csv","data/RulesExample_bad_connections.csv","data/all_colors_4.csv","data/new_ruleset.csv"]
+        rulesets = [rs.RuleSet(parser.parse_csv(file_name)) for file_name in files]
+        rulesets += [rs.RuleSet(random_rules(60,seed)) for seed in range(3)]
+        for ruleset in rulesets:
+            graph = ruleset.connection_graph()
+            ruleset.build_IDM()
+            ruleset.build_PM()
+            self.assertSameConnections(graph,ruleset)
+
+    def test_neighbours(self):
+        ruleset = rs.RuleSet(parser.parse_csv("data/RuleSetSmall.csv"))
+        graph = ruleset.connection_graph()
+        rules, codes = graph.neighbours(0)
+        self.assertEqual(rules.tolist(),[2,3,4,5,6,7,8])
+        for rule, code in zip(rules,codes):
+            self.assertEqual(CONNECTIONS[code],graph.connection(rule,0))
+        self.assertEqual(graph.indptr[-1],2*len(graph))
+
+    def test_small_sets(self):
+        self.assertEqual(len(rs.RuleSet([]).connection_graph()),0)
+        ruleset = rs.RuleSet([{'Rec':'rec1'},{'Rec':'rec1'},{'Rec':'rec2'}])
+        graph = ruleset.connection_graph()
+        self.assertEqual(graph.connection(0,1),Connection.EQUAL_SAME)
+        self.assertEqual(graph.connection(2,0),Connection.EQUAL_DIFF)
+
+
+class TestConnectionsFor(unittest.TestCase):
+    def test_same_as_pm(self):
+        for ruleset in [rs.RuleSet(parser.parse_csv("data/RuleSetSmall.csv")),rs.RuleSet(random_rules(40,7))]:
+            direct = [ruleset.connections_for(ref) for ref in range(ruleset.n)]
+            self.assertEqual(len(ruleset.idm),0) #computed without the matrices
+            ruleset._references.clear()
+            ruleset.build_IDM()
+            ruleset.build_PM()
+            for ref in range(ruleset.n):
+                from_pm = ruleset.connections_for(ref)
+                self.assertTrue(np.array_equal(direct[ref],from_pm))
+                self.assertEqual([CONNECTIONS[c] for c in from_pm],[ruleset.connection(ref,i) for i in range(ruleset.n)])
+
+    def test_cache(self):
+        ruleset = rs.RuleSet(parser.parse_csv("data/RuleSetMini.csv"))
+        codes = ruleset.connections_for(0)
+        self.assertIs(ruleset.connections_for(0),codes)
+        self.assertRaises(ValueError,codes.__setitem__,1,0)
+        self.assertEqual(CONNECTIONS[codes[2]],Connection.DISCONNECTED)
+        ruleset.update_val(0,2,float('nan'))
+        self.assertIsNot(ruleset.connections_for(0),codes)
+        self.assertEqual(CONNECTIONS[ruleset.connections_for(0)[2]],Connection.INCLUSION_DIFF)
+        for ref in range(3):
+            ruleset.connections_for(ref)
+        self.assertLessEqual(len(ruleset._references),rs.REFERENCE_CACHE_SIZE)
+        self.assertRaises(ValueError,ruleset.connections_for,3)
+
+
+class TestConnectionMatrix(unittest.TestCase):
+    def test_same_as_connection(self):
+        rules = random_rules(50,3)
+        for packed in [False,True]:
+            ruleset = rs.RuleSet(rules,packed=packed)
+            self.assertRaises(ValueError,ruleset.connection_matrix)
+            ruleset.build_IDM()
+            ruleset.build_PM()
+            codes = ruleset.connection_matrix()
+            self.assertEqual(codes.dtype,np.int8)
+            for i in range(ruleset.n):
+                for j in range(ruleset.n):
+                    if packed and i < j:
+                        self.assertEqual(CONNECTIONS[codes[layout.pair_index(i,j)]],ruleset.connection(i,j))
+                    elif not packed:
+                        self.assertEqual(CONNECTIONS[codes[i,j]],ruleset.connection(i,j))
+
+    def test_helpers(self):
+        ruleset = rs.RuleSet(parser.parse_csv("data/RuleSetMini.csv"))
+        ruleset.build_IDM()
+        ruleset.build_PM()
+        codes = ruleset.connection_matrix()
+        counts = count_connections(codes)
+        self.assertEqual(counts[Connection.REFERENCE],3)
+        self.assertEqual(counts[Connection.OVERLAP_DIFF],2)
+        self.assertEqual(counts[Connection.OVERLAP_SAME],2)
+        self.assertEqual(counts[Connection.DISCONNECTED],2)
+        self.assertEqual(sum(counts.values()),9)
+        rows, cols = find_connections(codes,CONFLICTS)
+        self.assertEqual(list(zip(rows.tolist(),cols.tolist())),[(0,1),(1,0)])
+        self.assertEqual(find_connections(ruleset.connections_for(1),Connection.OVERLAP_SAME)[0].tolist(),[2])
+
+
+class TestGrowth(unittest.TestCase):
+    def test_add_rules(self):
+        rules = random_rules(80,11)
+        for packed in [False,True]:
+            ruleset = rs.RuleSet(rules[:2],packed=packed)
+            ruleset.build_IDM()
+            ruleset.build_PM()
+            buffers = set()
+            for rule in rules[2:]:
+                values = list(rule.values())
+                ruleset.add_rule(values[0],values[1:])
+                buffers.add(id(ruleset._idm))
+            self.assertLess(len(buffers),len(rules)//4) #buffers only reallocated when full
+            self.assertGreaterEqual(ruleset.layout.capacity(ruleset._idm),ruleset.n)
+            ref = rs.RuleSet(rules,packed=packed)
+            ref.build_IDM()
+            ref.build_PM()
+            self.assertTrue(np.array_equal(ruleset.idm,ref.idm))
+            self.assertTrue(np.array_equal(ruleset.pm,ref.pm))
+            ruleset.delete_rule(3)
+            ruleset.add_attr('G')
+            ruleset.add_rule('rec0')
+            idm = ruleset.idm.copy(); pm = ruleset.pm.copy()
+            ruleset.build_IDM()
+            ruleset.build_PM()
+            self.assertTrue(np.array_equal(idm,ruleset.idm))
+            self.assertTrue(np.array_equal(pm,ruleset.pm))
+
+    def test_column_capacity(self):
+        column = columns.encode_column([1.0,2.0])
+        for i in range(100):
+            column.append(float(i))
+        self.assertEqual(len(column),102)
+        self.assertLess(column.capacity,2*len(column))
+        self.assertEqual(column.values[-1],99.0)
+        self.assertEqual(column.take([0,101]).values.tolist(),[1.0,99.0])
+        self.assertRaises(TypeError,column.append,True)
+        self.assertEqual(len(column),102)
+
+
+
+class TestTombstones(unittest.TestCase):
+    def build(self, rules, packed):
+        ruleset = rs.RuleSet(rules,packed=packed)
+        ruleset.build_IDM()
+        ruleset.build_PM()
+        return ruleset
+
+    def assertSameConnections(self, checked, ref):
+        self.assertEqual(checked.n,ref.n)
+        for i in range(ref.n):
+            self.assertTrue(np.array_equal(checked.connections_for(i),ref.connections_for(i)))
+            for j in range(ref.n):
+                self.assertEqual(checked.connection(i,j),ref.connection(i,j))
+
+    def test_deferred_compaction(self):
+        rules = random_rules(40,5)
+        for packed in [False,True]:
+            ruleset = self.build(rules,packed)
+            remaining = list(rules)
+            for rule in [3,10,3,20,0]:
+                ruleset.delete_rule(rule)
+                del remaining[rule]
+            self.assertIsNotNone(ruleset._slots) #5 deleted rules out of 40, not compacted yet
+            self.assertEqual(ruleset.layout.capacity(ruleset._idm),40)
+            ruleset.update_val(4,2,pd.Interval(0,3,'both'))
+            remaining[4] = col.OrderedDict(remaining[4]); remaining[4]['I1'] = pd.Interval(0,3,'both')
+            ruleset.add_rule('rec1',[float('nan')]*5)
+            remaining.append(col.OrderedDict([('Rec','rec1')]+[(name,float('nan')) for name in list(rules[0])[1:]]))
+            ref = self.build(remaining,packed)
+            self.assertSameConnections(ruleset,ref)
+            self.assertEqual(ruleset.set.index.tolist(),list(range(ruleset.n)))
+            self.assertTrue(np.array_equal(ruleset.idm,ref.idm)) #accessing idm compacts it
+            self.assertIsNone(ruleset._slots)
+            self.assertTrue(np.array_equal(ruleset.pm,ref.pm))
+
+    def test_threshold(self):
+        ruleset = self.build(random_rules(20,6),False)
+        for i in range(int(rs.DELETED_FRACTION*20)):
+            ruleset.delete_rule(0)
+        self.assertIsNotNone(ruleset._slots)
+        ruleset.delete_rule(0)
+        self.assertIsNone(ruleset._slots)
+        self.assertEqual(ruleset._idm.shape,(ruleset.m,ruleset.n,ruleset.n))
+
+
+
+class TestTransaction(unittest.TestCase):
+    def build(self, rules):
+        ruleset = rs.RuleSet(rules)
+        ruleset.build_IDM()
+        ruleset.build_PM()
+        return ruleset
+
+    def test_commit(self):
+        rules = random_rules(30,8)
+        ruleset = self.build(rules)
+        before = ruleset.idm.copy()
+        with ruleset.transaction() as transaction:
+            ruleset.update_val(1,1,pd.Interval(0,4,'both'))
+            ruleset.update_val(1,1,pd.Interval(0,5,'both'))
+            ruleset.update_val(7,4,False)
+            idm = ruleset.idm.copy()
+            ruleset.add_rule('rec2',[float('nan')]*5)
+        self.assertEqual(transaction.touched,{(1,1),(7,4)})
+        self.assertTrue(np.array_equal(idm,before)) #refreshed on commit only
+        rules = [col.OrderedDict(rule) for rule in rules]
+        rules[1]['I0'] = pd.Interval(0,5,'both'); rules[7]['B'] = False
+        rules.append(col.OrderedDict([('Rec','rec2')]+[(name,float('nan')) for name in list(rules[0])[1:]]))
+        ref = self.build(rules)
+        self.assertTrue(np.array_equal(ruleset.idm,ref.idm))
+        self.assertTrue(np.array_equal(ruleset.pm,ref.pm))
+
+    def test_rollback(self):
+        ruleset = self.build(random_rules(30,9))
+        values = ruleset.set.copy()
+        idm = ruleset.idm.copy(); pm = ruleset.pm.copy()
+        transaction = ruleset.transaction()
+        ruleset.update_val(2,3,pd.Interval(1,2,'left'))
+        ruleset.update_attr(['Rec','J0','J1','J2','B','F'])
+        ruleset.add_rule('rec0',[float('nan')]*5)
+        ruleset.add_attr('G',[True]*ruleset.n)
+        ruleset.update_val(30,6,False)
+        self.assertRaises(ValueError,ruleset.delete_rule,0)
+        self.assertRaises(ValueError,ruleset.transaction)
+        transaction.rollback()
+        self.assertTrue(ruleset.set.equals(values))
+        self.assertEqual(ruleset.attr_names,list(values.columns))
+        self.assertTrue(np.array_equal(ruleset.idm,idm))
+        self.assertTrue(np.array_equal(ruleset.pm,pm))
+        self.assertRaises(ValueError,transaction.commit)
+
+    def test_exception(self):
+        ruleset = rs.RuleSet(parser.parse_csv("data/RuleSetMini.csv"))
+        ruleset.add_attr('E')
+        values = ruleset.set.copy()
+        try:
+            with ruleset.transaction():
+                ruleset.update_val(0,ruleset.m-1,3.0) #column without any value gets a type
+                ruleset.add_rule('Rec3',[float('nan')]*(ruleset.m-1))
+                ruleset.update_val(1,1,True)
+        except TypeError:
+            pass
+        self.assertTrue(ruleset.set.equals(values))
+        self.assertEqual(ruleset.store.cols[-1].kind,columns.EMPTY)
+        self.assertIsNone(ruleset._transaction)
+
+    def test_rollback_unspecified_column(self):
+        ruleset = self.build([{'Rec': 'a', 'X': 1.0, 'E': float('nan')},{'Rec': 'b', 'X': 2.0, 'E': float('nan')}])
+        values = ruleset.set.copy()
+        try:
+            with ruleset.transaction():
+                ruleset.add_rule('c',[3.0,float('nan')]) #extends the column of E without giving it a type
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual([len(c) for c in ruleset.store.cols],[2,2,2])
+        self.assertTrue(ruleset.set.equals(values))
+        ruleset.add_rule('c',[3.0,float('nan')])
+        self.assertEqual([len(c) for c in ruleset.store.cols],[3,3,3])
+
+
+
+class TestParallel(unittest.TestCase):
+    def test_tasks(self):
+        for n in [2,3,10,101]:
+            for workers in [1,3,8]:
+                packed = parallel.tasks(n,True,workers,tile=50)
+                self.assertEqual([p for start, stop in packed for p in range(start,stop)],list(range(n*(n-1)//2)))
+                dense = parallel.tasks(n,False,workers,tile=50)
+                self.assertEqual([i for start, stop in dense for i in range(start,stop)],list(range(n-1)))
+
+    def test_same_as_serial(self):
+        rules = random_rules(120,4)
+        for packed in [False,True]:
+            serial = rs.RuleSet(rules,packed=packed)
+            serial.build()
+            shared = rs.RuleSet(rules,packed=packed)
+            shared.build(workers=2)
+            self.assertEqual(shared.idm.dtype,np.int8)
+            self.assertTrue(np.array_equal(shared.idm,serial.idm))
+            self.assertTrue(np.array_equal(shared.pm,serial.pm))
+            shared.add_rule('rec1',[float('nan')]*5)
+            serial.add_rule('rec1',[float('nan')]*5)
+            self.assertTrue(np.array_equal(shared.pm,serial.pm))
+        self.assertRaises(ValueError,parallel.build,serial.store.cols,serial.layout,serial.n,0)
+
+    def test_without_shared_memory(self):
+        #python 3.7 has no multiprocessing.shared_memory, a rule set must still be built with one worker
+        code = ("import sys; sys.modules['multiprocessing.shared_memory'] = None; import rule_set; "
+                "r = rule_set.RuleSet([{'Rec': 'rec1', 'A': 1.0}, {'Rec': 'rec1', 'A': 2.0}]); r.build(workers=1); print(r.pm.sum())")
+        result = subprocess.run([sys.executable,'-c',code],capture_output=True,text=True,cwd=os.path.dirname(os.path.abspath(parallel.__file__)))
+        self.assertEqual(result.returncode,0,result.stderr)
+
+
+
+class TestMapped(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_same_as_memory(self):
+        rules = random_rules(60,12)
+        for packed in [False,True]:
+            directory = os.path.join(self.tmp.name,str(packed))
+            ruleset = rs.RuleSet(rules,packed=packed,directory=directory)
+            ruleset.build()
+            ref = rs.RuleSet(rules,packed=packed)
+            ref.build()
+            self.assertIsInstance(ruleset._idm,np.memmap)
+            for r in [ruleset,ref]:
+                r.update_val(3,2,float('nan'))
+                r.add_rule('rec1',[pd.Interval(0,2),float('nan'),float('nan'),True,1.0])
+                r.delete_rule(10)
+                r.add_attr('G',[float(i % 3) for i in range(r.n)])
+                r.delete_attr(1)
+            self.assertIsInstance(ruleset._idm,np.memmap)
+            self.assertIsInstance(ruleset._pm,np.memmap)
+            self.assertEqual(ruleset.connection(0,5),ref.connection(0,5))
+            self.assertTrue(np.array_equal(ruleset.idm,ref.idm))
+            self.assertTrue(np.array_equal(ruleset.pm,ref.pm))
+            self.assertLessEqual(len(os.listdir(directory)),4) #two files per matrix at most
+
+    def test_storage(self):
+        #each allocation has its own file, the ones of a name are deleted when the second next one is allocated
+        storage = mapped.Storage(os.path.join(self.tmp.name,'storage'))
+        a = storage.alloc('idm',(2,3),np.int8)
+        a[...] = 1
+        b = storage.alloc('idm',(4,),np.int8)
+        self.assertEqual((a.shape,b.shape,b.sum()),((2,3),(4,),0))
+        self.assertNotEqual(a.filename,b.filename)
+        self.assertTrue(os.path.exists(a.filename))
+        storage.alloc('idm',(1,),np.int8)
+        self.assertFalse(os.path.exists(a.filename))
+        self.assertEqual(a.sum(),6) #still mapped
+        self.assertTrue(os.path.exists(b.filename))
+
+    def test_tiles(self):
+        #the layers are processed by tiles of rows so that mapped matrices are never copied whole in memory
+        n = 23
+        for lay in [layout.DENSE,layout.PACKED]:
+            a = np.arange(np.prod(lay.shape(n))).reshape(lay.shape(n))
+            covered = np.zeros(lay.shape(n),dtype=int)
+            for rows, pairs in lay.tiles(n,tile=50):
+                covered[rows] += pairs
+            expected = np.triu(np.ones((n,n),dtype=int),k=1) if not lay.packed else np.ones(lay.shape(n),dtype=int)
+            self.assertTrue(np.array_equal(covered,expected))
+            rules = np.array([0,2,3,7,11,20,22])
+            out = np.zeros(lay.shape(len(rules)),dtype=a.dtype)
+            lay.select(a,rules,out=out,tile=5)
+            self.assertTrue(np.array_equal(out,lay.select(a,rules)))
+
+    def test_resume(self):
+        rules = random_rules(50,13)
+        directory = self.tmp.name
+        ruleset = rs.RuleSet(rules,directory=directory)
+        fill_task = parallel.fill_task
+        calls = []
+        def interrupted(*args):
+            if len(calls) == 3:
+                raise KeyboardInterrupt()
+            calls.append(args[-1])
+            fill_task(*args)
+        parallel.fill_task = interrupted
+        try:
+            self.assertRaises(KeyboardInterrupt,ruleset.storage.build,ruleset.store.cols,ruleset.layout,ruleset.n,1,100)
+        finally:
+            parallel.fill_task = fill_task
+        self.assertTrue(os.path.exists(os.path.join(directory,'build.json')))
+        done = []
+        parallel.fill_task = lambda *args: (done.append(args[-1]), fill_task(*args))
+        try:
+            idm, pm = ruleset.storage.build(ruleset.store.cols,ruleset.layout,ruleset.n,1,100)
+        finally:
+            parallel.fill_task = fill_task
+        self.assertEqual(len(calls)+len(done),len(parallel.tasks(ruleset.n,False,1,100)))
+        self.assertFalse(set(calls) & set(done))
+        self.assertFalse(os.path.exists(os.path.join(directory,'build.json')))
+        ref = rs.RuleSet(rules)
+        ref.build()
+        self.assertTrue(np.array_equal(idm,ref.idm))
+        self.assertTrue(np.array_equal(pm,ref.pm))
+
+    def test_rebuild(self):
+        #a new build writes new files, the matrices of the previous one stay valid while they are mapped
+        ruleset = rs.RuleSet(random_rules(40,14),directory=self.tmp.name)
+        ruleset.build(workers=2)
+        idm, pm = ruleset._idm, ruleset._pm
+        before = np.array(idm), np.array(pm)
+        other = rs.RuleSet(random_rules(30,15))
+        new_idm, new_pm = ruleset.storage.build(other.store.cols,other.layout,other.n)
+        self.assertNotEqual(new_idm.filename,idm.filename)
+        self.assertTrue(np.array_equal(idm,before[0]))
+        self.assertTrue(np.array_equal(pm,before[1]))
+        other.build()
+        self.assertTrue(np.array_equal(new_idm,other.idm))
+        self.assertTrue(np.array_equal(new_pm,other.pm))
+
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_hit(self):
+        rules = random_rules(40,14)
+        matrices = cache.Cache(self.tmp.name)
+        ruleset = rs.RuleSet(rules)
+        ruleset.build(cache=matrices)
+        self.assertEqual(len(os.listdir(self.tmp.name)),1)
+        reopened = rs.RuleSet(rules)
+        reopened.build_IDM = None #must not be computed again
+        reopened.build(cache=matrices)
+        self.assertTrue(np.array_equal(reopened.idm,ruleset.idm))
+        self.assertTrue(np.array_equal(reopened.pm,ruleset.pm))
+        reopened.update_val(0,1,float('nan')) #loaded matrices can be modified
+        ruleset.update_val(0,1,float('nan'))
+        self.assertTrue(np.array_equal(reopened.pm,ruleset.pm))
+        #other values, layout or names of attributes
+        self.assertNotEqual(matrices.key(ruleset.store.cols,False),matrices.key(rs.RuleSet(rules[1:]).store.cols,False))
+        self.assertNotEqual(matrices.key(ruleset.store.cols,False),matrices.key(ruleset.store.cols,True))
+        ruleset.update_attr(['Rec','A','B','C','D','E'])
+        self.assertEqual(matrices.key(ruleset.store.cols,False),matrices.key(reopened.store.cols,False))
+
+    def test_version_and_size(self):
+        matrices = cache.Cache(self.tmp.name)
+        for seed in range(3):
+            rs.RuleSet(random_rules(30,seed)).build(cache=matrices)
+            os.utime(matrices.path(matrices.key(rs.RuleSet(random_rules(30,seed)).store.cols,False)),(seed,seed))
+        sizes = sorted(os.path.getsize(os.path.join(self.tmp.name,f)) for f in os.listdir(self.tmp.name))
+        small = cache.Cache(self.tmp.name,max_bytes=sum(sizes)-1)
+        small.evict()
+        self.assertEqual(len(os.listdir(self.tmp.name)),2)
+        self.assertIsNone(small.get(small.key(rs.RuleSet(random_rules(30,0)).store.cols,False))) #least recently used
+        #files that aren't named like the ones of the cache are never deleted
+        others = ['saved.npz','v1-matrices.npz']
+        for file_name in others:
+            np.savez(os.path.join(self.tmp.name,file_name),a=np.zeros(1 << 16))
+        cache.Cache(self.tmp.name,max_bytes=0).evict()
+        self.assertEqual(sorted(os.listdir(self.tmp.name)),others)
+        rs.RuleSet(random_rules(30,0)).build(cache=matrices)
+        version = cache.SEMANTICS_VERSION
+        cache.SEMANTICS_VERSION = version + 1
+        try:
+            cache.Cache(self.tmp.name)
+        finally:
+            cache.SEMANTICS_VERSION = version
+        self.assertEqual(sorted(os.listdir(self.tmp.name)),others)
+
+
+
+class TestColumnParser(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, text):
+        csv_name = os.path.join(self.tmp.name,'rules.csv')
+        with open(csv_name,'w') as f:
+            f.write(text)
+        return csv_name
+
+    def assertSameRules(self, csv_name):
+        ref = rs.RuleSet(parser.parse_csv(csv_name))
+        checked = rs.RuleSet.from_store(parser.parse_columns(csv_name))
+        self.assertEqual(checked.attr_names,ref.attr_names)
+        self.assertEqual([c.kind for c in checked.store.cols],[c.kind for c in ref.store.cols])
+        self.assertTrue(checked.set.equals(ref.set))
+
+    def test_data_files(self):
+        for file_name in sorted(os.listdir("data")):
+            self.assertSameRules(os.path.join("data",file_name))
+
+    def test_formats(self):
+        csv_name = self.write('Rec,A,B,C,D,E\n'
+                              'r1,"[0.0, 1.5)",true,1e3,*,nan\n'
+                              'r2,"]2,3[",FALSE,*, nan,\n'
+                              'r1,*,,-inf,,NaN\n'
+                              ',"(-1.0, 4.0]",True,7,*,*\n')
+        self.assertSameRules(csv_name)
+        store = parser.parse_columns(csv_name)
+        self.assertEqual([c.kind for c in store.cols],[columns.CATEGORY,columns.INTERVAL,columns.BOOL,columns.NUMBER,columns.EMPTY,columns.EMPTY])
+        self.assertEqual(store.get(1,1),pd.Interval(2.0,3.0,'neither'))
+        self.assertEqual(store.get(3,0),'')
+
+    def test_errors(self):
+        self.assertRaises(TypeError,parser.parse_columns,self.write('Rec,A\nr1,1.0\nr2,true\n'))
+        self.assertRaises(ValueError,parser.parse_columns,self.write('Rec,A\nr1,"[1.0, x)"\n'))
+        self.assertRaises(ValueError,parser.parse_columns,self.write('Rec,A\nr1,one\n'))
+        self.assertEqual(rs.RuleSet.from_store(parser.parse_columns(self.write('Rec,A\n'))).n,0)
+        #same first error as parse_csv when a column mixing kinds comes before a value that can't be parsed
+        for text in ['Rec,A,B\nr1,1.0,2.0\nr2,true,x\n','Rec,A,B,C\nr1,1.0,2.0,y\nr2,true,x,3.0\n','Rec,A,B\nr1,1.0,2.0\nr2,true,3.0\n']:
+            csv_name = self.write(text)
+            with self.assertRaises((TypeError,ValueError)) as ref:
+                rs.RuleSet(parser.parse_csv(csv_name))
+            with self.assertRaises(type(ref.exception)) as checked:
+                parser.parse_columns(csv_name)
+            self.assertEqual(str(checked.exception),str(ref.exception))
+
+class TestChunks(unittest.TestCase):
+    def assertSameSet(self, checked, ref):
+        self.assertEqual(checked.attr_names,ref.attr_names)
+        self.assertTrue(checked.set.equals(ref.set))
+        self.assertTrue(np.array_equal(checked.idm,ref.idm))
+        self.assertTrue(np.array_equal(checked.pm,ref.pm))
+
+    def test_rule_chunks(self):
+        rules = random_rules(83,5,wildcards=0.6)
+        for packed in [False,True]:
+            ref = rs.RuleSet(rules,packed=packed)
+            ref.build()
+            chunks = (rules[i:i+10] for i in range(0,len(rules),10))
+            self.assertSameSet(rs.RuleSet.from_chunks(chunks,packed=packed),ref)
+
+    def test_csv_chunks(self):
+        for file_name in sorted(os.listdir("data")):
+            csv_name = os.path.join("data",file_name)
+            ref = rs.RuleSet.from_store(parser.parse_columns(csv_name))
+            ref.build()
+            self.assertSameSet(rs.RuleSet.from_chunks(parser.read_chunks(csv_name,chunk_rows=3)),ref)
+
+    def test_add_rules(self):
+        rules = random_rules(40,6)
+        ruleset = rs.RuleSet(rules[:25],packed=True)
+        ruleset.build()
+        ruleset.delete_rule(3)
+        ruleset.add_rules(rules[25:])
+        ref = rs.RuleSet(rules[:3]+rules[4:],packed=True)
+        ref.build()
+        self.assertSameSet(ruleset,ref)
+        self.assertRaises(ValueError,ruleset.add_rules,[{'Rec':'rec0','X':1.0}])
+        self.assertRaises(TypeError,ruleset.add_rules,[{'Rec':'rec0','B':2.0}])
+        self.assertEqual(ruleset.n,39)
+        with ruleset.transaction():
+            self.assertRaises(ValueError,ruleset.add_rules,rules[:2])
+
+    def test_prefetch(self):
+        self.assertEqual(list(parser.prefetch(range(5))),list(range(5)))
+        def failing():
+            yield 1
+            raise ValueError("bad chunk")
+        self.assertRaises(ValueError,list,parser.prefetch(failing()))
+
+class TestRuleFile(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self.tmp.name,'rules'+rulefile.EXTENSION)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip(self):
+        for packed in [False,True]:
+            ruleset = rs.RuleSet(random_rules(60,7),packed=packed)
+            ruleset.build()
+            ruleset.delete_rule(5)
+            ruleset.save(self.file_name)
+            loaded = rs.RuleSet.load(self.file_name)
+            self.assertEqual(loaded.layout.packed,packed)
+            self.assertEqual(loaded.attr_names,ruleset.attr_names)
+            self.assertEqual([c.kind for c in loaded.store.cols],[c.kind for c in ruleset.store.cols])
+            self.assertTrue(loaded.set.equals(ruleset.set))
+            self.assertIsInstance(loaded.store.cols[1].left,np.memmap)
+            self.assertTrue(np.array_equal(loaded.idm,ruleset.idm))
+            self.assertTrue(np.array_equal(loaded.pm,ruleset.pm))
+            #the arrays are copied on write, the file is unchanged
+            loaded.update_val(0,5,2.0)
+            loaded.add_rule('rec9',[float('nan')]*5)
+            ruleset.update_val(0,5,2.0)
+            ruleset.add_rule('rec9',[float('nan')]*5)
+            self.assertTrue(np.array_equal(loaded.pm,ruleset.pm))
+            self.assertEqual(rs.RuleSet.load(self.file_name).n,59)
+            #saving over the file the rule set is mapped from
+            loaded.save(self.file_name,matrices=False)
+            reloaded = rs.RuleSet.load(self.file_name)
+            self.assertTrue(reloaded.set.equals(ruleset.set))
+            self.assertEqual(len(reloaded.idm),0)
+
+    def test_loaded_operations(self):
+        #operations on a loaded rule set before its idm or pm are read
+        for packed in [False,True]:
+            ruleset = rs.RuleSet(random_rules(40,27),packed=packed)
+            ruleset.build()
+            ruleset.save(self.file_name)
+            loaded = rs.RuleSet.load(self.file_name)
+            self.assertTrue(np.array_equal(loaded.connections_for(3),ruleset.connections_for(3)))
+            for r in [loaded,ruleset]:
+                r.update_val(1,5,2.0)
+                r.add_rule('rec9',[float('nan')]*5)
+                r.delete_rule(7)
+            self.assertTrue(np.array_equal(loaded.connections_for(0),ruleset.connections_for(0)))
+            self.assertTrue(np.array_equal(loaded.pm,ruleset.pm))
+
+    def test_data_files(self):
+        for file_name in sorted(os.listdir("data")):
+            ruleset = rs.RuleSet.from_store(parser.parse_columns(os.path.join("data",file_name)))
+            ruleset.save(self.file_name)
+            self.assertTrue(rs.RuleSet.load(self.file_name).set.equals(ruleset.set))
+
+    def test_errors(self):
+        with open(self.file_name,'w') as f:
+            f.write('Rec,A\nr1,1.0\n')
+        self.assertRaises(ValueError,rs.RuleSet.load,self.file_name)
+        rs.RuleSet([]).save(self.file_name)
+        self.assertEqual(rs.RuleSet.load(self.file_name).n,0)
+
+class TestBenchmark(unittest.TestCase):
+    def test_generate(self):
+        rules = benchmark.generate(50,m=5,wildcards=0.0,width='exponential',booleans=0.5,numbers=0.5,recs=2,seed=3)
+        ruleset = rs.RuleSet(rules)
+        self.assertEqual((ruleset.n,ruleset.m),(50,5))
+        self.assertTrue(set(ruleset.set['Rec']) <= {'rec0','rec1'})
+        self.assertTrue(all(c.kind in (columns.BOOL,columns.NUMBER) for c in ruleset.store.cols[1:]))
+        self.assertFalse(ruleset.set.iloc[:,1:].isna().any().any())
+        self.assertRaises(ValueError,benchmark.generate,5,width='normal')
+
+    def test_report(self):
+        report = benchmark.run_benchmark([20],calls=5,repeat=1,m=4)
+        self.assertEqual([r['operation'] for r in report['results']],
+                         ['to_csv','parse_csv','parse_columns','build_IDM','build_PM','connection','add_rule','delete_rule','update_val'])
+        self.assertTrue(all(r['peak_bytes'] > 0 for r in report['results'] if r['operation'] != 'connection'))
+        json.dumps(report)
+        slower = copy.deepcopy(report)
+        slower['results'][3]['seconds'] = 2*report['results'][3]['seconds'] + 1
+        self.assertEqual(benchmark.compare(report,slower),[(20,'build_IDM',report['results'][3]['seconds'],slower['results'][3]['seconds'])])
+        self.assertEqual(benchmark.compare(slower,report),[])
+
+class TestProfiling(unittest.TestCase):
+    def tearDown(self):
+        profiling.disable()
+
+    def test_stats(self):
+        rules = random_rules(30,8)
+        profiling.enable()
+        ruleset = rs.RuleSet(rules)
+        ruleset.build()
+        ruleset.update_val(2,1,float('nan'))
+        ruleset.delete_rule(0)
+        stats = profiling.stats()
+        for name in ['RuleSet.build','RuleSet.build_IDM','RuleSet.build_PM','RuleSet.update_val','RuleSet.delete_rule']:
+            self.assertEqual(stats[name]['calls'],1)
+        self.assertEqual(stats['RuleSet.update_idm']['calls'],1)
+        for name in ruleset.attr_names:
+            self.assertEqual(stats['RuleSet.build_IDM/'+name]['calls'],1)
+        self.assertGreaterEqual(stats['RuleSet.build_IDM']['bytes'],30*30*len(ruleset.attr_names))
+        self.assertGreaterEqual(stats['RuleSet.build']['seconds'],stats['RuleSet.build_IDM']['seconds'])
+        with tempfile.TemporaryDirectory() as directory:
+            file_name = os.path.join(directory,'profile.json')
+            profiling.dump(file_name)
+            with open(file_name) as f:
+                self.assertEqual(json.load(f),stats)
+        profiling.disable()
+        ruleset.build()
+        self.assertEqual(profiling.stats(),stats)
+        profiling.enable(memory=False)
+        parser.parse_csv("data/RuleSetMini.csv")
+        self.assertEqual(profiling.stats(),{'parser.parse_csv': {'calls': 1, 'seconds': profiling.stats()['parser.parse_csv']['seconds'], 'bytes': None}})
+
+    def test_without_reset_peak(self):
+        #tracemalloc.reset_peak is missing before Python 3.9, tracing is restarted instead
+        reset_peak = getattr(tracemalloc,'reset_peak',None)
+        if reset_peak is not None:
+            del tracemalloc.reset_peak
+        try:
+            profiling.enable()
+            with profiling.section('outer'):
+                kept = np.ones(1 << 20,dtype=np.uint8)
+                with profiling.section('inner'):
+                    temporary = np.ones(1 << 21,dtype=np.uint8)
+                    del temporary
+            stats = profiling.stats()
+            self.assertGreaterEqual(stats['inner']['bytes'],1 << 21)
+            self.assertGreaterEqual(stats['outer']['bytes'],(1 << 21) + (1 << 20))
+        finally:
+            if reset_peak is not None:
+                tracemalloc.reset_peak = reset_peak
+
+class TestCli(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_engines(self):
+        csv_name = os.path.join(self.tmp.name,'rules.csv')
+        ruleset = rs.RuleSet(random_rules(70,9))
+        ruleset.to_csv(csv_name)
+        ruleset.build()
+        codes = ruleset.connection_matrix()
+        for engine in ['dense','packed','mapped','sparse']:
+            output = os.path.join(self.tmp.name,engine)
+            self.assertEqual(cli.main([csv_name,'--engine',engine,'--output',output,'--format','binary','--reports','counts','conflicts','matrix']),0)
+            self.assertTrue(np.array_equal(np.load(os.path.join(output,'rules.matrix.npy')),codes))
+            pairs = np.load(os.path.join(output,'rules.conflicts.npy'))
+            upper = np.triu(np.isin(codes,[CODES[c] for c in CONFLICTS]),k=1)
+            self.assertEqual(list(zip(pairs['rule1'],pairs['rule2'])),list(zip(*np.nonzero(upper))))
+            counts = np.load(os.path.join(output,'rules.counts.npy'))
+            self.assertEqual(counts[4].tolist(),[int(np.sum(codes[4] == CODES[c])) for c in cli.COUNTED])
+        #auto: the matrices don't fit in the memory limit but their files fit on the disk
+        output = os.path.join(self.tmp.name,'auto')
+        self.assertEqual(cli.main([csv_name,'--memory-limit','1K','--output',output,'--format','binary','--reports','matrix']),0)
+        self.assertTrue(np.array_equal(np.load(os.path.join(output,'rules.matrix.npy')),codes))
+        with open(os.path.join(output,'rules.summary.json')) as f:
+            self.assertEqual(json.load(f)['engine'],'mapped')
+        self.assertEqual(cli.main([csv_name,'--output',self.tmp.name,'--format','jsonl','--reports','counts']),0)
+        with open(os.path.join(self.tmp.name,'rules.counts.jsonl')) as f:
+            self.assertEqual(len(f.readlines()),70)
+
+    def test_options(self):
+        self.assertEqual(cli.parse_size('512M'),512 << 20)
+        self.assertEqual(cli.parse_size('1.5k'),1536)
+        self.assertRaises(ValueError,cli.parse_size,'lots')
+        self.assertEqual(cli.choose_engine('auto',1000,6),'dense')
+        self.assertEqual(cli.choose_engine('auto',1000,6,cli.matrices_bytes(layout.PACKED,1000,6)),'packed')
+        self.assertEqual(cli.choose_engine('auto',1000,6,1 << 20),'sparse')
+        self.assertEqual(cli.choose_engine('auto',1000,6,1 << 20,disk=1 << 40),'mapped')
+        self.assertEqual(cli.choose_engine('auto',10**6,6,disk=1 << 50),'mapped') #more than the available memory
+        self.assertEqual(cli.choose_engine('auto',10**6,6,disk=1 << 20),'sparse')
+        self.assertGreater(cli.available_memory(),0)
+        self.assertGreater(cli.free_disk(os.path.join(self.tmp.name,'not','yet')),0)
+        self.assertRaises(ValueError,cli.choose_engine,'dense',1000,6,1 << 20)
+        self.assertEqual(cli.main([os.path.join(self.tmp.name,'missing.csv'),'--output',self.tmp.name]),1)
+
+    def test_no_gui(self):
+        code = "import sys; import cli; print('PySimpleGUI' in sys.modules or 'gui' in sys.modules)"
+        result = subprocess.run([sys.executable,'-c',code],capture_output=True,text=True,cwd=os.path.dirname(os.path.abspath(cli.__file__)))
+        self.assertEqual(result.stdout.strip(),'False')
+
+class TestQuery(unittest.TestCase):
+    def brute_force(self, ruleset, values):
+        rules = []
+        for rule in range(ruleset.n):
+            ok = True
+            for name, x in values.items():
+                val = ruleset.get_val(rule,name)
+                if isinstance(val,pd.Interval):
+                    ok = ok and x in val
+                elif not columns.is_na(val):
+                    ok = ok and val == x
+            if ok:
+                rules.append(rule)
+        return rules
+
+    def observations(self, rng, count):
+        for k in range(count):
+            values = {'I'+str(j): float(rng.integers(0,30))/2 for j in range(3) if rng.random() < 0.7}
+            if rng.random() < 0.5:
+                values['B'] = bool(rng.integers(2))
+            if rng.random() < 0.5:
+                values['F'] = float(rng.integers(3))
+            yield values
+
+    def assertMatches(self, ruleset, rng, count=40):
+        for values in self.observations(rng,count):
+            self.assertEqual(ruleset.match(values).tolist(),self.brute_force(ruleset,values))
+
+    def test_match(self):
+        rng = np.random.default_rng(10)
+        rules = random_rules(150,11)
+        ruleset = rs.RuleSet(rules)
+        self.assertMatches(ruleset,rng)
+        self.assertEqual(ruleset.match({}).tolist(),list(range(150)))
+        self.assertEqual(ruleset.match({'I0': float('nan')}).tolist(),list(range(150)))
+
+    def test_consistency(self):
+        rng = np.random.default_rng(12)
+        rules = random_rules(400,13)
+        ruleset = rs.RuleSet(rules[:300])
+        self.assertMatches(ruleset,rng,10)
+        for k in range(300,400):
+            ruleset.add_rule(rules[k]['Rec'],list(rules[k].values())[1:])
+            if k % 10 == 0:
+                self.assertMatches(ruleset,rng,5)
+        for k in range(60):
+            rule = int(rng.integers(ruleset.n))
+            ruleset.update_val(rule,1,pd.Interval(float(k % 9),float(k % 9)+2.0,'left'),update=False)
+            ruleset.update_val(rule,4,float('nan'),update=False)
+            if k % 10 == 0:
+                self.assertMatches(ruleset,rng,5)
+        for k in range(50):
+            ruleset.delete_rule(int(rng.integers(ruleset.n)))
+            if k % 10 == 0:
+                self.assertMatches(ruleset,rng,5)
+        self.assertMatches(ruleset,rng)
+        ruleset.delete_attr('I1')
+        self.assertEqual(ruleset.match({'B': True}).tolist(),self.brute_force(ruleset,{'B': True}))
+
+    def test_errors(self):
+        ruleset = rs.RuleSet(random_rules(20,14))
+        self.assertRaises(ValueError,ruleset.match,{'X': 1.0})
+        self.assertRaises(ValueError,ruleset.match,{'Rec': 'rec0'})
+        self.assertRaises(TypeError,ruleset.match,{'I0': True})
+        self.assertRaises(TypeError,ruleset.match,{'B': 1.0})
+
+class TestEvaluate(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.csv_name = os.path.join(self.tmp.name,'records.csv')
+        self.ruleset = rs.RuleSet(random_rules(60,15))
+        rng = np.random.default_rng(16)
+        self.records = []
+        with open(self.csv_name,'w') as f:
+            f.write('id,I0,I1,I2,B,F\n')
+            for k in range(230):
+                values = {'I'+str(j): float(rng.integers(0,30))/2 for j in range(3) if rng.random() < 0.8}
+                if rng.random() < 0.7:
+                    values['B'] = bool(rng.integers(2))
+                if rng.random() < 0.7:
+                    values['F'] = float(rng.integers(3))
+                self.records.append(values)
+                cells = [str(values[name]) if name in values else ('*' if k % 2 else '') for name in ['I0','I1','I2','B','F']]
+                f.write(','.join(['r'+str(k)]+cells)+'\n')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_evaluate(self):
+        matches = [set(self.ruleset.match(values).tolist()) for values in self.records]
+        bitsets = os.path.join(self.tmp.name,'fired.bits')
+        for workers in [1,2]:
+            result = evaluate.evaluate(self.ruleset,self.csv_name,chunk_rows=50,workers=workers,bitsets=bitsets)
+            self.assertEqual(result.records,230)
+            self.assertEqual(result.coverage.tolist(),[sum(r in m for m in matches) for r in range(60)])
+            expected = {}
+            for m in matches:
+                for r1 in m:
+                    for r2 in m:
+                        if r1 < r2:
+                            expected[(r1,r2)] = expected.get((r1,r2),0) + 1
+            self.assertEqual(dict(zip(zip(result.rows.tolist(),result.cols.tolist()),result.counts.tolist())),expected)
+            bits = np.unpackbits(np.fromfile(bitsets,dtype=np.uint8).reshape(230,-1),axis=1)[:,:60]
+            self.assertEqual([set(np.flatnonzero(row).tolist()) for row in bits],matches)
+        cells = evaluate.CELLS
+        try:
+            evaluate.CELLS = 7 #records and pairs processed in many small tiles
+            small = evaluate.evaluate(self.ruleset,self.csv_name,chunk_rows=50)
+        finally:
+            evaluate.CELLS = cells
+        self.assertTrue(np.array_equal(small.coverage,result.coverage))
+        self.assertTrue(np.array_equal(small.counts,result.counts))
+
+    def test_errors(self):
+        with open(self.csv_name,'w') as f:
+            f.write('I0,B\n1.0,2.0\n')
+        self.assertRaises(TypeError,evaluate.evaluate,self.ruleset,self.csv_name)
+        with open(self.csv_name,'w') as f:
+            f.write('')
+        self.assertEqual(evaluate.evaluate(self.ruleset,self.csv_name).records,0)
+
+class TestClusters(unittest.TestCase):
+    def brute_force(self, codes, allowed):
+        n = len(codes)
+        labels = [-1]*n
+        for start in range(n):
+            if labels[start] < 0:
+                labels[start] = start
+                todo = [start]
+                while todo:
+                    rule = todo.pop()
+                    for other in np.flatnonzero(np.isin(codes[rule],allowed)):
+                        if labels[other] < 0:
+                            labels[other] = start
+                            todo.append(other)
+        return labels
+
+    def test_components(self):
+        for wildcards in [0.05,0.3]:
+            ruleset = rs.RuleSet(random_rules(120,17,wildcards=wildcards))
+            graph = ruleset.connection_graph()
+            ruleset.build()
+            codes = ruleset.connection_matrix()
+            connected = [CODES[c] for c in CONNECTIONS if c not in (Connection.DISCONNECTED,Connection.REFERENCE,Connection.ERROR)]
+            self.assertEqual(sparse.components(graph).tolist(),self.brute_force(codes,connected))
+            self.assertEqual(sparse.components(graph,CONFLICTS).tolist(),self.brute_force(codes,[CODES[c] for c in CONFLICTS]))
+
+    def test_clusters(self):
+        ruleset = rs.RuleSet(random_rules(90,18,wildcards=0.05))
+        from_graph = ruleset.clusters(conflicts=True,min_size=1)
+        ruleset.build()
+        from_pm = ruleset.clusters(conflicts=True,min_size=1)
+        self.assertEqual([c.rules.tolist() for c in from_graph],[c.rules.tolist() for c in from_pm])
+        self.assertEqual(sum(c.size for c in from_pm),90)
+        self.assertEqual([c.size for c in from_pm],sorted([c.size for c in from_pm],reverse=True))
+        for cluster in from_pm:
+            recs = col.Counter(ruleset.get_val(int(rule),0) for rule in cluster.rules)
+            self.assertEqual(cluster.recommendations,dict(recs))
+        self.assertTrue(all(c.size >= 3 for c in ruleset.clusters(min_size=3)))
+        self.assertEqual(rs.RuleSet([]).clusters(),[])
+
+    def test_report(self):
+        with tempfile.TemporaryDirectory() as directory:
+            csv_name = os.path.join(directory,'rules.csv')
+            ruleset = rs.RuleSet(random_rules(50,19,wildcards=0.05))
+            ruleset.to_csv(csv_name)
+            self.assertEqual(cli.main([csv_name,'--output',directory,'--reports','clusters','--format','binary']),0)
+            labels = np.load(os.path.join(directory,'rules.clusters.npy'))
+            for k, cluster in enumerate(ruleset.clusters(conflicts=True)):
+                self.assertEqual(np.flatnonzero(labels == k).tolist(),cluster.rules.tolist())
+
+class TestRedundancy(unittest.TestCase):
+    def brute_force(self, ruleset):
+        ruleset.build()
+        codes = ruleset.connection_matrix()
+        pm = ruleset.pm
+        pairs = set()
+        for i in range(ruleset.n):
+            for j in range(i+1,ruleset.n):
+                if codes[i,j] == CODES[Connection.EQUAL_SAME]:
+                    pairs.add((j,i,True))
+                elif codes[i,j] == CODES[Connection.INCLUSION_SAME]:
+                    pairs.add((i,j,False) if pm[PM_RELATIONS.index(Relation.INCLUSION_IJ),i,j] > 0 else (j,i,False))
+        return pairs
+
+    def test_subsumptions(self):
+        for seed, wildcards in [(20,0.05),(21,0.3),(22,0.6)]:
+            rules = random_rules(100,seed,wildcards)
+            rules += [col.OrderedDict(rule) for rule in rules[:10]] #duplicates
+            ruleset = rs.RuleSet(rules)
+            subsumed = ruleset.subsumptions()
+            self.assertEqual(set(zip(subsumed.rules.tolist(),subsumed.by.tolist(),subsumed.equal.tolist())),self.brute_force(ruleset))
+            self.assertTrue(set(range(100,110)) <= set(subsumed.redundant.tolist()))
+        self.assertEqual(len(rs.RuleSet([]).subsumptions()),0)
+
+    def test_pruned(self):
+        rules = [{'Rec': 'a', 'X': pd.Interval(0,10,'both'), 'B': True},
+                 {'Rec': 'a', 'X': pd.Interval(2,5,'both'), 'B': True}, #within rule 0
+                 {'Rec': 'b', 'X': pd.Interval(2,5,'both'), 'B': True}, #other recommendation
+                 {'Rec': 'a', 'X': pd.Interval(0,10,'both'), 'B': True}, #equal to rule 0
+                 {'Rec': 'a', 'X': pd.Interval(2,5,'both'), 'B': float('nan')}, #includes rule 1
+                 {'Rec': float('nan'), 'X': pd.Interval(2,5,'both'), 'B': True}]
+        ruleset = rs.RuleSet(rules,packed=True)
+        subsumed = ruleset.subsumptions()
+        self.assertEqual(list(zip(subsumed.rules.tolist(),subsumed.by.tolist(),subsumed.equal.tolist())),
+                         [(1,0,False),(1,3,False),(1,4,False),(3,0,True)])
+        self.assertEqual(subsumed.redundant.tolist(),[1,3])
+        self.assertEqual(subsumed.kept.tolist(),[True,False,True,False,True,True])
+        store = redundancy.pruned_store(ruleset.store,subsumed)
+        self.assertEqual((store.n,store.names),(4,ruleset.store.names))
+        pruned = ruleset.pruned()
+        self.assertTrue(pruned.layout.packed)
+        self.assertEqual([pruned.get_val(r,0) for r in range(3)],['a','b','a'])
+        self.assertTrue(pd.isna(pruned.get_val(3,0)) and pd.isna(pruned.get_val(2,'B')))
+        self.assertEqual(len(pruned.subsumptions()),0)
+
+    def test_report(self):
+        with tempfile.TemporaryDirectory() as directory:
+            csv_name = os.path.join(directory,'rules.csv')
+            rules = random_rules(60,23,wildcards=0.5)
+            ruleset = rs.RuleSet(rules+rules[:5])
+            ruleset.to_csv(csv_name)
+            self.assertEqual(cli.main([csv_name,'--output',directory,'--reports','redundancy','counts','--format','binary','--prune']),0)
+            subsumed = ruleset.subsumptions()
+            pairs = np.load(os.path.join(directory,'rules.redundancy.npy'))
+            self.assertEqual(pairs['rule'].tolist(),subsumed.rules.tolist())
+            self.assertEqual(pairs['by'].tolist(),subsumed.by.tolist())
+            pruned = rs.RuleSet.load(os.path.join(directory,'rules.pruned.rset'))
+            self.assertEqual(pruned.n,ruleset.n-len(subsumed.redundant))
+            self.assertEqual(len(np.load(os.path.join(directory,'rules.counts.npy'))),pruned.n)
+            with open(os.path.join(directory,'rules.summary.json')) as f:
+                self.assertEqual(json.load(f)['redundant'],len(subsumed.redundant))
+            #mapped: the pruned rule set has its own files, next to the ones of the whole rule set
+            counts = np.load(os.path.join(directory,'rules.counts.npy'))
+            output, mapped_dir = os.path.join(directory,'mapped'), os.path.join(directory,'matrices')
+            self.assertEqual(cli.main([csv_name,'--output',output,'--reports','counts','--format','binary','--prune',
+                                       '--engine','mapped','--directory',mapped_dir]),0)
+            self.assertTrue(np.array_equal(np.load(os.path.join(output,'rules.counts.npy')),counts))
+            self.assertTrue(os.path.isdir(os.path.join(mapped_dir,'pruned')))
+
+class TestGrid(unittest.TestCase):
+    def test_viewport(self):
+        ruleset = rs.RuleSet(random_rules(1000,24))
+        table = grid.Grid(rows=5,cols=3)
+        self.assertEqual(table.size(ruleset),(1003,9))
+        table.scroll(ruleset,top=500,left=2)
+        view = table.changes(ruleset)
+        self.assertEqual(len(view),3+5*5)
+        self.assertEqual(view[(grid.HEADER,0)],'I1')
+        self.assertEqual(view[('label',0)],'500')
+        self.assertEqual(view[(1,1)],grid.text(ruleset.get_val(501,3)))
+        self.assertEqual(table.changes(ruleset),{})
+        table.scroll(ruleset,top=10**6,left=-4)
+        self.assertEqual((table.top,table.left),(998,0))
+        table.codes = ruleset.connections_for(999)
+        self.assertEqual(table.changes(ruleset)[('connection',1)],Connection.REFERENCE.value)
+        self.assertEqual(table.changes(ruleset),{})
+        self.assertEqual(table.view(ruleset)[('label',4)],'1002')
+
+    def test_edits(self):
+        ruleset = rs.RuleSet(random_rules(100,25))
+        table = grid.Grid(rows=4,cols=3)
+        values = table.view(ruleset)
+        table.changes(ruleset)
+        values[(0,1)] = '[0.0, 1.0]'
+        values[(grid.HEADER,2)] = 'New'
+        table.read(ruleset,values)
+        self.assertEqual(table.edits,{(0,1): '[0.0, 1.0]',(grid.HEADER,2): 'New'})
+        table.scroll(ruleset,top=50)
+        self.assertEqual(table.changes(ruleset)[(0,1)],grid.text(ruleset.get_val(50,1)))
+        table.scroll(ruleset,top=0)
+        self.assertEqual(table.changes(ruleset)[(0,1)],'[0.0, 1.0]')
+        self.assertEqual(table.values(ruleset)[(0,1)],'[0.0, 1.0]')
+        self.assertEqual(table.values(ruleset)[(1,0)],ruleset.get_val(1,0))
+        #typing the value of the rule set back removes the edit
+        values = table.view(ruleset)
+        values[(0,1)] = grid.text(ruleset.get_val(0,1))
+        table.read(ruleset,values)
+        self.assertEqual(table.edits,{(grid.HEADER,2): 'New'})
+        self.assertEqual(grid.text(True),'True')
+        self.assertEqual(grid.text(float('nan')),'')
+
+    def test_repaint(self):
+        ruleset = rs.RuleSet(random_rules(200,26))
+        table = grid.Grid(rows=10,cols=3)
+        self.assertEqual(set(table.repaint(ruleset).values()),{Connection.DISCONNECTED})
+        self.assertEqual(table.repaint(ruleset),{})
+        table.codes = ruleset.connections_for(3)
+        changed = table.repaint(ruleset)
+        expected = {r: CONNECTIONS[code] for r, code in enumerate(table.codes[:10]) if CONNECTIONS[code] != Connection.DISCONNECTED}
+        self.assertEqual(changed,expected)
+        #only the rows whose connection differs between the two reference rules are painted again
+        old = table.codes
+        table.codes = ruleset.connections_for(4)
+        self.assertEqual(sorted(table.repaint(ruleset)),[r for r in range(10) if old[r] != table.codes[r]])
+        table.scroll(ruleset,top=100)
+        self.assertEqual(sorted(table.repaint(ruleset)),[r for r in range(10) if table.codes[r] != table.codes[100+r]])
+        table.codes = None
+        self.assertEqual(set(table.repaint(ruleset).values()),{Connection.DISCONNECTED})
+
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file